@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Receive throughput of the event loops `flowproc.runtime` offers
+
+A sender process blasts NetFlow V9 export packets (a template first, then
+data packets of RECORDS records each) at a listener running on each event
+loop in turn. The listener either just counts datagrams ("receive") or
+decodes them like testlistener does inline ("decode"). Reported are the
+datagrams per second received and the share lost, e.g.
+
+    python benchmarks/bench_loops.py -n 200000 --mode receive decode
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import struct
+import sys
+import time
+
+from flowproc import runtime
+from flowproc import v9_parser
+from flowproc.dispatch import Dispatcher
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+RECORDS = 30
+TEMPLATE = (8, 4, 12, 4, 7, 2, 11, 2, 4, 1, 1, 4, 2, 4, 21, 4, 22, 4)
+IDLE = 0.5  # seconds without datagrams that end a run
+
+
+def packets():
+    """
+    Return template packet and data packet
+    """
+    fields = struct.pack("!" + "H" * len(TEMPLATE), *TEMPLATE)
+    tset = struct.pack("!HHH", 0, 8 + len(fields), 256)
+    tset += struct.pack("!H", len(TEMPLATE) // 2) + fields
+    record = struct.pack(
+        "!IIHHBIIII", 0xC0000201, 0xC6336401, 443, 51234, 6, 1500, 3, 1, 2
+    )
+    dset = struct.pack("!HH", 256, 4 + RECORDS * len(record))
+    dset += record * RECORDS
+
+    def header(count, seq):
+        return struct.pack("!HHIIII", 9, count, 1000, int(time.time()), seq, 0)
+
+    return header(1, 0) + tset, header(RECORDS, 1) + dset
+
+
+def send(port, count):
+    """
+    Send the template, then count data packets to port on localhost
+    """
+    template, data = packets()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(("127.0.0.1", port))
+    sock.send(template)
+    time.sleep(0.1)
+    for i in range(count):
+        sock.send(data)
+        if i % 256 == 255:
+            time.sleep(0)  # yield, the receiver is on the same host
+    sock.close()
+
+
+async def listen(mode, count):
+    """
+    Receive until count datagrams arrived or none for a while
+
+    Return:
+        (received, seconds from first to last)
+    """
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    dispatcher = Dispatcher()
+    parse = dispatcher.parse_packet
+    stats = {"received": 0, "first": None, "last": None}
+
+    class Counting(asyncio.DatagramProtocol):
+        def datagram_received(self, datagram, addr):
+            now = time.perf_counter()
+            if stats["first"] is None:
+                stats["first"] = now
+            stats["last"] = now
+            stats["received"] += 1
+            if mode == "decode":
+                parse(datagram, addr[0])
+            if stats["received"] > count and not done.done():
+                done.set_result(None)
+
+    transport, _ = await loop.create_datagram_endpoint(
+        Counting, local_addr=("127.0.0.1", 0)
+    )
+    sock = transport.get_extra_info("socket")
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2 ** 23)
+    port = sock.getsockname()[1]
+
+    sender = multiprocessing.Process(target=send, args=(port, count))
+    sender.start()
+    seen = -1
+    while not done.done() and seen != stats["received"]:
+        seen = stats["received"]
+        try:
+            await asyncio.wait_for(asyncio.shield(done), IDLE)
+        except asyncio.TimeoutError:
+            pass
+    sender.join()
+    transport.close()
+    return stats["received"] - 1, (stats["last"] or 0) - (stats["first"] or 0)
+
+
+def parse_args(args):
+    """
+    Parse command line parameters
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare receive throughput of event loops"
+    )
+    parser.add_argument(
+        "-n",
+        dest="count",
+        help="data packets to send per run (default 100000)",
+        type=int,
+        default=100000,
+    )
+    parser.add_argument(
+        "--loop",
+        dest="loops",
+        help="event loops to compare (default all available)",
+        nargs="+",
+        choices=runtime.LOOPS[:2],
+        default=runtime.available(),
+    )
+    parser.add_argument(
+        "--mode",
+        dest="modes",
+        help="what to do per datagram (default receive and decode)",
+        nargs="+",
+        choices=("receive", "decode"),
+        default=["receive", "decode"],
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Main entry point allowing external calls
+    """
+    args = parse_args(args)
+    v9_parser.output = lambda ipa, records: None
+    print(
+        "{:<8} {:<8} {:>10} {:>12} {:>7}".format(
+            "loop", "mode", "received", "packets/s", "lost"
+        )
+    )
+    for mode in args.modes:
+        for loop in args.loops:
+            received, seconds = runtime.run(listen(mode, args.count), loop)
+            print(
+                "{:<8} {:<8} {:>10d} {:>12.0f} {:>6.1f}%".format(
+                    loop,
+                    mode,
+                    received,
+                    received / seconds if seconds else 0,
+                    100 * (1 - received / args.count),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Startup time of the command line tools
+
+Each command runs in a fresh interpreter RUNS times, reported are the
+fastest and the median wall time. "python" is the bare interpreter, to
+subtract; "testreader" processes a small capture file (a template and a
+few data packets), as the short-lived batch jobs do, e.g.
+
+    python benchmarks/bench_startup.py -n 20 --importtime
+
+With `--importtime`, the modules taking longest to import for testreader
+get listed (from `python -X importtime`).
+"""
+
+import argparse
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+RECORDS = 30
+TEMPLATE = (8, 4, 12, 4, 7, 2, 11, 2, 4, 1, 1, 4, 2, 4, 21, 4, 22, 4)
+COMMANDS = {
+    "python": ["-c", "pass"],
+    "import flowproc": ["-c", "import flowproc"],
+    "import parsers": ["-c", "import flowproc.dispatch as d; d.Dispatcher()"],
+    "testreader -V": ["-m", "flowproc.testreader", "-V"],
+    "testreader": ["-m", "flowproc.testreader", "{capture}"],
+    "testlistener -h": ["-m", "flowproc.testlistener", "-h"],
+}
+
+
+def capture(path, packets=5):
+    """
+    Write a NetFlow V9 template packet and data packets to path
+    """
+    fields = struct.pack("!" + "H" * len(TEMPLATE), *TEMPLATE)
+    tset = struct.pack("!HHH", 0, 8 + len(fields), 256)
+    tset += struct.pack("!H", len(TEMPLATE) // 2) + fields
+    record = struct.pack(
+        "!IIHHBIIII", 0xC0000201, 0xC6336401, 443, 51234, 6, 1500, 3, 1, 2
+    )
+    dset = struct.pack("!HH", 256, 4 + RECORDS * len(record))
+    dset += record * RECORDS
+
+    def header(count, seq):
+        return struct.pack("!HHIIII", 9, count, 1000, int(time.time()), seq, 0)
+
+    with open(path, "wb") as fh:
+        fh.write(header(1, 0) + tset)
+        for seq in range(1, packets + 1):
+            fh.write(header(RECORDS, seq) + dset)
+
+
+def timed(argv, env):
+    """
+    Return wall time in seconds to run argv to completion
+    """
+    start = time.perf_counter()
+    subprocess.run(
+        argv,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def importtime(argv, env, top=15):
+    """
+    Print the top modules by cumulative import time for argv
+    """
+    argv = [argv[0], "-X", "importtime"] + argv[1:]
+    result = subprocess.run(
+        argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    rows = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), int(self_us), name.rstrip()))
+    print("\n{:>10} {:>10}  module".format("cum (ms)", "self (ms)"))
+    for cumulative, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(
+            "{:>10.1f} {:>10.1f}  {}".format(
+                cumulative / 1000, self_us / 1000, name
+            )
+        )
+
+
+def parse_args(args):
+    """
+    Parse command line parameters
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure startup time of flowproc command line tools"
+    )
+    parser.add_argument(
+        "-n",
+        dest="runs",
+        help="runs per command (default 10)",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--command",
+        dest="commands",
+        help="commands to time (default all)",
+        nargs="+",
+        choices=list(COMMANDS),
+        default=list(COMMANDS),
+    )
+    parser.add_argument(
+        "--importtime",
+        help="list the slowest imports of testreader",
+        action="store_true",
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Main entry point allowing external calls
+    """
+    args = parse_args(args)
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(__file__), os.pardir, "src")
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (os.path.abspath(src), env.get("PYTHONPATH")) if p
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "capture.v9")
+        capture(path)
+        print("{:<18} {:>10} {:>10}".format("command", "min (ms)", "med (ms)"))
+        for name in args.commands:
+            argv = [sys.executable] + [
+                a.format(capture=path) for a in COMMANDS[name]
+            ]
+            timed(argv, env)  # warm up caches, compile bytecode
+            times = [timed(argv, env) for _ in range(args.runs)]
+            print(
+                "{:<18} {:>10.1f} {:>10.1f}".format(
+                    name,
+                    min(times) * 1000,
+                    statistics.median(times) * 1000,
+                )
+            )
+        if args.importtime:
+            importtime(
+                [sys.executable, "-m", "flowproc.testreader", path], env
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -5,20 +5,29 @@ tbd
 
 import logging
 
-from pkg_resources import DistributionNotFound
-from pkg_resources import get_distribution
-
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
 __license__ = "mit"
 
 logger = logging.getLogger(__name__)
 
-# retrieve version info
-try:
-    dist_name = __name__
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = "unknown"
-finally:
-    del get_distribution, DistributionNotFound
+
+def __getattr__(name):
+    """
+    Look up `__version__` on first access - `importlib.metadata` takes a
+    while to import, most imports of the package don't need the version
+    """
+    global __version__
+    if name != "__version__":
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        )
+    # retrieve version info
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version
+
+    try:
+        __version__ = version(__name__)
+    except PackageNotFoundError:
+        __version__ = "unknown"
+    return __version__
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Reprocess many capture files in parallel
+
+Capture files (raw NetFlow V9 as `testreader` reads them) get parsed in a
+pool of processes, one file per task. The exporter of a file is told by
+the directory holding it - archives kept like `<exporter address>/<file>` -
+files elsewhere count as exported by "0.0.0.0".
+
+Exporters send templates every so often, so the Data FlowSets of one file
+may need templates sent in an earlier one. Before any of its files get
+parsed, all files of an exporter get scanned in name order for templates
+only (Data FlowSets are skipped, not read), snapshotting the template state
+at the start of each file (see `flowproc.persist.dump_exporter`). Each file
+then gets parsed in whatever process, seeded with its snapshot.
+
+Workers write to the sink a `flowproc.config.Config` describes, flow store
+segments tagged by process, and return their counters, which get summed.
+"""
+
+import glob
+import ipaddress
+import logging
+import os
+import struct
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+from flowproc import config
+from flowproc import persist
+from flowproc import v9_parser
+from flowproc.collector_state import Collector
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+DEFAULT_EXPORTER = "0.0.0.0"
+
+
+def is_batch(spec):
+    """
+    Return `True` if spec names a directory or is a glob pattern
+    """
+    return os.path.isdir(spec) or any(c in spec for c in "*?[")
+
+
+def captures(spec):
+    """
+    Return sorted paths of the files in directory spec (recursively) or
+    matching glob pattern spec
+    """
+    if os.path.isdir(spec):
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(spec)
+            for name in names
+        ]
+    else:
+        paths = glob.glob(spec, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p))
+
+
+def exporter_of(path):
+    """
+    Return exporter address for capture file path: the name of the
+    directory holding it if that's an address, else `DEFAULT_EXPORTER`
+    """
+    name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    try:
+        ipaddress.ip_address(name)
+    except ValueError:
+        return DEFAULT_EXPORTER
+    return name
+
+
+def _counters():
+    return {
+        "packets": Collector.packets,
+        "count": Collector.count,
+        "record_count": Collector.record_count,
+    }
+
+
+def _check_version(fh):
+    ver = struct.unpack("!H", fh.read(2))[0]
+    fh.seek(0)  # reset
+    if ver != 9:
+        raise ValueError("Not equipped to parse ver {:d}".format(ver))
+
+
+def scan(ipa, paths):
+    """
+    Responsibility: find the template state at the start of each file
+
+    Args:
+        ipa     `str`: exporter address
+        paths   [`str`]: capture files of exporter ipa, in order
+
+    Return:
+        `list` of `persist.dump_exporter` snapshots, one per path
+    """
+    Collector.unregister(ipa)  # worker processes get reused
+    seeds = []
+    for path in paths:
+        seeds.append(persist.dump_exporter(ipa))
+        try:
+            with open(path, "rb") as fh:
+                _check_version(fh)
+                v9_parser.parse_file(fh, ipa, templates_only=True)
+        except Exception as e:
+            # its data gets skipped by `process`, templates so far count
+            logger.error("Scanning %s for templates failed: %r", path, e)
+    Collector.unregister(ipa)
+    return seeds
+
+
+def process(path, ipa, seed, settings):
+    """
+    Responsibility: parse one capture file into the configured sink
+
+    Args:
+        path        `str`: capture file
+        ipa         `str`: exporter address
+        seed        templates as `scan` returns them for path
+        settings    `dict`: `flowproc.config.Config` keyword arguments
+
+    Return:
+        `dict` of counters
+    """
+    Collector.unregister(ipa)
+    seeded = persist.load_exporter(ipa, seed)
+    conf = config.Config(**settings)
+    conf.build(v9_parser, tag="{:d}".format(os.getpid()))
+    conf.apply(v9_parser)
+    before = _counters()
+    try:
+        with open(path, "rb") as fh:
+            _check_version(fh)
+            v9_parser.parse_file(fh, ipa)
+    finally:
+        conf.close()
+        Collector.unregister(ipa)
+    after = _counters()
+
+    stats = {k: after[k] - before[k] for k in after}
+    stats["files"] = 1
+    stats["seeded"] = seeded
+    stats["pipeline"] = conf.pipeline.stats()
+    return stats
+
+
+def merge_stats(total, stats):
+    """
+    Return total with stats added: numbers summed, `dict` and `list`
+    merged item by item, anything else kept as first seen
+    """
+    if isinstance(stats, dict):
+        total = dict(total or {})
+        for key, value in stats.items():
+            total[key] = merge_stats(total.get(key), value)
+        return total
+    if isinstance(stats, list):
+        total = list(total or [])
+        merged = [
+            merge_stats(total[i] if i < len(total) else None, value)
+            for i, value in enumerate(stats)
+        ]
+        return merged + total[len(stats) :]
+    if isinstance(stats, (int, float)) and not isinstance(stats, bool):
+        return (total or 0) + stats
+    return stats if total is None else total
+
+
+def run(spec, settings, jobs=None):
+    """
+    Process capture files in directory or glob pattern spec in a pool of
+    jobs processes (default: a process per CPU)
+
+    Args:
+        spec        `str`: directory or glob pattern
+        settings    `dict`: `flowproc.config.Config` keyword arguments
+
+    Return:
+        `dict` of counters, summed over all files
+    """
+    files = {}  # exporter -> [path]
+    for path in captures(spec):
+        files.setdefault(exporter_of(path), []).append(path)
+    conf = config.Config(**settings)
+    conf.build(v9_parser)  # fail early, not per file
+    conf.close()
+
+    totals = {"files": 0, "failed": 0, "exporters": len(files)}
+    with ProcessPoolExecutor(jobs) as pool:
+        scans = {
+            pool.submit(scan, ipa, paths): ipa for ipa, paths in files.items()
+        }
+        tasks = {}
+        # files of an exporter get parsed as soon as it's scanned
+        for future in as_completed(scans):
+            ipa = scans[future]
+            try:
+                seeds = future.result()
+            except Exception as e:
+                logger.error("Scanning %s failed: %r", ipa, e)
+                seeds = [{}] * len(files[ipa])
+            for path, seed in zip(files[ipa], seeds):
+                task = pool.submit(process, path, ipa, seed, settings)
+                tasks[task] = path
+
+        for future in as_completed(tasks):
+            try:
+                totals = merge_stats(totals, future.result())
+            except Exception as e:
+                totals["failed"] += 1
+                logger.error("Processing %s failed: %r", tasks[future], e)
+
+    pipeline = totals.get("pipeline")
+    if pipeline and pipeline["seconds"]:
+        # per process, seconds are summed over workers
+        pipeline["records_per_sec"] = round(
+            pipeline["records"] / pipeline["seconds"]
+        )
+    return totals
+
+
+def report(totals):
+    """
+    Return totals as returned by `run` formatted for humans
+    """
+    return """Files processed:      {:9d}
+Files failed:         {:9d}
+Exporters:            {:9d}
+Templates seeded:     {:9d}
+
+Packets processed:    {:9d}
+Headers record count: {:9d}
+Records processed:    {:9d}
+Records diff:         {:9d}""".format(
+        totals["files"],
+        totals["failed"],
+        totals["exporters"],
+        totals.get("seeded", 0),
+        totals.get("packets", 0),
+        totals.get("count", 0),
+        totals.get("record_count", 0),
+        totals.get("count", 0) - totals.get("record_count", 0),
+    )
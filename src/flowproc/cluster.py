@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Run collectors as a cluster, exporters owned by consistent hashing
+
+Nodes are placed on a hash ring (`HashRing`), an exporter belongs to the
+first node clockwise from its address. The relay (`flowproc.relay`) sends
+its datagrams there, using the same ring - so node names are the
+"host:port" collectors are relayed to.
+
+When a node fails, its exporters move on to the next node on the ring,
+which is why that one is their backup: each node sends template changes
+(`Collector.notify`) of its exporters to their backup (`Replicator`),
+which thus decodes right away when taking over. Replication is JSON lines
+over TCP ("host:port") or UNIX sockets (a path):
+
+    {"op": "register", "path": [ipa, odid], "template": {...}}
+    {"op": "remove", "path": [ipa, odid, tid]}
+
+After (re)connecting, all templates a peer backs up get sent first.
+Refreshes of a template get replicated at most every so many seconds.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from collections import deque
+
+from flowproc import persist
+from flowproc.collector_state import Collector
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+VNODES = 64  # points on the ring per node
+REFRESH = 60  # seconds between replicated refreshes of a template
+QUEUE = 10000  # messages per peer, overflow triggers a full resync
+RETRY = 2  # seconds between connection attempts
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Responsibility: map keys to nodes, moving as few keys as possible when
+    nodes come and go
+    """
+
+    def __init__(self, nodes=(), vnodes=VNODES):
+        """
+        Args:
+            nodes       [`str`]: node names
+            vnodes      `int`: points per node
+        """
+        self.vnodes = vnodes
+        self.nodes = set()
+        self.points = []  # sorted hashes
+        self.owners = {}  # hash -> node
+        self.cache = {}  # key -> node, cleared on changes
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = _hash("{}#{:d}".format(node, i))
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node
+        self.cache = {}
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self.points = [p for p in self.points if self.owners[p] != node]
+        self.owners = {p: self.owners[p] for p in self.points}
+        self.cache = {}
+
+    def lookup(self, key, n=1):
+        """
+        Return up to n distinct nodes clockwise from key, owner first
+        """
+        nodes = []
+        if not self.points:
+            return nodes
+        start = bisect.bisect(self.points, _hash(key))
+        count = len(self.points)
+        for i in range(count):
+            node = self.owners[self.points[(start + i) % count]]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == n:
+                    break
+        return nodes
+
+    def owner(self, key):
+        """
+        Return the node key belongs to, `None` if there are no nodes
+        """
+        try:
+            return self.cache[key]
+        except KeyError:
+            nodes = self.lookup(key)
+            node = self.cache[key] = nodes[0] if nodes else None
+            return node
+
+
+def parse_peer(spec):
+    """
+    Return (name, address) from "name=address"
+    """
+    name, sep, address = spec.partition("=")
+    if not sep or not name or not address:
+        raise ValueError("Peer '{}' is not name=address".format(spec))
+    return name, address
+
+
+def _is_path(address):
+    host, sep, port = address.rpartition(":")
+    return not (sep and port.isdigit())
+
+
+class Replicator:
+    """
+    Responsibility: send template changes of the exporters a node owns to
+    their backup, apply what peers send
+    """
+
+    def __init__(self, node, peers, refresh=REFRESH, maxqueue=QUEUE):
+        """
+        Args:
+            node        `str`: this node's name
+            peers       `dict`: name -> replication address of all nodes,
+                        this one included
+            refresh     `int`: min seconds between replicated refreshes
+            maxqueue    `int`: messages queued per peer
+        """
+        if node not in peers:
+            raise ValueError("Node '{}' is not among the peers".format(node))
+        self.node = node
+        self.peers = dict(peers)
+        self.ring = HashRing(peers)
+        self.refresh = refresh
+        others = [name for name in peers if name != node]
+        self.queues = {name: deque(maxlen=maxqueue) for name in others}
+        self.ready = {}  # name -> `asyncio.Event`, created on start
+        self.resync = set(others)  # full state owed on connect
+        self.connected = set()
+        self.refreshed = {}  # path -> time replicated last
+        self.local = threading.local()  # `applying`, per thread
+        self.loop = None  # running the senders, set on start
+        self.server = None
+        self.tasks = []
+        # metrics
+        self.sent = 0
+        self.applied = 0
+        self.overflows = 0
+        self.connects = 0
+
+    def backup(self, ipa):
+        """
+        Return the node to replicate exporter ipa to, `None` if none
+
+        That's the next node on the ring while owning it, the owner while
+        having taken over (the owner is down, it gets resynced).
+        """
+        for node in self.ring.lookup(ipa, 2):
+            if node != self.node:
+                return node
+        return None
+
+    def observe(self, event, path, node):
+        """
+        Queue a `Collector.notify` event for the backup of the exporter -
+        called in whatever thread registered the template (decode workers)
+        """
+        if getattr(self.local, "applying", False):
+            return  # from a peer, not ours to replicate
+        if event == "refresh":
+            now = time.monotonic()
+            if now - self.refreshed.get(path, 0) < self.refresh:
+                return
+            self.refreshed[path] = now
+        elif event == "remove":
+            self.refreshed.pop(path, None)
+        else:
+            self.refreshed[path] = time.monotonic()
+        peer = self.backup(path[0])
+        if peer is None:
+            return
+        if event == "remove":
+            msg = {"op": "remove", "path": list(path)}
+        elif type(node).__name__ in ("Template", "OptionsTemplate"):
+            msg = {
+                "op": "register",
+                "path": list(path[:2]),
+                "template": persist.dump_template(node),
+            }
+        else:
+            return
+        self._queue(peer, msg)
+
+    def _queue(self, peer, msg):
+        queue = self.queues[peer]
+        if len(queue) == queue.maxlen:
+            self.overflows += 1
+            self.resync.add(peer)  # lost a change, send all once connected
+        queue.append(msg)
+        if peer in self.ready:
+            # `asyncio.Event` is not thread-safe, set it in the loop thread
+            self.loop.call_soon_threadsafe(self.ready[peer].set)
+
+    def state_for(self, peer):
+        """
+        Return register messages for all templates peer backs up
+        """
+        snapshot = Collector.accept(persist.SnapshotVisitor())
+        return [
+            {"op": "register", "path": [ipa, int(odid)], "template": d}
+            for ipa, domains in snapshot["exporters"].items()
+            if self.backup(ipa) == peer
+            for odid, templates in domains.items()
+            for d in templates
+        ]
+
+    def apply(self, msg):
+        """
+        Apply a message from a peer to collector state
+        """
+        self.local.applying = True
+        try:
+            if msg["op"] == "register":
+                ipa, odid = msg["path"]
+                persist.load_template(ipa, odid, msg["template"])
+            elif msg["op"] == "remove":
+                Collector.unregister(*msg["path"])
+            else:
+                raise ValueError("Unknown op '{}'".format(msg["op"]))
+        finally:
+            self.local.applying = False
+        self.applied += 1
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info("peername") or "unix"
+        logger.info("Replicating from %s", peer)
+        try:
+            async for line in reader:
+                try:
+                    self.apply(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.error("Bad replication from %s: %r", peer, e)
+        finally:
+            writer.close()
+
+    async def _connect(self, address):
+        if _is_path(address):
+            return await asyncio.open_unix_connection(address)
+        host, _, port = address.rpartition(":")
+        return await asyncio.open_connection(host.strip("[]"), int(port))
+
+    async def _send(self, peer):
+        queue = self.queues[peer]
+        ready = self.ready[peer]
+        while True:
+            try:
+                _, writer = await self._connect(self.peers[peer])
+            except OSError as e:
+                logger.debug("Cannot connect to %s: %r", peer, e)
+                await asyncio.sleep(RETRY)
+                continue
+            self.connected.add(peer)
+            self.connects += 1
+            logger.info("Replicating to %s", peer)
+            try:
+                if peer in self.resync:
+                    self.resync.discard(peer)
+                    queue.clear()  # contained in the state sent
+                    for msg in self.state_for(peer):
+                        writer.write(json.dumps(msg).encode() + b"\n")
+                        self.sent += 1
+                    await writer.drain()
+                while True:
+                    while queue:
+                        msg = queue.popleft()
+                        writer.write(json.dumps(msg).encode() + b"\n")
+                        self.sent += 1
+                    await writer.drain()
+                    ready.clear()
+                    await ready.wait()
+            except OSError as e:
+                logger.warning("Lost replication to %s: %r", peer, e)
+                self.resync.add(peer)
+            finally:
+                self.connected.discard(peer)
+                writer.close()
+            await asyncio.sleep(RETRY)
+
+    async def start(self):
+        """
+        Listen for peers and start sending, on the running event loop
+        """
+        address = self.peers[self.node]
+        if _is_path(address):
+            self.server = await asyncio.start_unix_server(
+                self._handle, address
+            )
+        else:
+            host, _, port = address.rpartition(":")
+            self.server = await asyncio.start_server(
+                self._handle, host.strip("[]"), int(port)
+            )
+        self.loop = asyncio.get_running_loop()
+        self.ready = {name: asyncio.Event() for name in self.queues}
+        self.tasks = [
+            asyncio.ensure_future(self._send(name)) for name in self.queues
+        ]
+        Collector.observers.append(self.observe)
+        logger.info("Node %s listening on %s", self.node, address)
+
+    async def stop(self):
+        """
+        Stop replicating
+        """
+        if self.observe in Collector.observers:
+            Collector.observers.remove(self.observe)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.ready = {}
+        if self.server:
+            self.server.close()
+            self.server = None
+
+    def stats(self):
+        """
+        Return metrics as `dict`
+        """
+        owners = [self.ring.owner(ipa) for ipa in Collector.children]
+        return {
+            "node": self.node,
+            "nodes": sorted(self.ring.nodes),
+            "connected": sorted(self.connected),
+            "queued": {name: len(q) for name, q in self.queues.items()},
+            "sent": self.sent,
+            "applied": self.applied,
+            "overflows": self.overflows,
+            "connects": self.connects,
+            "owned": owners.count(self.node),
+            "backed_up": len(owners) - owners.count(self.node),
+        }
@@ -4,6 +4,7 @@ Experiment on dealing with state
 """
 
 import logging
+import threading
 
 from abc import ABC
 from abc import abstractmethod
@@ -17,6 +18,16 @@ __license__ = "mit"
 
 # globals
 logger = logging.getLogger(__name__)
+REMOVED_KEEP = 4096  # removals remembered for change queries
+
+# ----- [ label ] = options index table, for labels identifying what an
+# Options Data Record describes (scope first, then option fields)
+OPTION_KEYS = {
+    "Interface": "interface",
+    "INPUT_SNMP": "interface",
+    "FLOW_SAMPLER_ID": "sampler",
+    "INGRESS_VRFID": "vrf",
+}
 
 
 class AbstractTemplate(ABC):
@@ -24,6 +35,8 @@ class AbstractTemplate(ABC):
     The things every temlate class should implement
     """
 
+    __slots__ = ()
+
     @abstractmethod
     def get_tid(self):
         pass
@@ -49,6 +62,16 @@ class Collector:
     packets = 0
     count = 0
     record_count = 0
+    evictions = 0
+    # change tracking, see `changed` and `forget`
+    version = 0
+    removed = deque(maxlen=REMOVED_KEEP)  # (version, path)
+    forgotten = 0  # latest version of removals dropped from removed
+    domains = 0
+    templates = 0
+    observers = []  # callables, see `notify`
+    # held while changing state, decode workers register concurrently
+    lock = threading.RLock()
 
     @classmethod
     def accept(cls, visitor):
@@ -77,25 +100,146 @@ class Collector:
         """
         Create, update or replace anything implementing `AbstractTemplate`
         """
-        cls.accept(RegisteringVisitor(ipa, odid, template))
+        with cls.lock:
+            cls.accept(RegisteringVisitor(ipa, odid, template))
 
     @classmethod
-    def register_optrec(cls, ipa, odid, dict):
+    def register_optrec(cls, ipa, odid, optrec):
         """
         Register an Options Data Record (`dict`) with the `ObservationDomain`
         given by path.
         """
         try:
-            cls.children[ipa].children[odid].optrecs.append(dict)
-            return True
+            exporter = cls.children[ipa]
+            domain = exporter.children[odid]
         except KeyError:
             return False
+        if domain.index_optrec(optrec):
+            cls.changed(exporter, domain)
+        return True
+
+    @classmethod
+    def changed(cls, *nodes):
+        """
+        Count a new state version and mark nodes (`Exporter`,
+        `ObservationDomain`) on the path changed with it
+        """
+        with cls.lock:
+            cls.version += 1
+            for node in nodes:
+                node.version = cls.version
+
+    @classmethod
+    def notify(cls, event, path, node=None):
+        """
+        Tell observers about a template registered ("create", "replace",
+        "refresh") or a node on path removed ("remove")
+        """
+        for observer in cls.observers:
+            observer(event, path, node)
+
+    @classmethod
+    def forget(cls, path, node):
+        """
+        Account for node on path (and its child nodes) having been removed
+        """
+        if len(path) == 1:
+            domains = list(node.children.values())
+        elif len(path) == 2:
+            domains = [node]
+        else:
+            domains = []
+        with cls.lock:
+            cls.domains -= len(domains)
+            if len(path) == 3:
+                cls.templates -= 1
+            else:
+                cls.templates -= sum(len(d.children) for d in domains)
+
+            cls.version += 1
+            if len(cls.removed) == cls.removed.maxlen:
+                cls.forgotten = cls.removed[0][0]
+            cls.removed.append((cls.version, path))
+        cls.notify("remove", path, node)
 
     @classmethod
-    def unregister(cls, ipa, odid):
+    def summary(cls):
+        """
+        Return counters, all maintained along the way (no walk)
         """
-        Remove rightmost element in path (and its child nodes)
+        return {
+            "version": cls.version,
+            "exporters": len(cls.children),
+            "domains": cls.domains,
+            "templates": cls.templates,
+            "packets": cls.packets,
+            "count": cls.count,
+            "record_count": cls.record_count,
+            "evictions": cls.evictions,
+        }
+
+    @classmethod
+    def touch(cls, ipa, odid):
         """
+        Mark exporter and observation domain on path as active now
+
+        Return:
+            `True` if path exists, else `False`
+        """
+        now = datetime.utcnow()
+        try:
+            exporter = cls.children[ipa]
+            domain = exporter.children[odid]
+        except KeyError:
+            return False
+        exporter.lastseen = domain.lastseen = now
+        return True
+
+    @classmethod
+    def unregister(cls, ipa, odid=None, tid=None):
+        """
+        Remove rightmost element in path (and its child nodes) - a path
+        with a gap (e.g. a tid but no odid) raises `ValueError`
+
+        Return:
+            `True` if removed, `False` if path not existing
+        """
+        args = (ipa, odid, tid)
+        path = args[: args.index(None)] if None in args else args
+        if not path or any(arg is not None for arg in args[len(path) :]):
+            raise ValueError("Path {} has a gap".format(args))
+        with cls.lock:  # nothing gets registered below what's removed
+            parent = cls.get_qualified(*path[:-1])
+            if parent is None:
+                return False
+            node = parent.children.pop(path[-1], None)
+            if node is None:
+                return False
+            cls.forget(path, node)
+        return True
+
+    @classmethod
+    def expire(cls, template_age=None, idle=None, max_templates=None):
+        """
+        Remove stale templates and idle exporters/ observation domains
+
+        Args:
+            template_age    `int`: max seconds since a template was written
+            idle            `int`: max seconds since an exporter or domain
+                            was last seen (see `touch`)
+            max_templates   `int`: max templates per exporter, oldest
+                            beyond are removed
+
+        Return:
+            `list` of evictions as (path `tuple`, reason `str`)
+        """
+        visitor = ExpiringVisitor(template_age, idle, max_templates)
+        with cls.lock:
+            cls.accept(visitor)
+        cls.evictions += len(visitor.evicted)
+        for path, reason in visitor.evicted:
+            logger.info("Evicted %s (%s)", path, reason)
+        return visitor.evicted
 
 
 class Exporter(Visitable):
@@ -107,6 +251,8 @@ class Exporter(Visitable):
     def __init__(self, ipa):
         self.children = {}
         self.ipa = ip_address(ipa).exploded
+        self.lastseen = datetime.utcnow()
+        self.version = 0  # state version of last change
 
     def __repr__(self):
         return self.ipa
@@ -117,14 +263,60 @@ class ObservationDomain(Visitable):
     TODO Clarify relation to exporters (and for V10) transport protocols.
     """
 
-    def __init__(self, odid, bufsize=8):
+    def __init__(self, odid):
         self.children = {}
         self.odid = int(odid)
-        self.optrecs = deque(maxlen=bufsize)  # option data records collected
+        # option data records collected: table -> key -> fields, e.g.
+        # options["interface"][ifindex]["IF_NAME"]
+        self.options = {}
+        self.lastseen = datetime.utcnow()
+        self.version = 0  # state version of last change
 
     def __repr__(self):
         return str(self.odid)
 
+    def index_optrec(self, optrec):
+        """
+        Merge an Options Data Record into the table and under the key its
+        first identifying label (see `OPTION_KEYS`) gives - "system" and
+        key `None` for records describing the exporter as a whole
+
+        Return:
+            `True` if this changed the index
+        """
+        table, key = "system", None
+        for label, value in optrec.items():
+            if label in OPTION_KEYS:
+                table, key = OPTION_KEYS[label], value
+                break
+        entry = self.options.setdefault(table, {}).setdefault(key, {})
+        if optrec.items() <= entry.items():
+            return False  # a refresh
+        entry.update(optrec)
+        return True
+
+    def sampling_rate(self, sampler=None):
+        """
+        Return the sampling rate (1 out of N packets) of a sampler, falling
+        back to the one announced for the domain as a whole
+
+        Args:
+            sampler     `int`: FLOW_SAMPLER_ID, `None` for the domain's
+
+        Return:
+            N, 1 if unknown (i.e. unsampled)
+        """
+        rate = None
+        if sampler is not None:
+            entry = self.options.get("sampler", {}).get(sampler, {})
+            rate = entry.get("FLOW_SAMPLER_RANDOM_INTERVAL") or entry.get(
+                "SAMPLING_INTERVAL"
+            )
+        if not rate:
+            entry = self.options.get("system", {}).get(None, {})
+            rate = entry.get("SAMPLING_INTERVAL")
+        return rate or 1
+
 
 class RetrievingVisitor:
     """
@@ -186,13 +378,17 @@ class RegisteringVisitor:
         self.template = template_obj
 
     def visit_Collector(self, host):
-        exporter = host.children.get(self.ipa, Exporter(self.ipa))
-        host.children[self.ipa] = exporter
+        exporter = host.children.get(self.ipa)
+        if exporter is None:
+            exporter = host.children[self.ipa] = Exporter(self.ipa)
+        self.exporter = exporter
         exporter.accept(self)
 
     def visit_Exporter(self, host):
-        domain = host.children.get(self.odid, ObservationDomain(self.odid))
-        host.children[self.odid] = domain
+        domain = host.children.get(self.odid)
+        if domain is None:
+            domain = host.children[self.odid] = ObservationDomain(self.odid)
+            Collector.domains += 1
         domain.accept(self)
 
     def visit_ObservationDomain(self, host):
@@ -202,22 +398,87 @@ class RegisteringVisitor:
             # hope this helps us work around the timestamp of refreshment
             if val.__repr__() == self.template.__repr__():
                 logger.debug(
-                    "Updating {} with tid {:d}".format(
-                        type(self.template), tid
-                    )
+                    "Updating %s with tid %d", type(self.template), tid
                 )
+                event = "refresh"
             else:
                 logger.warning(
-                    "Replacing {} with tid {:d}".format(
-                        type(self.template), tid
-                    )
+                    "Replacing %s with tid %d", type(self.template), tid
                 )
+                event = "replace"
         except KeyError:
-            logger.info(
-                "Creating {} with tid {:d}".format(type(self.template), tid)
-            )
+            logger.info("Creating %s with tid %d", type(self.template), tid)
+            Collector.templates += 1
+            event = "create"
         # at last DO it
         host.children[tid] = self.template
+        Collector.changed(self.exporter, host)
+        Collector.notify(event, (self.ipa, self.odid, tid), self.template)
+
+
+class ExpiringVisitor:
+    """
+    Remove what's older than the limits received as '__init__' args (`None`
+    for no limit) and collect evictions along the way.
+    """
+
+    def __init__(self, template_age, idle, max_templates):
+        self.now = datetime.utcnow()
+        self.template_age = template_age
+        self.idle = idle
+        self.max_templates = max_templates
+        self.evicted = []
+        self.path = ()
+
+    def _age(self, then):
+        return (self.now - then).total_seconds()
+
+    def visit_Collector(self, host):
+        for ipa, exporter in list(host.children.items()):
+            self.path = (ipa,)
+            if self.idle is not None and self._age(exporter.lastseen) > \
+                    self.idle:
+                del host.children[ipa]
+                Collector.forget(self.path, exporter)
+                self.evicted.append((self.path, "exporter idle"))
+            else:
+                exporter.accept(self)
+
+    def visit_Exporter(self, host):
+        ipa = self.path[0]
+        for odid, domain in list(host.children.items()):
+            self.path = (ipa, odid)
+            if self.idle is not None and self._age(domain.lastseen) > \
+                    self.idle:
+                del host.children[odid]
+                Collector.forget(self.path, domain)
+                self.evicted.append((self.path, "domain idle"))
+            else:
+                domain.accept(self)
+
+        if self.max_templates is None:
+            return
+        templates = sorted(
+            (
+                (template.lastwrite, odid, tid)
+                for odid, domain in list(host.children.items())
+                for tid, template in list(domain.children.items())
+            ),
+            reverse=True,  # newest first
+        )
+        for lastwrite, odid, tid in templates[self.max_templates:]:
+            template = host.children[odid].children.pop(tid)
+            Collector.forget((ipa, odid, tid), template)
+            self.evicted.append(((ipa, odid, tid), "template limit"))
+
+    def visit_ObservationDomain(self, host):
+        if self.template_age is None:
+            return
+        for tid, template in list(host.children.items()):
+            if self._age(template.lastwrite) > self.template_age:
+                del host.children[tid]
+                Collector.forget(self.path + (tid,), template)
+                self.evicted.append((self.path + (tid,), "template age"))
 
 
 class TraversingVisitor:
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Runtime configuration and its hot reload
+
+A `Config` is one consistent set of settings - filter, sink, aggregation
+keys, counter scaling and options joins - read from a JSON file like
+
+    {
+        "filter": "proto tcp and dst port 443",
+        "store": "/var/lib/flowproc",
+        "upscale": true,
+        "joins": true,
+        "aggregate": [
+            {"name": "bytes", "key": ["IPV4_SRC_ADDR"], "value": "IN_BYTES"}
+        ]
+    }
+
+Everything a config describes is built before anything in use is touched,
+so a config failing to build leaves the running one in place. Parsers run
+on the event loop thread, hence swapping their globals happens between two
+batches and datagrams arriving meanwhile wait in the socket buffer.
+
+Reloading parser code (field tables, codecs, template classes) re-creates
+all templates from their state, so compiled decoders get rebuilt by the
+new code and no exporter has to resend.
+"""
+
+import importlib
+import json
+import logging
+
+from flowproc import persist
+from flowproc.fluent import Fluent
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+
+
+class Config:
+    """
+    Responsibility: hold settings and the filter and pipeline built from them
+    """
+
+    def __init__(
+        self,
+        filter=None,
+        store=None,
+        upscale=False,
+        joins=True,
+        aggregate=(),
+        path=None,
+    ):
+        """
+        Args:
+            filter      `str`: filter expression, see `flowproc.flowfilter`
+            store       `str`: flow store directory, `None` to print records
+            upscale     `bool`: scale counters by sampling rate
+            joins       `bool`: join options data into Data Records
+            aggregate   sequence of `dict` with "name", "key" (`list` of
+                        labels) and optionally "value" (label, else counts)
+            path        `str`: file the settings were loaded from
+        """
+        self.settings = {
+            "filter": filter,
+            "store": store,
+            "upscale": bool(upscale),
+            "joins": bool(joins),
+            "aggregate": [dict(agg) for agg in aggregate],
+        }
+        self.path = path
+        self.record_filter = None
+        self.pipeline = None
+
+    def __repr__(self):
+        return "Config({})".format(self.path or self.settings)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return `Config` read from JSON file at path
+
+        Raises `ValueError` for malformed files or unknown settings.
+        """
+        with open(path) as fh:
+            settings = json.load(fh)
+        try:
+            return cls(path=path, **settings)
+        except TypeError as e:
+            raise ValueError("Bad config {}: {}".format(path, e))
+
+    def build(self, parser, tag=None):
+        """
+        Compile filter and pipeline, raising before anything is in use
+
+        Args:
+            parser      parser module whose output to use when not storing
+            tag         `str`: for the store's segment names, see
+                        `flowproc.flowstore.FlowStore`
+        """
+        expression = self.settings["filter"]
+        record_filter = None
+        if expression:
+            from flowproc.flowfilter import Filter  # if used only
+
+            record_filter = Filter(expression)
+
+        fluent = Fluent()
+        for agg in self.settings["aggregate"]:
+            try:
+                name, key = agg["name"], tuple(agg["key"])
+            except KeyError as e:
+                raise ValueError("Aggregate without {}".format(e))
+            value = agg.get("value")
+            fluent = fluent.aggregate(
+                name,
+                key=lambda r, key=key: tuple(getattr(r, k, None) for k in key),
+                value=(lambda r, value=value: getattr(r, value, None) or 0)
+                if value
+                else (lambda r: 1),
+            )
+        store = self.settings["store"]
+        if store:
+            from flowproc.flowstore import FlowStore  # if used only
+
+            fluent = fluent.sink(FlowStore(store, tag=tag))
+        else:
+            fluent = fluent.sink(parser.print_records)
+
+        self.record_filter = record_filter
+        self.pipeline = fluent.compile()
+        logger.info("Built {}: {}".format(self, fluent))
+
+    def apply(self, parser):
+        """
+        Set parser globals to what was built, all in one go
+        """
+        (
+            parser.record_filter,
+            parser.output,
+            parser.upscale,
+            parser.joins,
+        ) = (
+            self.record_filter,
+            self.pipeline,
+            self.settings["upscale"],
+            parser.JOINS if self.settings["joins"] else (),
+        )
+
+    def close(self):
+        """
+        Close sinks (flushing a `FlowStore`)
+        """
+        if self.pipeline:
+            self.pipeline.close()
+
+
+def swap(parser, current, new, retire=None):
+    """
+    Build new config and put it in place of current, closing current's sinks
+    once unused
+
+    Args:
+        retire      callable(func) to defer closing with, e.g.
+                    `flowproc.stages.Stages.retire` while output may run
+
+    Return:
+        new `Config` - if building it raises, current stays in place
+    """
+    new.build(parser)
+    new.apply(parser)
+    if current:
+        (retire or (lambda close: close()))(current.close)
+    logger.info("Swapped {} for {}".format(current, new))
+    return new
+
+
+def reload_code(parser, config, modules):
+    """
+    Reload modules, re-create templates with the reloaded classes and
+    re-apply config to the reloaded parser
+
+    Sources get compiled first, so a syntax error leaves all code as is. A
+    module raising while executing stops reloading there, modules after it
+    stay as they were - templates and config still get rebuilt with what
+    was reloaded, then the error is raised.
+
+    Args:
+        parser      parser module (also in modules)
+        config      `Config` in use
+        modules     sequence of modules, in dependency order
+
+    Return:
+        number of templates rebuilt
+    """
+    for module in modules:
+        with open(module.__file__, "rb") as fh:
+            compile(fh.read(), module.__file__, "exec")
+
+    reloaded = []
+    failed = None
+    for module in modules:
+        try:
+            importlib.reload(module)
+        except Exception as e:
+            logger.error("Reloading %s failed: %r", module.__name__, e)
+            failed = e
+            break
+        reloaded.append(module)
+
+    count = persist.rebuild()
+    config.apply(parser)
+    logger.info(
+        "Reloaded {}, rebuilt {:d} templates".format(
+            [m.__name__ for m in reloaded], count
+        )
+    )
+    if failed:
+        raise failed
+    return count
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+JSON-lines control protocol
+
+Clients send one request per line
+
+    {"id": 1, "cmd": "setloglevel", "args": [10]}
+
+(a plain text line like `setloglevel 10` works as well, with id `null`) and
+get one response line per request, carrying its id
+
+    {"id": 1, "ok": true, "result": 10}
+    {"id": 2, "ok": false, "error": "KeyError: 'foo'"}
+
+Commands returning an iterator stream their result instead, one line per
+item and a final line marking the end:
+
+    {"id": 3, "chunk": {...}}
+    {"id": 3, "ok": true, "done": true}
+
+Responses get serialized in the loop's default executor and the loop is
+yielded to between chunks, so large state dumps don't hold up datagrams.
+Requests on one connection are answered in order.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+
+
+def parse_request(line):
+    """
+    Return request `dict` with "id", "cmd" and "args" for a line received
+    """
+    line = line.decode().strip()
+    try:
+        request = json.loads(line)
+    except ValueError:
+        request = None
+    if not isinstance(request, dict):
+        words = line.split()  # plain text
+        request = {
+            "id": None,
+            "cmd": words[0] if words else "",
+            "args": words[1:],
+        }
+    request.setdefault("id", None)
+    request.setdefault("args", [])
+    return request
+
+
+def dumps(response):
+    """
+    Return response as line (`bytes`), anything not JSON-serializable as
+    `str`
+    """
+    return (json.dumps(response, default=str) + "\n").encode()
+
+
+class ControlServer:
+    """
+    Responsibility: serve control requests from connected streams
+    """
+
+    def __init__(self, commands):
+        """
+        Args:
+            commands    `dict`: command name -> callable(*args) returning a
+                        result, an iterator to stream or an awaitable
+        """
+        self.commands = commands
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        """
+        Callback for `asyncio.start_unix_server`
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.respond(parse_request(line), writer)
+        except ConnectionError as e:
+            logger.info("Ctrl connection lost: {}".format(e))
+        finally:
+            writer.close()
+
+    async def respond(self, request, writer):
+        """
+        Run request and write its response(s)
+        """
+        self.requests += 1
+        rid, cmd, args = request["id"], request.get("cmd"), request["args"]
+        logger.info("Ctrl: {} {} {}".format(rid, cmd, args))
+        try:
+            if cmd not in self.commands:
+                raise KeyError("Command '{}' unknown".format(cmd))
+            result = self.commands[cmd](*args)
+            if inspect.isawaitable(result):
+                result = await result
+            if hasattr(result, "__next__"):
+                for chunk in result:
+                    await self.send(writer, {"id": rid, "chunk": chunk})
+                await self.send(writer, {"id": rid, "ok": True, "done": True})
+            else:
+                await self.send(
+                    writer, {"id": rid, "ok": True, "result": result}
+                )
+        except ConnectionError:
+            raise
+        except Exception as e:
+            await self.send(
+                writer,
+                {
+                    "id": rid,
+                    "ok": False,
+                    "error": "{}: {}".format(type(e).__name__, e),
+                },
+            )
+
+    async def send(self, writer, response):
+        """
+        Serialize response off the event loop and write it
+        """
+        loop = asyncio.get_running_loop()
+        line = await loop.run_in_executor(None, dumps, response)
+        writer.write(line)
+        await writer.drain()
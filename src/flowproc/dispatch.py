@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Version-sniffing front end for NetFlow V5, V9 and IPFIX on one socket
+
+The first two bytes of an export packet tell its version, a `Dispatcher`
+routes each datagram to the parser for it. It takes the place of a parser
+module: parser settings (`output`, `record_filter`, `upscale`, `joins`)
+set on it go to all parsers having them - IPFIX Data Sets get decoded with
+`v9_parser`'s.
+
+Parser modules get imported when a `Dispatcher` accepting their version is
+made, short-lived processes don't pay for parsers they don't use.
+"""
+
+import importlib
+import logging
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+PARSERS = {
+    5: "flowproc.v5_parser",
+    9: "flowproc.v9_parser",
+    10: "flowproc.ipfix_parser",
+}
+NAMES = {5: "v5", 9: "v9", 10: "ipfix"}
+
+
+def _setting(name):
+    def get(self):
+        return getattr(self.modules[0], name)
+
+    def set(self, value):
+        for module in self.modules:
+            setattr(module, name, value)
+
+    return property(get, set)
+
+
+class Dispatcher:
+    """
+    Responsibility: route datagrams to the parser for their version and
+    count per version
+    """
+
+    output = _setting("output")
+    record_filter = _setting("record_filter")
+    upscale = _setting("upscale")
+    joins = _setting("joins")
+
+    def __init__(self, versions=tuple(PARSERS)):
+        """
+        Args:
+            versions    versions to accept, others get counted and dropped
+        """
+        self.parsers = {
+            v: importlib.import_module(PARSERS[v]) for v in versions
+        }
+        # parser modules holding settings, IPFIX Data Sets get decoded by
+        # V9's - the first one's settings get reported
+        self.modules = [
+            importlib.import_module(PARSERS[v])
+            for v in (9, 5)
+            if v in self.parsers or (v == 9 and 10 in self.parsers)
+        ]
+        self.JOINS = self.modules[0].JOINS
+        self.packets = dict.fromkeys(self.parsers, 0)
+        self.errors = dict.fromkeys(self.parsers, 0)
+        self.unknown = 0
+
+    def __repr__(self):
+        return "Dispatcher({})".format([NAMES[v] for v in self.parsers])
+
+    def print_records(self, ipa, records):
+        self.modules[0].print_records(ipa, records)
+
+    def parse_packet(self, datagram, ipa):
+        """
+        Parse datagram with the parser for its version
+        """
+        version = int.from_bytes(datagram[:2], "big")
+        parser = self.parsers.get(version)
+        if parser is None:
+            self.unknown += 1
+            logger.warning(
+                "Cannot process header version %s from %s", version, ipa
+            )
+            return
+        self.packets[version] += 1
+        try:
+            parser.parse_packet(datagram, ipa)
+        except Exception:
+            self.errors[version] += 1
+            raise
+
+    def stats(self):
+        """
+        Return counters per version
+        """
+        return {
+            "versions": {
+                NAMES[v]: {"packets": n, "errors": self.errors[v]}
+                for v, n in self.packets.items()
+            },
+            "unknown": self.unknown,
+            "ipfix_skipped_templates": getattr(
+                self.parsers.get(10), "skipped", 0
+            ),
+        }
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Field codecs for template based (NetFlow V9, IPFIX) records
+
+What a field means is looked up once per field type in
+`v9_fieldtypes.SEMANTIC` (unsigned, address, mac, string, timestamp,
+octets), the codec registered for that semantic returns a `struct` format
+character for the field's length plus an optional conversion. All fields of
+a template get compiled into one precompiled `struct.Struct`, so decoding a
+whole Data FlowSet is a single `iter_unpack` plus conversions only where
+`struct` has no native format (e.g. 3, 6 or 16 byte integers).
+"""
+
+import logging
+import struct
+
+from functools import lru_cache
+from functools import partial
+
+from flowproc import v9_fieldtypes
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+CODECS = {}  # semantic -> factory(length) returning (format, convert)
+_NATIVE = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+_from_bytes = partial(int.from_bytes, byteorder="big")
+
+
+def codec(semantic):
+    """
+    Register the decorated factory as codec for semantic
+    """
+
+    def register(factory):
+        CODECS[semantic] = factory
+        return factory
+
+    return register
+
+
+@codec("unsigned")
+def unsigned(length):
+    if length in _NATIVE:
+        return _NATIVE[length], None
+    if length <= 16:
+        return "{:d}s".format(length), _from_bytes
+    return "{:d}s".format(length), None  # longer than any number sent
+
+
+@codec("timestamp")
+def timestamp(length):
+    return unsigned(length)
+
+
+@codec("address")
+def address(length):
+    return unsigned(length)  # `int`, rendered only as needed
+
+
+def mac_to_str(value):
+    return ":".join(["{:02x}".format(b) for b in value])
+
+
+@codec("mac")
+def mac(length):
+    return "{:d}s".format(length), mac_to_str
+
+
+def bytes_to_str(value):
+    # up to the first trailing \x00
+    return value.partition(b"\0")[0].decode(errors="replace")
+
+
+@codec("string")
+def string(length):
+    return "{:d}s".format(length), bytes_to_str
+
+
+@codec("octets")
+def octets(length):
+    return "{:d}s".format(length), None
+
+
+def field_codec(ftype, length, semantic=None):
+    """
+    Return (`struct` format, conversion or `None`) for a field
+
+    Args:
+        ftype       `int`: field type
+        length      `int`: field length
+        semantic    `str`: overrides the semantic of ftype
+    """
+    semantic = semantic or v9_fieldtypes.SEMANTIC.get(ftype, "unsigned")
+    return CODECS[semantic](length)
+
+
+class RecordCodec:
+    """
+    Responsibility: decode records of one fixed layout
+    """
+
+    __slots__ = ("struct", "convert", "reclen")
+
+    def __init__(self, types, lengths, semantics=None):
+        """
+        Args:
+            types       sequence of field types
+            lengths     sequence of field lengths
+            semantics   sequence overriding semantic per field (or `None`)
+        """
+        semantics = semantics or [None] * len(types)
+        fmt = "!"
+        convert = []
+        for i, (ftype, length, semantic) in enumerate(
+            zip(types, lengths, semantics)
+        ):
+            code, func = field_codec(ftype, length, semantic)
+            fmt += code
+            if func:
+                convert.append((i, func))
+        self.struct = struct.Struct(fmt)
+        self.convert = tuple(convert)
+        self.reclen = self.struct.size
+
+    def decode(self, buf):
+        """
+        Return all records in buf (a trailing rest is padding) as `tuple` or,
+        where conversions apply, `list`
+        """
+        count = len(buf) // self.reclen if self.reclen else 0
+        rows = self.struct.iter_unpack(
+            memoryview(buf)[: count * self.reclen]
+        )
+        if not self.convert:
+            return list(rows)
+
+        records = []
+        for row in rows:
+            row = list(row)
+            for i, func in self.convert:
+                row[i] = func(row[i])
+            records.append(row)
+        return records
+
+
+@lru_cache(maxsize=1024)
+def record_codec(types, lengths, semantics=None):
+    """
+    Return a `RecordCodec`, shared by all templates of the same layout
+
+    Args:
+        types       `tuple` of field types
+        lengths     `tuple` of field lengths
+        semantics   `tuple` overriding semantic per field (or `None`)
+    """
+    return RecordCodec(types, lengths, semantics)
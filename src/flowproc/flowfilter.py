@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+BPF-like filter expressions compiled to Python bytecode
+
+Expressions are parsed once, e.g.
+
+    proto tcp and dst port 443 and src net 10.0.0.0/8
+
+and compiled per record layout (the field labels of a template or V5 field
+selection) into a plain `lambda` doing integer comparisons only, so records
+can be dropped right after unpacking - before any conversion, enrichment or
+output. Records must hold addresses, ports and protocols as `int`.
+
+Grammar:
+
+    expr        := term ("or" | "||" term)*
+    term        := factor ("and" | "&&" factor)*
+    factor      := ("not" | "!") factor | "(" expr ")" | primitive
+    primitive   := "proto" (number | label) | "tcp" | "udp" | "icmp"
+                 | [ "src" | "dst" ] ("host" ipaddr | "net" cidr
+                                      | "port" number | "portrange" n-m)
+"""
+
+import logging
+
+from ipaddress import ip_address
+from ipaddress import ip_network
+
+from flowproc import util
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+
+
+class FilterSyntaxError(ValueError):
+    """
+    Raised for expressions not conforming to the grammar
+    """
+
+
+def _tokenize(expression):
+    for char in "()":
+        expression = expression.replace(char, " {} ".format(char))
+    aliases = {"&&": "and", "||": "or", "!": "not"}
+    return [aliases.get(t, t) for t in expression.split()]
+
+
+class _Parser:
+    """
+    Recursive descent parser returning nested tuples:
+
+        ("and", a, b), ("or", a, b), ("not", a),
+        ("range", dims, version, lo, hi)
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self, what="token"):
+        token = self.peek()
+        if token is None:
+            raise FilterSyntaxError("Expected {} at end".format(what))
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise FilterSyntaxError("Empty expression")
+        node = self.expr()
+        if self.peek() is not None:
+            raise FilterSyntaxError("Unexpected '{}'".format(self.peek()))
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek() == "or":
+            self.next()
+            node = ("or", node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() == "and":
+            self.next()
+            node = ("and", node, self.factor())
+        return node
+
+    def factor(self):
+        token = self.next("expression")
+        if token == "not":
+            return ("not", self.factor())
+        if token == "(":
+            node = self.expr()
+            if self.next("')'") != ")":
+                raise FilterSyntaxError("Expected ')'")
+            return node
+        return self.primitive(token)
+
+    def primitive(self, token):
+        if token in ("tcp", "udp", "icmp"):
+            proto = util.proto_to_num(token)
+            return ("range", ("proto",), None, proto, proto)
+        if token == "proto":
+            arg = self.next("protocol")
+            proto = int(arg) if arg.isdigit() else util.proto_to_num(arg)
+            if proto is None:
+                raise FilterSyntaxError("Unknown protocol '{}'".format(arg))
+            return ("range", ("proto",), None, proto, proto)
+
+        direction = None
+        if token in ("src", "dst"):
+            direction = token
+            token = self.next("host, net or port")
+
+        if token in ("host", "net"):
+            arg = self.next(token)
+            try:
+                net = ip_network(arg, strict=False) if token == "net" else \
+                    ip_network(ip_address(arg))
+            except ValueError as e:
+                raise FilterSyntaxError(str(e))
+            dims = ("srcaddr", "dstaddr") if not direction else \
+                (direction + "addr",)
+            return (
+                "range",
+                dims,
+                net.version,
+                int(net.network_address),
+                int(net.broadcast_address),
+            )
+
+        if token in ("port", "portrange"):
+            arg = self.next(token)
+            try:
+                lo, _, hi = arg.partition("-") if token == "portrange" else \
+                    (arg, None, arg)
+                lo, hi = int(lo), int(hi)
+            except ValueError:
+                raise FilterSyntaxError("Bad {} '{}'".format(token, arg))
+            dims = ("srcport", "dstport") if not direction else \
+                (direction + "port",)
+            return ("range", dims, None, lo, hi)
+
+        raise FilterSyntaxError("Unexpected '{}'".format(token))
+
+
+class Filter:
+    """
+    Responsibility: hold a parsed expression and its compiled predicates
+    """
+
+    def __init__(self, expression):
+        """
+        Args:
+            expression  `str`: filter expression
+        """
+        self.expression = expression
+        self.tree = _Parser(_tokenize(expression)).parse()
+        self._cache = {}
+
+    def __repr__(self):
+        return "Filter({!r})".format(self.expression)
+
+    def compile(self, fields=None, index=False):
+        """
+        Return predicate callable(record) -> `bool` for a record layout
+
+        Args:
+            fields      sequence of the record's field labels, `None` if not
+                        known in advance (then all aliases get looked up)
+            index       `True` for records that are sequences in the order of
+                        fields (tuples, lists), `False` for mappings
+
+        Dimensions missing from fields never match.
+        """
+        key = (tuple(fields) if fields is not None else None, index)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        if fields is None:
+            def access(field):
+                return "r.get({!r}, -1)".format(field)
+        elif index:
+            positions = {f: i for i, f in enumerate(fields)}
+
+            def access(field):
+                return "r[{:d}]".format(positions[field])
+        else:
+            def access(field):
+                return "r[{!r}]".format(field)
+
+        source = "lambda r: " + self._emit(self.tree, fields, access)
+        logger.debug("Compiled {} to '{}'".format(self, source))
+        predicate = eval(compile(source, "<filter>", "eval"), {})
+        self._cache[key] = predicate
+        return predicate
+
+    def _emit(self, node, fields, access):
+        op = node[0]
+        if op == "not":
+            return "not ({})".format(self._emit(node[1], fields, access))
+        if op in ("and", "or"):
+            return "({} {} {})".format(
+                self._emit(node[1], fields, access),
+                op,
+                self._emit(node[2], fields, access),
+            )
+
+        _, dims, version, lo, hi = node
+        comparisons = []
+        for dim in dims:
+            for field in util.FIELD_ALIASES[dim]:
+                if fields is not None and field not in fields:
+                    continue
+                if version and ("IPV6" in field) != (version == 6):
+                    continue  # no IPv6 net on IPv4 fields and vice versa
+                if lo == hi:
+                    comparisons.append("{} == {:d}".format(access(field), lo))
+                else:
+                    comparisons.append(
+                        "{:d} <= {} <= {:d}".format(lo, access(field), hi)
+                    )
+        return "({})".format(" or ".join(comparisons) or "False")
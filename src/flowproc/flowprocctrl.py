@@ -26,10 +26,16 @@ def parse_args(args):
     )
     parser.add_argument(
         dest="cmd",
-        help="ping, stats",
+        help="ping, stats, tree, help etc.",
         type=str,
         metavar="command"
     )
+    parser.add_argument(
+        dest="args",
+        help="command arguments",
+        nargs="*",
+        metavar="arg"
+    )
     parser.add_argument(
         "-s",
         "--sock",
@@ -45,26 +51,44 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
-@asyncio.coroutine
-def unix_socket_client(command, socketpath):
-    reader, writer = yield from asyncio.open_unix_connection(socketpath)
-
-    # command += "\n"  # readline() in the other end!
-    # read(1024) on the other end
-    writer.write(command.encode())
-
-    data = yield from reader.read(-1)
+async def unix_socket_client(command, args, socketpath):
+    """
+    Send request, print result or streamed chunks as they arrive
 
-    msg = data.decode()
-    # If JSON, we might pretty-print:
-    try:
-        msg = json.loads(msg)
-        # pprint.PrettyPrinter(indent=1, width=80, compact=True)
-        pprint.pprint(msg, width=172, compact=True)
-    except json.decoder.JSONDecodeError:
-        print(msg)
+    Return:
+        `True` if the command succeeded
+    """
+    reader, writer = await asyncio.open_unix_connection(socketpath)
+
+    request = {"id": 1, "cmd": command, "args": args}
+    writer.write((json.dumps(request) + "\n").encode())
+    await writer.drain()
+
+    ok = False
+    while True:
+        line = await reader.readline()
+        if not line:
+            print("Connection closed", file=sys.stderr)
+            break
+        response = json.loads(line.decode())
+        if "chunk" in response:
+            pprint.pprint(response["chunk"], width=172, compact=True)
+            continue
+        ok = response["ok"]
+        if not ok:
+            print(response["error"], file=sys.stderr)
+        elif "result" in response:
+            result = response["result"]
+            # multi line text as is, anything else pretty-printed
+            if isinstance(result, str):
+                print(result)
+            else:
+                pprint.pprint(result, width=172, compact=True)
+        break
 
     writer.close()
+    await writer.wait_closed()
+    return ok
 
 
 def main(args):
@@ -73,9 +97,9 @@ def main(args):
     """
     args = parse_args(args)
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(unix_socket_client(args.cmd, args.sock))
-    loop.close()
+    ok = asyncio.run(unix_socket_client(args.cmd, args.args, args.sock))
+    if not ok:
+        sys.exit(1)
 
 
 def run():
@@ -2,21 +2,39 @@
 # -*- coding: utf-8 -*-
 """
 The flow collector daemon
+
+Decodes what it receives or, given `--relay` destinations, runs as relay
+forwarding export packets to downstream collectors by exporter (see
+`flowproc.relay`). With `--decode-processes`, this process only receives
+and hands datagrams to decoder processes by exporter, through shared memory
+ring buffers (see `flowproc.shmring`).
 """
 
 import argparse
 import logging
+import multiprocessing
+import platform
+import signal
+import socket
 import socketserver
 import sys
+import time
+import zlib
 
-from flowproc import process
 from flowproc import __version__
+from flowproc import relay
+from flowproc import shmring
+from flowproc.dispatch import Dispatcher
 
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
 __license__ = "mit"
 
 logger = logging.getLogger(__name__)
+# V5, V9 and IPFIX on the same socket, made by `main` when decoding here -
+# relays don't import parsers
+dispatcher = None
+trusted = frozenset()  # relays to take the exporter from, see `main`
 
 
 def parse_args(args):
@@ -83,6 +101,74 @@ def parse_args(args):
         version="flowproc {ver}".format(ver=__version__),
     )
 
+    parser.add_argument(
+        "--relay",
+        dest="destinations",
+        default=[],
+        help="relay to collector, repeat to balance by exporter over several",
+        action="append",
+        type=relay.parse_destination,
+        metavar="host:port",
+    )
+    parser.add_argument(
+        "--duplicate",
+        dest="duplicates",
+        default=[],
+        help="relay copies to collector, repeat to balance over several",
+        action="append",
+        type=relay.parse_destination,
+        metavar="host:port",
+    )
+    parser.add_argument(
+        "--pool",
+        default=relay.POOL,
+        help="set number of connected sockets per relay destination",
+        type=int,
+        action="store",
+        metavar="int",
+    )
+    parser.add_argument(
+        "--batch",
+        default=relay.BATCH,
+        help="set datagrams per socket to relay in one go",
+        type=int,
+        action="store",
+        metavar="int",
+    )
+    parser.add_argument(
+        "--relay-from",
+        dest="trusted",
+        default=[],
+        help="take the exporter from the relay header of datagrams sent by "
+        "this relay, repeat for several (others are taken as received)",
+        action="append",
+        type=relay.parse_source,
+        metavar="ipaddr",
+    )
+    parser.add_argument(
+        "--raw",
+        help="relay datagrams as received, without exporter header "
+        "(downstream sees the relay as exporter)",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--decode-processes",
+        default=0,
+        help="set number of processes decoding, 0 to decode in this one",
+        type=int,
+        action="store",
+        metavar="int",
+    )
+    parser.add_argument(
+        "--ring-size",
+        default=shmring.SIZE,
+        help="set bytes of shared memory ring buffer per decoder process",
+        type=int,
+        action="store",
+        metavar="int",
+    )
+
     # TODO add options to select output processing
 
     return parser.parse_args(args)
@@ -91,10 +177,15 @@ def parse_args(args):
 class _NetFlowUDPHandler(socketserver.DatagramRequestHandler):
     def handle(self):
         client_addr = self.client_address[0]  # [1] contains the port.
-        export_packet = self.request[0]
+        export_packet, client_addr = relay.unwrap(
+            self.request[0], client_addr, trusted
+        )
 
         # collecting and output processing
-        process(client_addr, export_packet, None)
+        try:
+            dispatcher.parse_packet(export_packet, client_addr)
+        except Exception as e:
+            logger.error("Failed to parse from %s: %r", client_addr, e)
 
 
 def start_listener(socket_type, addr):
@@ -110,6 +201,103 @@ def start_listener(socket_type, addr):
         logger.error("There's no TCP without IPFIX support, exiting...")
 
 
+def start_relay(addr, args):
+    """Forward what is received on addr as given by args
+
+    Args:
+        addr    `str`,`int` tuple (host, port)
+        args    `argparse.Namespace` with destinations, duplicates, pool,
+                batch, raw and trusted
+    """
+    fwd = relay.Relay(
+        args.destinations,
+        args.duplicates,
+        pool=args.pool,
+        batch=args.batch,
+        raw=args.raw,
+        trusted=args.trusted,
+    )
+    sock = relay.listen(*addr)
+    try:
+        fwd.serve(sock)
+    finally:
+        sock.close()
+        fwd.close()
+        logger.info("Relay stats %s", fwd.stats())
+
+
+def _decode(ring, loglevel):
+    """
+    Decoder process: parse what comes through ring until its input closes
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # drain, then exit
+    setup_logging(loglevel)
+    dispatcher = Dispatcher()
+    parse = dispatcher.parse_packet
+
+    def handle(datagram, ipa, ts):
+        try:
+            parse(datagram, ipa)
+        except Exception as e:
+            logger.error("Failed to parse from %s: %r", ipa, e)
+
+    try:
+        ring.consume(handle)
+    finally:
+        logger.info("Parsed %s", dispatcher.stats())
+        ring.close()
+
+
+def start_decoders(addr, args):
+    """Receive on addr, hand datagrams to decoder processes by exporter
+
+    Args:
+        addr    `str`,`int` tuple (host, port)
+        args    `argparse.Namespace` with decode_processes, ring_size and
+                loglevel
+    """
+    rings = [
+        shmring.Ring(size=args.ring_size) for _ in range(args.decode_processes)
+    ]
+    procs = [
+        multiprocessing.Process(
+            target=_decode, args=(ring, args.loglevel), name="decoder-%d" % i
+        )
+        for i, ring in enumerate(rings)
+    ]
+    for proc in procs:
+        proc.start()
+    sock = relay.listen(*addr)
+    sock.settimeout(1)
+    recvfrom = sock.recvfrom
+    shard = {}  # exporter -> ring
+    last = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() - last > 60:
+                last = time.monotonic()
+                logger.info("Ring stats %s", [r.stats() for r in rings])
+            try:
+                datagram, client = recvfrom(65535)
+            except socket.timeout:
+                continue
+            datagram, ipa = relay.unwrap(datagram, client[0], trusted)
+            ring = shard.get(ipa)
+            if ring is None:
+                n = zlib.crc32(ipa.encode()) % len(rings)
+                ring = shard[ipa] = rings[n]
+            ring.put(datagram, ipa)
+    finally:
+        sock.close()
+        for ring in rings:
+            ring.close_input()
+        for proc in procs:
+            proc.join()
+        for ring in rings:
+            logger.info("Ring stats %s", ring.stats())
+            ring.close()
+
+
 def setup_logging(loglevel):
     """Setup basic logging
 
@@ -131,15 +319,32 @@ def main(args):
     Args:
       args ([str]): command line parameter list
     """
+    global dispatcher, trusted
     args = parse_args(args)
     setup_logging(args.loglevel)
+    trusted = frozenset(args.trusted)
 
     logger.info("Starting version {}".format(__version__,))
     logger.info("Args {}".format(vars(args)))
+    decoders = args.decode_processes > 0
+    if decoders and not shmring.supported():
+        logger.warning(
+            "No --decode-processes on %s, decoding in this process",
+            platform.machine(),
+        )
+        decoders = False
     try:
-        start_listener(args.socket, (args.host, args.port))
+        if args.destinations:
+            start_relay((args.host, args.port), args)
+        elif decoders:
+            start_decoders((args.host, args.port), args)
+        else:
+            dispatcher = Dispatcher()
+            start_listener(args.socket, (args.host, args.port))
     except KeyboardInterrupt:
         logger.info("Shutting down...")
+    if dispatcher is not None:
+        logger.info("Parsed %s", dispatcher.stats())
 
 
 def run():
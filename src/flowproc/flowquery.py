@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Query flows kept in a flow store (a bit like tcpdump)
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+from datetime import datetime
+
+from flowproc import __version__
+from flowproc import util
+from flowproc.flowstore import FlowStore
+from flowproc.flowstore import Query
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# global settings
+logger = logging.getLogger()  # root
+fmt = logging.Formatter("%(levelname)-8s %(name)s: %(message)s")
+sh = logging.StreamHandler(sys.stderr)
+sh.setFormatter(fmt)
+logger.addHandler(sh)
+
+
+def timestamp(arg):
+    """
+    Return unix time for either a number or an ISO 8601 date (local time)
+    """
+    try:
+        return float(arg)
+    except ValueError:
+        return datetime.fromisoformat(arg).timestamp()
+
+
+def parse_args(args):
+    """
+    Parse command line parameters
+    """
+    parser = argparse.ArgumentParser(
+        description="Query flows kept in a flow store"
+    )
+    parser.add_argument(
+        dest="store", help="flow store directory", type=str, metavar="STORE"
+    )
+    parser.add_argument(
+        "--start",
+        help="earliest receive time (unix time or ISO 8601, inclusive)",
+        type=timestamp,
+    )
+    parser.add_argument(
+        "--end",
+        help="latest receive time (unix time or ISO 8601, exclusive)",
+        type=timestamp,
+    )
+    parser.add_argument("--exporter", help="exporter ip address", type=str)
+    parser.add_argument(
+        "--host", help="source or destination ip address", type=str
+    )
+    parser.add_argument(
+        "--net", help="source or destination network (CIDR)", type=str
+    )
+    parser.add_argument(
+        "--port", help="source or destination port", type=int
+    )
+    parser.add_argument(
+        "--proto", help="protocol number or label (e.g. 'tcp')", type=str
+    )
+    parser.add_argument(
+        "--stats",
+        help="print pruning statistics to stderr",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-d",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG,
+    )
+    parser.add_argument(
+        "-V",
+        action="version",
+        version="flowproc {ver}".format(ver=__version__),
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Main entry point allowing external calls
+    """
+    args = parse_args(args)
+    logger.setLevel(logging.WARNING) if not args.loglevel else logger.setLevel(
+        args.loglevel
+    )
+
+    query = Query(
+        start=args.start,
+        end=args.end,
+        exporter=args.exporter,
+        host=args.host,
+        net=args.net,
+        port=args.port,
+        proto=args.proto,
+    )
+    try:
+        for ts, exporter, rec in FlowStore(args.store).query(query):
+            print(
+                datetime.fromtimestamp(ts).isoformat(),
+                exporter,
+                json.dumps(util.render_addresses([rec])[0]),
+            )
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+    if args.stats:
+        print(query.stats, file=sys.stderr)
+
+
+def run():
+    """
+    Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only flow store with statistics for predicate pushdown
+
+Records are kept as JSON lines in segment files which roll over after a
+configurable number of records. Segments are written in row groups, and for
+every row group the segment's index file keeps min/max statistics (time,
+addresses, ports), the set of exporters and protocols and a bloom filter on
+all addresses seen. A `Query` consults these first and only reads row groups
+which may contain matching records.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from ipaddress import IPv4Address
+from ipaddress import IPv6Address
+from ipaddress import ip_address
+from ipaddress import ip_network
+
+from flowproc import util
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+SEGMENT_PREFIX = "flows-"
+SEGMENT_SUFFIX = ".jsonl"
+INDEX_SUFFIX = ".idx"
+
+
+class BloomFilter:
+    """
+    Plain bloom filter over `bytes` keys (double hashing on blake2b)
+    """
+
+    def __init__(self, nbits, nhashes=7, bits=None):
+        self.nbits = nbits
+        self.nhashes = nhashes
+        self.bits = bytearray(bits) if bits else bytearray((nbits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, n):
+        """
+        Return an empty filter sized for about 1% false positives at `n` keys
+        """
+        nbits = max(64, 10 * n)
+        return cls(nbits + (-nbits % 8))
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(key)
+        )
+
+    def dump(self):
+        return {"m": self.nbits, "k": self.nhashes, "bits": self.bits.hex()}
+
+    @classmethod
+    def load(cls, d):
+        return cls(d["m"], d["k"], bytes.fromhex(d["bits"]))
+
+
+def _as_dict(rec):
+    """
+    Return records given as named tuples (V5 `FlowRec` etc.) as `dict`
+    """
+    return rec._asdict() if hasattr(rec, "_asdict") else rec
+
+
+def _address(key, value):
+    """
+    Return an `ip_address` for a record value under key (`int`, `str` or
+    packed `bytes`)
+    """
+    if isinstance(value, int):
+        return IPv6Address(value) if "IPV6" in key else IPv4Address(value)
+    return ip_address(value)
+
+
+def _addresses(rec):
+    """
+    Yield all source and destination addresses found in record
+    """
+    for dim in ("srcaddr", "dstaddr"):
+        for key in util.FIELD_ALIASES[dim]:
+            value = rec.get(key)
+            if value is not None:
+                yield _address(key, value)
+
+
+def _ports(rec):
+    for dim in ("srcport", "dstport"):
+        for key in util.FIELD_ALIASES[dim]:
+            value = rec.get(key)
+            if isinstance(value, int):
+                yield value
+
+
+def _proto(rec):
+    for key in util.FIELD_ALIASES["proto"]:
+        value = rec.get(key)
+        if value is not None:
+            return proto_to_int(value)
+    return None
+
+
+def proto_to_int(proto):
+    """
+    Return protocol number for `int` or label (e.g. 'tcp') given, else `None`
+    """
+    if isinstance(proto, int):
+        return proto
+    if proto.isdigit():
+        return int(proto)
+    return util.proto_to_num(proto)  # pretty-printed records
+
+
+def _minmax(old, value):
+    return [value, value] if old is None else [
+        min(old[0], value), max(old[1], value)
+    ]
+
+
+class _RowGroupStats:
+    """
+    Collect statistics while records of one row group get buffered
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = None
+        self.v4 = None
+        self.v6 = None
+        self.ports = None
+        self.exporters = set()
+        self.protos = set()
+        self.keys = set()
+
+    def add(self, ts, exporter, rec):
+        self.count += 1
+        self.time = _minmax(self.time, ts)
+        self.exporters.add(exporter)
+        for ipa in _addresses(rec):
+            if ipa.version == 4:
+                self.v4 = _minmax(self.v4, int(ipa))
+            else:
+                self.v6 = _minmax(self.v6, int(ipa))
+            self.keys.add(ipa.packed)
+        for port in _ports(rec):
+            self.ports = _minmax(self.ports, port)
+        proto = _proto(rec)
+        if proto is not None:
+            self.protos.add(proto)
+
+    def dump(self, offset, length):
+        bloom = BloomFilter.for_capacity(len(self.keys))
+        for key in self.keys:
+            bloom.add(key)
+        return {
+            "offset": offset,
+            "length": length,
+            "count": self.count,
+            "time": self.time,
+            "exporters": sorted(self.exporters),
+            "v4": self.v4,
+            "v6": self.v6,
+            "ports": self.ports,
+            "protos": sorted(self.protos),
+            "bloom": bloom.dump(),
+        }
+
+
+def _json_default(obj):
+    # packed addresses, MACs etc.
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.hex()
+    return str(obj)
+
+
+class FlowStore:
+    """
+    Responsibility: write records to and read them back from a directory
+    """
+
+    def __init__(self, path, rowgroup=4096, segsize=262144, tag=None):
+        """
+        Args:
+            path        `str`: directory holding segment and index files
+            rowgroup    `int`: records per row group
+            segsize     `int`: records per segment file
+            tag         `str`: added to segment names, to tell several
+                        stores writing the same directory apart
+        """
+        self.path = path
+        self.tag = "-" + tag if tag else ""
+        self.rowgroup = rowgroup
+        self.segsize = segsize
+        self._segment = None
+        self._groups = []
+        self._seg_count = 0
+        self._seg_seq = 0
+        self._lines = []
+        self._stats = _RowGroupStats()
+
+    def __repr__(self):
+        return "FlowStore({})".format(self.path)
+
+    def append(self, exporter, records, ts=None):
+        """
+        Add records received from exporter at ts (defaults to now)
+
+        Args:
+            exporter    `str`: ip address of exporter
+            records     iterable of `dict` or named tuples
+            ts          `float`: unix time
+        """
+        ts = time.time() if ts is None else ts
+        for rec in records:
+            rec = _as_dict(rec)
+            self._lines.append(
+                json.dumps(
+                    {"t": ts, "exporter": exporter, "rec": rec},
+                    default=_json_default,
+                )
+            )
+            self._stats.add(ts, exporter, rec)
+            if len(self._lines) >= self.rowgroup:
+                self.flush()
+
+    def flush(self):
+        """
+        Write buffered records as a row group and update the segment index
+        """
+        if not self._lines:
+            return
+        if self._segment is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._segment = os.path.join(
+                self.path,
+                # fixed width to have names sort by time
+                "{}{:017.6f}-{:04d}{}{}".format(
+                    SEGMENT_PREFIX,
+                    self._stats.time[0],
+                    self._seg_seq,
+                    self.tag,
+                    SEGMENT_SUFFIX,
+                ),
+            )
+            self._groups = []
+            self._seg_count = 0
+            self._seg_seq += 1
+
+        data = ("\n".join(self._lines) + "\n").encode()
+        with open(self._segment, "ab") as fh:
+            offset = fh.tell()
+            fh.write(data)
+        self._groups.append(self._stats.dump(offset, len(data)))
+        self._seg_count += self._stats.count
+        self._write_index()
+
+        self._lines = []
+        self._stats = _RowGroupStats()
+        if self._seg_count >= self.segsize:
+            self._segment = None  # roll over on next flush
+
+    def _write_index(self):
+        index = self._segment + INDEX_SUFFIX
+        tmp = index + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(
+                {
+                    "segment": os.path.basename(self._segment),
+                    "groups": self._groups,
+                },
+                fh,
+            )
+        os.replace(tmp, index)  # readers never see a partial index
+
+    def close(self):
+        self.flush()
+        self._segment = None
+
+    def __call__(self, exporter, records):
+        """
+        Make the store usable wherever an output callable is expected -
+        records reprocessed from capture files are stored at their export
+        time (`flowproc.util.EXPORTED`), else at the time received
+        """
+        self.append(exporter, records, util.EXPORTED.get())
+
+    def indexes(self):
+        """
+        Return paths of all index files, oldest segment first
+        """
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            os.path.join(self.path, name)
+            for name in names
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(INDEX_SUFFIX)
+        )
+
+    def query(self, query):
+        """
+        Yield (ts, exporter, record) for all records stored matching query
+
+        Args:
+            query       `Query`
+        """
+        for index in self.indexes():
+            with open(index) as fh:
+                idx = json.load(fh)
+            query.stats["files"] += 1
+            groups = [g for g in idx["groups"] if query.may_match(g)]
+            query.stats["groups"] += len(idx["groups"])
+            query.stats["groups_skipped"] += len(idx["groups"]) - len(groups)
+            if not groups:
+                query.stats["files_skipped"] += 1
+                continue
+
+            segment = os.path.join(self.path, idx["segment"])
+            with open(segment, "rb") as fh:
+                for group in groups:
+                    fh.seek(group["offset"])
+                    for line in fh.read(group["length"]).splitlines():
+                        row = json.loads(line)
+                        query.stats["records_read"] += 1
+                        if query.match(row["t"], row["exporter"], row["rec"]):
+                            query.stats["records_matched"] += 1
+                            yield row["t"], row["exporter"], row["rec"]
+
+
+class Query:
+    """
+    Responsibility: decide which row groups to read and which records match
+
+    All criteria given are ANDed, addresses and ports match on either source
+    or destination.
+    """
+
+    def __init__(
+        self,
+        start=None,
+        end=None,
+        exporter=None,
+        host=None,
+        net=None,
+        port=None,
+        proto=None,
+    ):
+        """
+        Args:
+            start       `float`: unix time, inclusive
+            end         `float`: unix time, exclusive
+            exporter    `str`: ip address of exporter
+            host        `str`: ip address
+            net         `str`: network in CIDR notation
+            port        `int`: port number
+            proto       `int` or `str`: protocol number or label
+        """
+        self.start = start
+        self.end = end
+        self.exporter = ip_address(exporter).exploded if exporter else None
+        self.host = ip_address(host) if host else None
+        self.net = ip_network(net, strict=False) if net else None
+        self.port = port
+        self.proto = None if proto is None else proto_to_int(proto)
+        if proto is not None and self.proto is None:
+            raise ValueError("Unknown protocol {}".format(proto))
+        self.stats = dict.fromkeys(
+            (
+                "files",
+                "files_skipped",
+                "groups",
+                "groups_skipped",
+                "records_read",
+                "records_matched",
+            ),
+            0,
+        )
+
+    @staticmethod
+    def _overlaps(minmax, lo, hi):
+        return minmax is not None and minmax[0] <= hi and lo <= minmax[1]
+
+    def may_match(self, group):
+        """
+        Return `False` if statistics of row group rule out any match
+        """
+        tmin, tmax = group["time"]
+        if self.start is not None and tmax < self.start:
+            return False
+        if self.end is not None and tmin >= self.end:
+            return False
+        if self.exporter and not any(
+            ip_address(e).exploded == self.exporter for e in group["exporters"]
+        ):
+            return False
+        if self.proto is not None and self.proto not in group["protos"]:
+            return False
+        if self.port is not None and not self._overlaps(
+            group["ports"], self.port, self.port
+        ):
+            return False
+        for ipa in (self.host, self.net):
+            if ipa is None:
+                continue
+            if isinstance(ipa, (IPv4Address, IPv6Address)):
+                lo = hi = int(ipa)
+            else:
+                lo = int(ipa.network_address)
+                hi = int(ipa.broadcast_address)
+            minmax = group["v4"] if ipa.version == 4 else group["v6"]
+            if not self._overlaps(minmax, lo, hi):
+                return False
+        if self.host is not None:
+            if self.host.packed not in BloomFilter.load(group["bloom"]):
+                return False
+        return True
+
+    def match(self, ts, exporter, rec):
+        """
+        Return `True` if record received at ts from exporter matches
+        """
+        if self.start is not None and ts < self.start:
+            return False
+        if self.end is not None and ts >= self.end:
+            return False
+        if self.exporter and ip_address(exporter).exploded != self.exporter:
+            return False
+        if self.proto is not None and _proto(rec) != self.proto:
+            return False
+        if self.port is not None and self.port not in _ports(rec):
+            return False
+        if self.host is not None or self.net is not None:
+            addresses = list(_addresses(rec))
+            if self.host is not None and self.host not in addresses:
+                return False
+            if self.net is not None and not any(
+                ipa in self.net for ipa in addresses
+            ):
+                return False
+        return True
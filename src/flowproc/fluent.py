@@ -1,45 +1,295 @@
-# https://gist.github.com/thinkingserious/d1b06ee12a3613c0dc3b
+# -*- coding: utf-8 -*-
+"""
+Fluent interface to declare record processing, compiled to one callable
 
-import sys
+Stages get chained declaratively (every call returns a new `Fluent`):
 
-from ipaddress import ip_address
+    pipeline = (
+        Fluent()
+        .filter(lambda r: r.PROTOCOL == 6)
+        .aggregate("bytes", key=lambda r: r.IPV4_SRC_ADDR,
+                   value=lambda r: r.IN_BYTES)
+        .enrich("SERVICE", lambda r: util.port_to_str(r.L4_DST_PORT))
+        .sink(FlowStore("/var/lib/flowproc"))
+        .compile()
+    )
+
+Parsers emit named tuples, fields are attributes - `enrich` turns records
+into `dict`s though, stages after it look fields up by key.
+
+`compile` fuses all record-level stages into a single loop generated once,
+so a batch costs one Python function call plus one call per stage function
+and record - no intermediate lists. Sinks come last and get called once per
+batch with the records surviving. Every stage counts records in and out.
+"""
+
+import logging
+import operator
+import time
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+
+
+def _enriched(rec, name, value):
+    """
+    Set field name in a `dict` record (named tuples are converted first)
+    """
+    if hasattr(rec, "_asdict"):
+        rec = rec._asdict()
+    rec[name] = value
+    return rec
+
+
+class Stage:
+    """
+    Responsibility: one step in a pipeline and its counters
+    """
+
+    KINDS = ("filter", "map", "enrich", "aggregate", "sink")
+
+    def __init__(self, kind, func, name=None, **kwargs):
+        if kind not in Stage.KINDS:
+            raise ValueError("Unknown stage kind '{}'".format(kind))
+        self.kind = kind
+        self.func = func
+        self.name = name or "{}:{}".format(
+            kind, getattr(func, "__name__", type(func).__name__)
+        )
+        self.kwargs = kwargs
+        self.count_in = 0
+        self.count_out = 0
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, self.name)
 
 
 class Fluent:
-    def __init__(self, cache=None):
-        self._cache = cache or []
+    """
+    Responsibility: collect stages, method chaining returns new instances
+    """
+
+    def __init__(self, stages=()):
+        self._stages = tuple(stages)
 
-    # Build the cache, and handle special cases
-    def _(self, name):
+    def _(self, kind, func, name=None, **kwargs):
         # Enables method chaining
-        return Fluent(self._cache+[name])
+        return Fluent(self._stages + (Stage(kind, func, name, **kwargs),))
+
+    def filter(self, predicate, name=None):
+        """
+        Keep records for which predicate(record) is true
+        """
+        return self._("filter", predicate, name)
+
+    def map(self, func, name=None):
+        """
+        Replace records by func(record)
+        """
+        return self._("map", func, name)
+
+    def enrich(self, field, func, name=None):
+        """
+        Add field with value func(record) to records
+        """
+        return self._("enrich", func, name or "enrich:" + field, field=field)
+
+    def aggregate(
+        self, name, key, value=lambda r: 1, reduce=operator.add, initial=0
+    ):
+        """
+        Fold value(record) into a table under key(record), records pass on
+
+        Args:
+            name        `str`: to retrieve the table from `Pipeline`
+            key         callable returning a hashable for records
+            value       callable returning the value to fold in
+            reduce      callable(accumulated, value)
+            initial     starting value for new keys
+        """
+        return self._(
+            "aggregate", key, name, value=value, reduce=reduce, initial=initial
+        )
+
+    def sink(self, func, name=None):
+        """
+        Hand surviving records to func(exporter, records) once per batch
+        """
+        return self._("sink", func, name)
+
+    def compile(self):
+        """
+        Return a `Pipeline` running all stages declared so far
+        """
+        return Pipeline(self._stages)
+
+    def __repr__(self):
+        return " -> ".join(stage.name for stage in self._stages)
+
+
+class Pipeline:
+    """
+    Responsibility: run records through compiled stages batch by batch
+
+    Call with (exporter, records) as parsers do with their output.
+    """
+
+    def __init__(self, stages):
+        # own copies, counters must not be shared between pipelines
+        self.stages = [
+            Stage(s.kind, s.func, s.name, **s.kwargs) for s in stages
+        ]
+        self.tables = {}
+        self.batches = 0
+        self.records = 0
+        self.seconds = 0.0
+
+        record_stages = []
+        self.sinks = []
+        for stage in self.stages:
+            if stage.kind == "sink":
+                self.sinks.append(stage)
+            elif self.sinks:
+                raise ValueError(
+                    "Stage {} must not follow a sink".format(stage.name)
+                )
+            else:
+                record_stages.append(stage)
+        self._record_stages = record_stages
+        self._run = self._generate(record_stages)
+
+    def _generate(self, stages):
+        """
+        Generate the fused loop over records, avoiding all per-stage
+        overhead but the calls to stage functions
+        """
+        namespace = {"_enriched": _enriched}
+        params = []
+        body = []
+        for i, stage in enumerate(stages):
+            f = "_f{:d}".format(i)
+            namespace[f] = stage.func
+            params.append(f)
+            if stage.kind == "filter":
+                body += ["if not {}(r):".format(f), "    continue"]
+            elif stage.kind == "map":
+                body += ["r = {}(r)".format(f)]
+            elif stage.kind == "enrich":
+                body += [
+                    "r = _enriched(r, {!r}, {}(r))".format(
+                        stage.kwargs["field"], f
+                    )
+                ]
+            elif stage.kind == "aggregate":
+                table = self.tables.setdefault(stage.name, {})
+                a, v, red, ini = (
+                    "_a{:d}".format(i),
+                    "_v{:d}".format(i),
+                    "_r{:d}".format(i),
+                    "_i{:d}".format(i),
+                )
+                namespace.update(
+                    {
+                        a: table,
+                        v: stage.kwargs["value"],
+                        red: stage.kwargs["reduce"],
+                        ini: stage.kwargs["initial"],
+                    }
+                )
+                params += [a, v, red, ini]
+                body += [
+                    "k = {}(r)".format(f),
+                    "{a}[k] = {red}({a}.get(k, {ini}), {v}(r))".format(
+                        a=a, red=red, ini=ini, v=v
+                    ),
+                ]
+            body.append("n{:d} += 1".format(i))
 
-    # Final method call accepting an argument
-    def process(self, data):
-        for func in self._cache:
-            # Cool, yep - just inspect the cache and check if sequence found
-            # is allowed consulting a state transition table :))
-            data = func(data)
+        counters = ["n{:d}".format(i) for i in range(len(stages))]
+        # stage functions bound as defaults for fast local lookup
+        src = [
+            "def _run({}):".format(
+                ", ".join(
+                    ["batch", "_counts"]
+                    + ["{0}={0}".format(p) for p in params]
+                )
+            )
+        ]
+        src.append("    out = []")
+        src.append("    append = out.append")
+        if counters:
+            src.append("    {} = 0".format(" = ".join(counters)))
+        src.append("    for r in batch:")
+        src += ["        " + line for line in body]
+        src.append("        append(r)")
+        for i, n in enumerate(counters):
+            src.append("    _counts[{:d}] += {}".format(i, n))
+        src.append("    return out")
 
-    # Reflection to get an object
-    def __getattr__(self, name):
-        obj = globals()[name]
-        return self._(obj)
+        self.source = "\n".join(src)
+        exec(compile(self.source, "<pipeline>", "exec"), namespace)
+        return namespace["_run"]
 
-    # Called with the object is deleted
-    def __del__(self):
-        print('Deleting', self)
+    def __call__(self, exporter, batch):
+        """
+        Run batch of records received from exporter through all stages
 
+        Return:
+            `list` of records surviving
+        """
+        start = time.perf_counter()
+        batch = batch if isinstance(batch, list) else list(batch)
+        counts = [0] * len(self._record_stages)
+        out = self._run(batch, counts)
 
-def to_ip(data):
-    return ip_address(int(data))
+        count_in = len(batch)
+        for stage, count_out in zip(self._record_stages, counts):
+            stage.count_in += count_in
+            stage.count_out += count_out
+            count_in = count_out
+        for stage in self.sinks:
+            stage.count_in += len(out)
+            if out:
+                stage.func(exporter, out)
+            stage.count_out += len(out)
 
+        self.batches += 1
+        self.records += len(batch)
+        self.seconds += time.perf_counter() - start
+        return out
 
-def print_ip(data):
-    print(data)
-    return(data)
+    def close(self):
+        """
+        Close sinks which can be closed (e.g. to flush a `FlowStore`)
+        """
+        for stage in self.sinks:
+            close = getattr(stage.func, "close", None)
+            if close:
+                close()
 
+    def table(self, name):
+        """
+        Return the `dict` aggregated by stage name
+        """
+        return self.tables[name]
 
-fluent = Fluent()
-chain = fluent.to_ip.print_ip
-chain.process(sys.argv[1] if len(sys.argv) > 1 else 0)
+    def stats(self):
+        """
+        Return throughput counters, overall and per stage
+        """
+        return {
+            "batches": self.batches,
+            "records": self.records,
+            "seconds": round(self.seconds, 6),
+            "records_per_sec": round(self.records / self.seconds)
+            if self.seconds
+            else None,
+            "stages": [
+                {"stage": s.name, "in": s.count_in, "out": s.count_out}
+                for s in self.stages
+            ],
+        }
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for IPFIX (NetFlow V10) messages
+
+IPFIX differs from NetFlow V9 in its header, in set IDs (2 for templates,
+3 for options templates) and in the template records, which announce
+enterprise-specific fields, variable length fields and withdrawals. Data
+Sets decode exactly like V9 Data FlowSets - they are handed over to
+`v9_parser.parse_data_flowset` and thus get its output, filter, joins and
+upscaling.
+
+Templates are registered like V9 ones with two adaptions:
+
+- Enterprise-specific field types get the enterprise bit kept, 0x8000 |
+  element ID, so they don't collide with IANA ones (the enterprise number
+  itself is skipped).
+- Options templates get scope fields registered as option fields - IPFIX
+  scopes are ordinary information elements, not V9 scope types.
+
+Templates with variable length fields can't be decoded by the fixed layout
+record codecs, they get skipped (and their Data Sets with them).
+"""
+
+import logging
+import struct
+
+from flowproc import v9_parser
+from flowproc.collector_state import Collector
+from flowproc.logqueue import EXPORTER
+from flowproc.v9_classes import OptionsTemplate
+from flowproc.v9_classes import Template
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# global settings
+logger = logging.getLogger(__name__)
+HEADER = struct.Struct("!HHIII")
+SET_HEADER = struct.Struct("!HH")
+VARLEN = 65535
+skipped = 0  # templates with variable length fields
+
+
+def _fields(packed, start, count):
+    """
+    Return (field specifiers as flat `tuple` of type, length, offset after
+    them) - raises `struct.error` on truncation
+    """
+    tdata = []
+    for _ in range(count):
+        ftype, length = SET_HEADER.unpack_from(packed, start)
+        start += 4
+        if ftype & 0x8000:
+            start += 4  # enterprise number
+        tdata += (ftype, length)
+    return tuple(tdata), start
+
+
+def _withdraw(ipa, odid, tid):
+    if tid in (2, 3):  # all (options) templates
+        count = Template.discard_all(ipa, odid)
+    else:
+        count = int(Collector.unregister(ipa, odid, tid))
+    logger.info("Withdrawn %d templates (tid %d)", count, tid)
+
+
+def _register(cls, ipa, odid, tid, *args):
+    global skipped
+    if VARLEN in args[-1][1::2]:
+        skipped += 1
+        logger.warning("Skipping template %d with variable length fields", tid)
+        return
+    cls(ipa, odid, tid, *args)
+
+
+def parse_template_set(ipa, odid, packed):
+    """
+    Responsibility: parse Template Set
+
+    Args:
+        ipa         `str`: ip address of exporter
+        odid        `int`: Observation Domain ID
+        packed      `bytes`: data to parse
+
+    Return:
+        number of records processed
+    """
+    record_count = 0
+    start = 0
+    while start + 4 <= len(packed):  # less is padding
+        tid, fieldcount = SET_HEADER.unpack_from(packed, start)
+        start += 4
+        if fieldcount == 0:
+            _withdraw(ipa, odid, tid)
+        else:
+            tdata, start = _fields(packed, start, fieldcount)
+            _register(Template, ipa, odid, tid, tdata)
+        record_count += 1
+    return record_count
+
+
+def parse_options_template_set(ipa, odid, packed):
+    """
+    Responsibility: parse Options Template Set
+
+    Args:
+        ipa         `str`: ip address of exporter
+        odid        `int`: Observation Domain ID
+        packed      `bytes`: data to parse
+
+    Return:
+        number of records processed
+    """
+    record_count = 0
+    start = 0
+    while start + 4 <= len(packed):  # less is padding
+        tid, fieldcount = SET_HEADER.unpack_from(packed, start)
+        start += 4
+        if fieldcount == 0:
+            _withdraw(ipa, odid, tid)
+        else:
+            start += 2  # scope field count, scopes go with the options
+            tdata, start = _fields(packed, start, fieldcount)
+            _register(OptionsTemplate, ipa, odid, tid, (), tdata)
+        record_count += 1
+    return record_count
+
+
+def dispatch_set(ipa, odid, setid, packed):
+    """
+    Responsibility: dispatch Set data to the appropriate parser
+
+    Return:
+        number of records processed
+    """
+    if setid == 2:
+        return parse_template_set(ipa, odid, packed)
+    elif setid == 3:
+        return parse_options_template_set(ipa, odid, packed)
+    elif setid > 255:
+        return v9_parser.parse_data_flowset(ipa, odid, setid, packed)
+    logger.error("No implementation for set ID %d", setid)
+    return 0
+
+
+def parse_packet(datagram, ipa):
+    """
+    Responsibility: parse UDP packet received from IPFIX exporter
+
+    Args:
+        packet  `bytes`: next packet to parse
+        ipa     `str` or `int`: ip addr to use for exporter identification
+    """
+    record_count = 0
+
+    EXPORTER.set(ipa)  # log context
+    header = HEADER.unpack_from(datagram)
+    ver, length, exported, seq, odid = header
+    Collector.touch(ipa, odid)
+
+    start = HEADER.size
+    end = min(length, len(datagram))
+    while start + 4 <= end:
+        setid, setlen = SET_HEADER.unpack_from(datagram, start)
+        if setlen < 4 or start + setlen > end:
+            logger.error("Bad set length %d at offset %d", setlen, start)
+            break
+        record_count += dispatch_set(
+            ipa, odid, setid, datagram[start + 4 : start + setlen]
+        )
+        start += setlen
+
+    logger.info(
+        "Parsed %s, %d recs processed from %s", header, record_count, ipa
+    )
+
+    # stats
+    Collector.packets += 1
+    Collector.count += record_count  # no count in the header
+    Collector.record_count += record_count
@@ -0,0 +1,595 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Synthetic NetFlow V5, V9 and IPFIX exporters for load tests
+
+Each stream, an observation domain of an exporter, builds its datagrams in
+a buffer allocated up front. Per packet, only the header gets packed in
+place and a window of records generated at start (`POOL` of them, or a
+packet's worth if more, random but plausible values per field type) gets
+copied over the records - no objects get created on the way to the
+socket.
+
+Time is virtual: packet n is due at n / rate seconds after start. Header
+timestamps and template refresh go by it, so a capture file comes out
+as if sent at that rate. Sending is paced to the rate in bursts, a sender
+falling behind sends what's due without sleeping and the rate achieved
+gets reported - run with rate 0 to find where sender or collector
+saturate.
+
+Exporters get consecutive addresses from a base. Sent over loopback, each
+sends from its own address (Linux answers to all of 127.0.0.0/8), else
+with `--wrap` the relay header carries it (see `flowproc.relay`, the
+collector needs `--relay-from` the sending host). Capture files are
+datagrams back to back as `testreader` reads them, one file per exporter
+in a directory named by its address for several (the layout
+`flowproc.batch` expects).
+"""
+
+import argparse
+import ipaddress
+import logging
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+from flowproc import relay
+from flowproc.v5_parser import RECORD as V5_RECORD
+from flowproc.v5_parser import TYPES as V5_TYPES
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+VERSIONS = {"v5": 5, "v9": 9, "ipfix": 10}
+HEADERS = {
+    5: struct.Struct("!HHIIIIBBH"),
+    9: struct.Struct("!HHIIII"),
+    10: struct.Struct("!HHIII"),
+}
+SET_HEADER = struct.Struct("!HH")
+TEMPLATE_SET = {9: 0, 10: 2}
+TEMPLATE_ID = 256
+# type:length - addresses, ports, protocol, flags, bytes, packets, times
+FIELDS = "8:4,12:4,7:2,11:2,4:1,6:1,1:4,2:4,22:4,21:4"
+RECORDS = 30  # per data packet, V5 can't have more
+POOL = 64  # records generated per stream, packets copy windows of them
+BURST = 32  # packets sent between checks of the pace
+UPTIME = 3600 * 1000  # milliseconds exporters are up at start
+PREFIX = relay.HEADER_LEN  # room for the relay header in front
+MAXSIZE = 65507
+
+
+def parse_fields(spec):
+    """
+    Return field specifiers ((type, length), ...) from "type:length,..."
+    """
+    try:
+        fields = tuple(
+            tuple(int(n) for n in field.split(":"))
+            for field in spec.split(",")
+        )
+    except ValueError:
+        fields = ()
+    if not fields or any(
+        len(f) != 2 or not 0 < f[0] < 32768 or not 0 < f[1] <= 16
+        for f in fields
+    ):
+        raise ValueError("Fields '{}' are not type:length,...".format(spec))
+    return fields
+
+
+def _value(ftype, length, rng):
+    """
+    Return a plausible `int` value for field type
+    """
+    if ftype in (8, 12, 15):  # IPv4 addresses
+        value = 0x0A000000 | rng.getrandbits(24)
+    elif ftype == 7:
+        value = rng.randrange(1024, 65536)
+    elif ftype == 11:
+        value = rng.choice((53, 80, 123, 443, 443, 443))
+    elif ftype == 4:
+        value = rng.choice((1, 6, 6, 6, 17, 17))
+    elif ftype == 6:
+        value = rng.choice((0x02, 0x10, 0x18, 0x11))
+    elif ftype in (1, 2):  # bytes, packets
+        value = rng.randrange(1, 1 << 14)
+    elif ftype in (21, 22):  # sysUpTime of last/first packet
+        value = rng.randrange(UPTIME - 60000, UPTIME)
+    else:
+        value = rng.getrandbits(8 * length)
+    return value & ((1 << 8 * length) - 1)
+
+
+class Stream:
+    """
+    Responsibility: build the datagrams of an exporter's observation domain
+    in buffers allocated once
+    """
+
+    def __init__(self, version, ipa, odid, fields, records, rng):
+        """
+        Args:
+            version     `int`: 5, 9 or 10
+            ipa         `str`: exporter address
+            odid        `int`: observation domain (V5: engine ID)
+            fields      ((type, length), ...), not for V5
+            records     `int`: records per data packet
+            rng         `random.Random` to generate values with
+        """
+        self.version = version
+        self.ipa = ipa
+        self.odid = odid
+        self.header = HEADERS[version]
+        self.records = records
+        self.seq = 0  # V9: packets, else records sent before
+        self.packets = 0
+        self.wrapper = relay.wrap(b"", ipa)
+        # records generated, at least a packet's worth
+        self.variants = max(POOL, records)
+
+        if version == 5:
+            if records > RECORDS:
+                raise ValueError("V5 packets hold up to 30 records")
+            lengths = [
+                struct.calcsize("!" + c)
+                for c in V5_RECORD.format.strip("!").replace("x", "")
+            ]
+            pool = b"".join(
+                V5_RECORD.pack(
+                    *(_value(t, n, rng) for t, n in zip(V5_TYPES, lengths))
+                )
+                for _ in range(self.variants)
+            )
+            self.reclen = V5_RECORD.size
+            self.template = None
+            sets = b""
+        else:
+            pool = b"".join(
+                b"".join(
+                    _value(t, n, rng).to_bytes(n, "big") for t, n in fields
+                )
+                for _ in range(self.variants)
+            )
+            self.reclen = sum(n for _, n in fields)
+            self.template = self._template(fields)
+            sets = SET_HEADER.pack(TEMPLATE_ID, 0)
+
+        # twice, so any window of records is one slice
+        self.pool = pool * 2
+        self.size = records * self.reclen
+        padding = -(len(sets) + self.size) % 4 if sets else 0
+        length = PREFIX + self.header.size + len(sets) + self.size + padding
+        if length - PREFIX > MAXSIZE:
+            raise ValueError("Data packets too large, use less records")
+        self.data = bytearray(length)
+        self.data[:PREFIX] = self.wrapper
+        self.offset = PREFIX + self.header.size + len(sets)
+        if sets:
+            SET_HEADER.pack_into(
+                self.data,
+                PREFIX + self.header.size,
+                TEMPLATE_ID,
+                len(sets) + self.size + padding,
+            )
+
+    def _template(self, fields):
+        tset = SET_HEADER.pack(TEMPLATE_ID, len(fields))
+        tset += b"".join(SET_HEADER.pack(t, n) for t, n in fields)
+        tset = SET_HEADER.pack(TEMPLATE_SET[self.version], 4 + len(tset)) + (
+            tset
+        )
+        packet = bytearray(PREFIX + self.header.size) + tset
+        packet[:PREFIX] = self.wrapper
+        return packet
+
+    def _pack_header(self, buf, count, now):
+        """
+        Pack header for count records into buf at time now (seconds since
+        the epoch), return datagram length
+        """
+        secs = int(now)
+        length = len(buf) - PREFIX
+        if self.version == 5:
+            uptime = UPTIME + int((now % 86400) * 1000)
+            self.header.pack_into(
+                buf,
+                PREFIX,
+                5,
+                count,
+                uptime & 0xFFFFFFFF,
+                secs,
+                int((now - secs) * 1e9),
+                self.seq & 0xFFFFFFFF,
+                0,
+                self.odid & 0xFF,
+                0,
+            )
+        elif self.version == 9:
+            uptime = UPTIME + int((now % 86400) * 1000)
+            self.header.pack_into(
+                buf,
+                PREFIX,
+                9,
+                count,
+                uptime & 0xFFFFFFFF,
+                secs,
+                self.seq & 0xFFFFFFFF,
+                self.odid,
+            )
+        else:
+            self.header.pack_into(
+                buf, PREFIX, 10, length, secs, self.seq & 0xFFFFFFFF, self.odid
+            )
+        return length
+
+    def template_packet(self, now):
+        """
+        Return the template packet (with room for the relay header in
+        front), `None` for V5
+        """
+        if self.template is None:
+            return None
+        self._pack_header(self.template, 1, now)
+        if self.version == 9:
+            self.seq += 1
+        return self.template
+
+    def data_packet(self, now, gap=0):
+        """
+        Return the next data packet (with room for the relay header in
+        front) - the buffer gets reused for the packet after
+
+        Args:
+            now     `float`: seconds since the epoch
+            gap     `int`: packets to act as if lost before this one
+        """
+        if gap:
+            self.seq += gap if self.version == 9 else gap * self.records
+        start = (self.packets % self.variants) * self.reclen
+        self.data[self.offset : self.offset + self.size] = self.pool[
+            start : start + self.size
+        ]
+        self._pack_header(self.data, self.records, now)
+        self.packets += 1
+        self.seq += 1 if self.version == 9 else self.records
+        return self.data
+
+
+class Generator:
+    """
+    Responsibility: interleave the packets of all streams in virtual time,
+    refresh templates and count
+    """
+
+    def __init__(
+        self,
+        version,
+        exporters=1,
+        domains=1,
+        fields=FIELDS,
+        records=RECORDS,
+        rate=10000,
+        template_interval=60,
+        gap_every=0,
+        gap=1,
+        base="127.0.0.1",
+        seed=0,
+    ):
+        """
+        Args:
+            version             `int`: 5, 9 or 10
+            exporters           `int`: exporters, with consecutive
+                                addresses from base
+            domains             `int`: observation domains per exporter
+            fields              `str`: "type:length,..." of the template
+            records             `int`: records per data packet
+            rate                `float`: packets per second, 0 for as fast
+                                as possible
+            template_interval   `float`: seconds between templates resent
+            gap_every           `int`: data packets per stream between
+                                sequence gaps, 0 for none
+            gap                 `int`: packets missing in a gap
+            base                `str`: first exporter's address
+            seed                `int`: for the values generated
+        """
+        rng = random.Random(seed)
+        fields = parse_fields(fields)
+        first = ipaddress.ip_address(base)
+        self.streams = [
+            Stream(version, str(first + i), odid, fields, records, rng)
+            for i in range(exporters)
+            for odid in range(domains)
+        ]
+        self.rate = rate
+        self.template_interval = template_interval
+        self.gap_every = gap_every
+        self.gap = gap
+        self.refreshed = {}  # stream -> virtual time of last template
+        # metrics
+        self.sent = 0
+        self.templates = 0
+        self.records = 0
+        self.bytes = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def exporters(self):
+        """
+        Return exporter addresses in order
+        """
+        return list(dict.fromkeys(s.ipa for s in self.streams))
+
+    def packets(self, count, start=None):
+        """
+        Yield (exporter, buffer) for count data packets and the templates
+        due in between, each buffer with room for the relay header in
+        front - and valid until the next one is yielded
+
+        Args:
+            count   `int`: data packets
+            start   `float`: seconds since the epoch of packet 0
+        """
+        start = time.time() if start is None else start
+        streams = self.streams
+        clock = time.perf_counter()
+        for n in range(count):
+            stream = streams[n % len(streams)]
+            if self.rate:
+                elapsed = n / self.rate
+            else:
+                elapsed = time.perf_counter() - clock
+            now = start + elapsed
+
+            last = self.refreshed.get(stream)
+            if stream.template is not None and (
+                last is None or elapsed - last >= self.template_interval
+            ):
+                self.refreshed[stream] = elapsed
+                self.templates += 1
+                yield stream.ipa, stream.template_packet(now)
+
+            gap = 0
+            if self.gap_every and stream.packets % self.gap_every == (
+                self.gap_every - 1
+            ):
+                gap = self.gap
+            self.records += stream.records
+            yield stream.ipa, stream.data_packet(now, gap)
+
+    def send(self, dest, count, wrap=False):
+        """
+        Send count data packets (and templates) to dest, (host, port),
+        paced to the rate - from the exporters' addresses unless wrap,
+        then with relay header from one socket
+        """
+        family = socket.getaddrinfo(*dest, type=socket.SOCK_DGRAM)[0][0]
+        socks = {}
+        for ipa in self.exporters():
+            if wrap and socks:
+                socks[ipa] = next(iter(socks.values()))
+                continue
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            if not wrap:
+                sock.bind((ipa, 0))
+            sock.connect(dest)
+            socks[ipa] = sock
+        skip = 0 if wrap else PREFIX
+
+        clock = time.perf_counter()
+        try:
+            for n, (ipa, buf) in enumerate(self.packets(count)):
+                if self.rate and n % BURST == 0:
+                    ahead = n / self.rate - (time.perf_counter() - clock)
+                    if ahead > 0:
+                        time.sleep(ahead)
+                try:
+                    self.bytes += socks[ipa].send(memoryview(buf)[skip:])
+                    self.sent += 1
+                except OSError as e:  # ENOBUFS, ECONNREFUSED
+                    self.errors += 1
+                    logger.debug("Sending failed: %r", e)
+        finally:
+            self.seconds = time.perf_counter() - clock
+            for sock in set(socks.values()):
+                sock.close()
+
+    def write(self, path, count):
+        """
+        Write count data packets (and templates) as capture file to path,
+        with several exporters to files in directories named by exporter
+        below path instead
+        """
+        exporters = self.exporters()
+        files = {}
+        clock = time.perf_counter()
+        try:
+            for ipa in exporters:
+                name = path
+                if len(exporters) > 1:
+                    os.makedirs(os.path.join(path, ipa), exist_ok=True)
+                    name = os.path.join(path, ipa, "loadgen.cap")
+                files[ipa] = open(name, "wb")
+            for ipa, buf in self.packets(count):
+                self.bytes += files[ipa].write(memoryview(buf)[PREFIX:])
+                self.sent += 1
+        finally:
+            self.seconds = time.perf_counter() - clock
+            for fh in files.values():
+                fh.close()
+
+    def stats(self):
+        """
+        Return metrics as `dict`
+        """
+        return {
+            "streams": len(self.streams),
+            "packets": self.sent,
+            "templates": self.templates,
+            "records": self.records,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "packets_per_sec": round(self.sent / self.seconds)
+            if self.seconds
+            else None,
+        }
+
+
+def parse_args(args):
+    """
+    Parse command line parameters
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate NetFlow/IPFIX load from synthetic exporters"
+    )
+    parser.add_argument(
+        dest="version", help="export version", choices=list(VERSIONS)
+    )
+    parser.add_argument(
+        "-d",
+        "--dest",
+        help="collector to send to (default 127.0.0.1:2055)",
+        type=relay.parse_destination,
+        default=("127.0.0.1", 2055),
+        metavar="HOST:PORT",
+    )
+    parser.add_argument(
+        "-w",
+        "--write",
+        help="write capture file (directory for several exporters) "
+        "instead of sending",
+        type=str,
+        action="store",
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "-n",
+        "--packets",
+        help="data packets to send (default 100000)",
+        type=int,
+        default=100000,
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        help="packets per second, 0 for as fast as possible "
+        "(default 10000)",
+        type=float,
+        default=10000,
+    )
+    parser.add_argument(
+        "-e",
+        "--exporters",
+        help="number of exporters (default 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--domains",
+        help="observation domains per exporter (default 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--base",
+        help="first exporter's address (default 127.0.0.1)",
+        type=str,
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--fields",
+        help="template fields as type:length,... (default {})".format(
+            FIELDS
+        ),
+        type=str,
+        default=FIELDS,
+    )
+    parser.add_argument(
+        "--records",
+        help="records per data packet (default {:d})".format(RECORDS),
+        type=int,
+        default=RECORDS,
+    )
+    parser.add_argument(
+        "--template-interval",
+        help="seconds between templates resent (default 60)",
+        type=float,
+        default=60,
+    )
+    parser.add_argument(
+        "--gap-every",
+        help="data packets per stream between sequence gaps (default 0, "
+        "none)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--gap",
+        help="packets missing per sequence gap (default 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--wrap",
+        help="send with relay header carrying the exporter address, from "
+        "one socket (for exporter addresses not local)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--seed",
+        help="seed for the values generated (default 0)",
+        type=int,
+        default=0,
+    )
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Main entry point allowing external calls
+    """
+    args = parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        gen = Generator(
+            VERSIONS[args.version],
+            args.exporters,
+            args.domains,
+            args.fields,
+            args.records,
+            args.rate,
+            args.template_interval,
+            args.gap_every,
+            args.gap,
+            args.base,
+            args.seed,
+        )
+    except ValueError as e:
+        print(e)
+        exit(1)
+    try:
+        if args.write:
+            gen.write(args.write, args.packets)
+        else:
+            gen.send(args.dest, args.packets, args.wrap)
+    except KeyboardInterrupt:
+        pass
+    print(gen.stats())
+
+
+def run():
+    """
+    Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Logging off the packet path
+
+`start` puts a queue handler in front of the real handlers, which then run
+in a listener thread. In the thread parsing packets a log call costs a
+`LogRecord` and a queue put - messages logged `%`-style get formatted by
+the listener only, and repeated warnings get dropped before even that.
+
+Records are stamped with the exporter in `EXPORTER`, parsers set it per
+packet, so formats may use `%(exporter)s` (see `FORMAT`).
+"""
+
+import contextvars
+import logging
+import queue
+
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+FORMAT = "[%(asctime)s] %(levelname)-8s %(name)s [%(exporter)s]: %(message)s"
+RATE_LIMIT = 10  # default seconds between repetitive warnings
+MAX_KEYS = 1024  # distinct messages tracked for rate limiting
+
+# exporter (ip address) being processed in the current context
+EXPORTER = contextvars.ContextVar("exporter", default="-")
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamp records with the exporter being processed
+    """
+
+    def filter(self, record):
+        record.exporter = EXPORTER.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let a message (by logger, level and unformatted message) at or above
+    level pass once per interval, the next one passing tells how many were
+    suppressed meanwhile
+    """
+
+    def __init__(self, interval=RATE_LIMIT, level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.seen = {}  # key -> [next time to pass, suppressed]
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+
+        key = (record.name, record.levelno, record.msg)
+        state = self.seen.get(key)
+        if state is not None and record.created < state[0]:
+            state[1] += 1
+            return False
+
+        if len(self.seen) >= MAX_KEYS:
+            # messages formatted before logging make distinct keys
+            self.seen = {
+                k: v for k, v in self.seen.items() if v[0] > record.created
+            }
+        self.seen[key] = [record.created + self.interval, 0]
+
+        suppressed = state[1] if state else 0
+        if suppressed and isinstance(record.args, tuple):
+            if record.args:
+                record.msg = str(record.msg) + " (%d similar suppressed)"
+                record.args += (suppressed,)
+            else:
+                record.msg = "{} ({:d} similar suppressed)".format(
+                    record.msg, suppressed
+                )
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueue records as they are, formatting is left to the listener's
+    handlers (records never leave the process)
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def start(handlers, target=None, rate_limit=RATE_LIMIT):
+    """
+    Route target logger's records through a queue to handlers run by a
+    listener thread, replacing target's handlers
+
+    Args:
+        handlers    sequence of `logging.Handler`
+        target      `logging.Logger`, default root
+        rate_limit  seconds between repetitive warnings, 0 for no limit
+
+    Return:
+        `QueueListener` started, to `stop` (flushing the queue) on shutdown
+    """
+    target = target or logging.getLogger()
+    records = queue.SimpleQueue()
+
+    handler = LazyQueueHandler(records)
+    handler.addFilter(ContextFilter())
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit))
+
+    for old in list(target.handlers):
+        target.removeHandler(old)
+    target.addHandler(handler)
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -10,7 +10,7 @@ import struct
 from collections import namedtuple
 from datetime import datetime
 from flowproc import util
-from ipaddress import ip_address
+from flowproc.logqueue import EXPORTER
 
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
@@ -83,10 +83,13 @@ class Collector(util.AbstractCollector):
 
         return format_string
 
-    def __init__(self, fields):
+    def __init__(self, fields, record_filter=None, upscale=False):
         """
         Args:
-            fields      either "all" or a subset of keys in SILK_TO_NFV5
+            fields          either "all" or a subset of keys in SILK_TO_NFV5
+            record_filter   `flowproc.flowfilter.Filter` or `None`
+            upscale         `True` to multiply packets and bytes by the
+                            sampling interval the header announces
         """
 
         # FIXME When fields not enumerated in sequential order given by struct,
@@ -101,11 +104,34 @@ class Collector(util.AbstractCollector):
         # format string for `struct.unpack`
         self.format_string = Collector._compose_format(self.fields)
 
+        # labels in the order of unpacked tuples, to filter before transform
+        self.unpacked_fields = [
+            k for k in Collector.SILK_TO_NFV5.keys() if k in self.fields
+        ]
+        self.keep = (
+            record_filter.compile(self.unpacked_fields, index=True)
+            if record_filter
+            else None
+        )
+
+        # positions of counters in unpacked tuples, to scale before transform
+        self.scaled = (
+            [
+                i
+                for i, k in enumerate(self.unpacked_fields)
+                if k in ("packets", "bytes")
+            ]
+            if upscale
+            else []
+        )
+        # sampling interval last seen per (exporter, engine_id)
+        self.sampling = {}
+
         # transform_pretty for now
         self.TRANSFORM_NFV5 = {
-            "sIP": lambda x: str(ip_address(x)),
-            "dIP": lambda x: str(ip_address(x)),
-            "nhIP": lambda x: str(ip_address(x)),
+            "sIP": util.ipv4_to_str,
+            "dIP": util.ipv4_to_str,
+            "nhIP": util.ipv4_to_str,
             "inNic": lambda x: x,
             "outNic": lambda x: x,
             "packets": lambda x: x,
@@ -114,7 +140,7 @@ class Collector(util.AbstractCollector):
             "eTime": lambda x: self._abs_time(x),
             "sPort": lambda x: util.port_to_str(x),
             "dPort": lambda x: util.port_to_str(x),
-            "flags": lambda x: util.tcpflags_h(x, brief=False),
+            "flags": lambda x: util.tcpflags_to_str(x, brief=False),
             "protocol": lambda x: util.proto_to_str(x),
             "tos": lambda x: x,
             "sASN": lambda x: x,
@@ -156,10 +182,12 @@ class Collector(util.AbstractCollector):
     def collect(self, client_addr, export_packet):
         """See `flowproc.util.AbstractCollector.collect`"""
 
+        EXPORTER.set(client_addr)  # log context
+
         # entry level test
         ver = util.get_header_version(export_packet)
         if ver != 5:
-            logger.error("Cannot process header version {}".format(ver))
+            logger.error("Cannot process header version %s", ver)
             return
 
         # get header
@@ -167,9 +195,10 @@ class Collector(util.AbstractCollector):
 
         # log export packet summary
         logger.debug(
-            "Received {:4d} bytes from observation dom {:d} at {}".format(
-                len(export_packet), header["engine_id"], client_addr
-            )
+            "Received %4d bytes from observation dom %d at %s",
+            len(export_packet),
+            header["engine_id"],
+            client_addr,
         )
 
         # prepare variables for record processing
@@ -180,13 +209,22 @@ class Collector(util.AbstractCollector):
             - header["SysUptime"] / 1000
         )
         logger.debug(
-            "Exporter started on {}".format(
-                datetime.fromtimestamp(self.exporter_start_t).strftime(
-                    "%b %m %Y %H:%M:%S"
-                )
-            )
+            "Exporter started on %s",
+            datetime.fromtimestamp(self.exporter_start_t),
         )
 
+        # sampling mode in the 2 upper bits, interval in the lower 14
+        interval = header["sampling_interval"] & 0x3FFF
+        key = (client_addr, header["engine_id"])
+        if self.sampling.get(key) != interval:
+            logger.info(
+                "Sampling interval %d (mode %d) for %s",
+                interval,
+                header["sampling_interval"] >> 14,
+                key,
+            )
+            self.sampling[key] = interval
+
         flowrec_iterable = []
 
         # loop over records
@@ -196,6 +234,12 @@ class Collector(util.AbstractCollector):
             record = export_packet[ptr : ptr + RECORD_LENGTH]
 
             unpacked = struct.unpack(self.format_string, record)
+            if self.keep and not self.keep(unpacked):
+                continue
+            if self.scaled and interval > 1:
+                unpacked = list(unpacked)
+                for pos in self.scaled:
+                    unpacked[pos] *= interval
             transformed = list(
                 map(lambda f, y: f(y), self.xform_list, unpacked)
             )
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Save template state to disk and restore it on startup
+
+Exporters send templates only every so often, a collector restarting with
+empty state drops all data until they do. With a snapshot written
+periodically and on shutdown, a restarted collector decodes right away.
+Templates older than a maximum age get discarded on restore, as exporters
+would have refreshed them long since (or went away).
+"""
+
+import json
+import logging
+import os
+
+from datetime import datetime
+
+from flowproc.collector_state import Collector
+from flowproc.v9_classes import OptionsTemplate
+from flowproc.v9_classes import Template
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+FORMAT = 1  # snapshot format version
+
+
+class SnapshotVisitor:
+    """
+    Return template state as nested `dict` ready for JSON, exporters keyed
+    like in `Collector.children`
+    """
+
+    def visit_Collector(self, host):
+        return {
+            "format": FORMAT,
+            "at": datetime.utcnow().isoformat(),  # TODO add timezone info
+            "exporters": {
+                str(ipa): child.accept(self)
+                for ipa, child in list(host.children.items())
+            },
+        }
+
+    def visit_Exporter(self, host):
+        return {
+            str(odid): child.accept(self)
+            for odid, child in list(host.children.items())
+        }
+
+    def visit_ObservationDomain(self, host):
+        # by name, classes may have been reloaded since instantiation
+        return [
+            dump_template(child)
+            for child in list(host.children.values())
+            if type(child).__name__ in ("Template", "OptionsTemplate")
+        ]
+
+
+def dump_template(template):
+    """
+    Return `Template` or `OptionsTemplate` as `dict`
+    """
+    d = {
+        "tid": template.tid,
+        "lastwrite": template.lastwrite.isoformat(),
+    }
+    if type(template).__name__ == "OptionsTemplate":
+        d["class"] = "OptionsTemplate"
+        d["scopes"] = list(template.scopes)
+        d["options"] = list(template.options)
+    else:
+        d["class"] = "Template"
+        d["tdata"] = list(template.tdata)
+    return d
+
+
+def load_template(ipa, odid, d):
+    """
+    Create (and thereby register) the template described by d, keeping its
+    original lastwrite
+    """
+    if d["class"] == "OptionsTemplate":
+        template = OptionsTemplate(
+            ipa, odid, d["tid"], tuple(d["scopes"]), tuple(d["options"])
+        )
+    else:
+        template = Template(ipa, odid, d["tid"], tuple(d["tdata"]))
+    template.lastwrite = datetime.fromisoformat(d["lastwrite"])
+    return template
+
+
+def save(path):
+    """
+    Write a snapshot of all templates to path (atomically)
+
+    Return:
+        number of templates saved
+    """
+    snapshot = Collector.accept(SnapshotVisitor())
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump(snapshot, fh)
+    os.replace(tmp, path)
+
+    count = sum(
+        len(templates)
+        for domains in snapshot["exporters"].values()
+        for templates in domains.values()
+    )
+    logger.info("Saved {:d} templates to {}".format(count, path))
+    return count
+
+
+def restore(path, maxage):
+    """
+    Register templates from snapshot at path, skipping those older than
+    maxage seconds
+
+    Return:
+        number of templates restored
+    """
+    try:
+        with open(path) as fh:
+            snapshot = json.load(fh)
+    except FileNotFoundError:
+        logger.info("No template snapshot at {}".format(path))
+        return 0
+    except ValueError as e:
+        logger.error("Ignoring bad template snapshot {}: {}".format(path, e))
+        return 0
+
+    if snapshot.get("format") != FORMAT:
+        logger.error(
+            "Ignoring template snapshot format {}".format(
+                snapshot.get("format")
+            )
+        )
+        return 0
+
+    now = datetime.utcnow()
+    count = 0
+    skipped = 0
+    for ipa, domains in snapshot["exporters"].items():
+        for odid, templates in domains.items():
+            for d in templates:
+                age = now - datetime.fromisoformat(d["lastwrite"])
+                if age.total_seconds() > maxage:
+                    skipped += 1
+                    continue
+                load_template(ipa, int(odid), d)
+                count += 1
+
+    logger.info(
+        "Restored {:d} templates from {}, {:d} expired".format(
+            count, path, skipped
+        )
+    )
+    return count
+
+
+def dump_exporter(ipa):
+    """
+    Return templates of exporter ipa like in a snapshot, by observation
+    domain - e.g. to seed another process with
+
+    Return:
+        `dict` (empty for exporters unknown)
+    """
+    exporter = Collector.children.get(ipa)
+    if exporter is None:
+        return {}
+    return exporter.accept(SnapshotVisitor())
+
+
+def load_exporter(ipa, domains):
+    """
+    Register templates of exporter ipa as returned by `dump_exporter`
+
+    Return:
+        number of templates loaded
+    """
+    count = 0
+    for odid, templates in domains.items():
+        for d in templates:
+            load_template(ipa, int(odid), d)
+            count += 1
+    return count
+
+
+def rebuild():
+    """
+    Re-create all templates from their own state, e.g. with classes and
+    codecs reloaded since they were created
+
+    Return:
+        number of templates rebuilt
+    """
+    snapshot = Collector.accept(SnapshotVisitor())
+    count = 0
+    for ipa, domains in snapshot["exporters"].items():
+        for odid, templates in domains.items():
+            for d in templates:
+                load_template(ipa, int(odid), d)
+                count += 1
+    return count
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Relay export packets to downstream collectors by exporter
+
+Only the version in the header is looked at. The exporter address picks
+the downstream collector by consistent hashing (`flowproc.cluster`), and
+a socket of its pool, so all packets of an exporter - templates and data -
+end up at the same collector, in order. A downstream reported unreachable
+is left out for a while, its exporters go to the next one on the ring.
+Datagrams read in one go are sent in batches per socket.
+
+Downstream, the sender of a relayed datagram is the relay. Unless relaying
+raw, the exporter address is therefore prepended:
+
+    MAGIC (4 bytes) | exporter address (16 bytes, IPv4 mapped) | datagram
+
+"FP" is no NetFlow/IPFIX version, so `unwrap` tells both kinds apart with
+a single comparison. Anyone able to send to a collector could prepend the
+header and pose as any exporter, so collectors only `unwrap` what their
+trusted relays (`--relay-from`) send. From anyone else, datagrams with the
+header are passed on as received and dropped as unknown version.
+"""
+
+import ipaddress
+import logging
+import selectors
+import socket
+import time
+import zlib
+
+from functools import lru_cache
+
+from flowproc import util
+from flowproc.cluster import HashRing
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+MAGIC = b"FPR1"
+HEADER_LEN = len(MAGIC) + 16
+VERSIONS = (5, 9, 10)  # forwarded, anything else is dropped
+POOL = 4  # sockets per destination
+BATCH = 64  # datagrams per socket before sending
+RCVBUF = 2 ** 22
+RETRY = 10  # seconds before relaying to a downstream marked down again
+
+
+def wrap(datagram, ipa):
+    """
+    Return datagram with the relay header for exporter ipa
+    """
+    return MAGIC + _packed(ipa) + datagram
+
+
+@lru_cache(maxsize=4096)
+def _packed(ipa):
+    address = ipaddress.ip_address(ipa)
+    if address.version == 4:
+        address = ipaddress.IPv6Address("::ffff:" + ipa)
+    return address.packed
+
+
+def unwrap(datagram, ipa, trusted=()):
+    """
+    Return (datagram, exporter) - with the relay header removed, if any and
+    sender ipa is among the trusted relays, else as received
+    """
+    if datagram[:4] != MAGIC or ipa not in trusted:
+        return datagram, ipa
+    return datagram[HEADER_LEN:], _unpacked(datagram[4:HEADER_LEN])
+
+
+@lru_cache(maxsize=4096)
+def _unpacked(packed):
+    address = ipaddress.IPv6Address(packed)
+    return str(address.ipv4_mapped or address)
+
+
+def parse_source(addr):
+    """
+    Return address addr normalized as the socket reports senders
+    """
+    return str(ipaddress.ip_address(addr))
+
+
+def parse_destination(dest):
+    """
+    Return (host, port) from "host:port" ("[v6addr]:port" for IPv6)
+    """
+    host, sep, port = dest.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError("Destination '{}' is not host:port".format(dest))
+    return host.strip("[]"), int(port)
+
+
+class Relay:
+    """
+    Responsibility: pick downstream and socket per exporter, forward
+    datagrams in batches and count
+    """
+
+    def __init__(
+        self,
+        destinations,
+        duplicates=(),
+        pool=POOL,
+        batch=BATCH,
+        raw=False,
+        trusted=(),
+    ):
+        """
+        Args:
+            destinations    [(`str`, `int`)]: collectors to balance over
+            duplicates      [(`str`, `int`)]: collectors to balance copies
+                            over, empty for no copies
+            pool            `int`: connected sockets per destination
+            batch           `int`: datagrams queued per socket before sending
+            raw             `bool`: forward without relay header
+            trusted         [`str`]: relays to take the exporter from the
+                            relay header of (relaying relays)
+        """
+        if not destinations:
+            raise ValueError("Relay needs at least one destination")
+        self.pools = {}  # name -> [socket]
+        self.names = {}  # socket -> (name, ring)
+        self.ring = self._connect(destinations, pool)
+        self.dup_ring = self._connect(duplicates, pool)
+        self.down = {}  # name -> (ring, when marked down)
+        self.batch = batch
+        self.raw = raw
+        self.trusted = frozenset(trusted)
+        self.pending = {}  # socket -> [datagram]
+        # metrics
+        self.received = 0
+        self.dropped = 0  # unknown version
+        self.errors = 0
+        self.sends = 0
+        self.forwarded = dict.fromkeys(self.ring.nodes, 0)
+        self.duplicated = dict.fromkeys(self.dup_ring.nodes, 0)
+        self.versions = {}
+
+    def _connect(self, dests, pool):
+        ring = HashRing()
+        for host, port in dests:
+            name = "{}:{}".format(host, port)  # as cluster nodes name it
+            family, _, _, _, addr = socket.getaddrinfo(
+                host, port, type=socket.SOCK_DGRAM
+            )[0]
+            socks = self.pools[name] = []
+            for _ in range(pool):
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.connect(addr)
+                sock.setblocking(False)
+                socks.append(sock)
+                self.names[sock] = (name, ring)
+            ring.add(name)
+        return ring
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def _hash(ipa):
+        return zlib.crc32(ipa.encode())
+
+    def pick(self, ipa, ring):
+        """
+        Return (name, socket) of the downstream on ring for exporter ipa
+        """
+        name = ring.owner(ipa)
+        socks = self.pools[name]
+        return name, socks[self._hash(ipa) % len(socks)]
+
+    def forward(self, datagram, ipa):
+        """
+        Queue datagram from exporter ipa for its downstream(s)
+        """
+        self.received += 1
+        try:
+            version = util.get_header_version(datagram)
+        except Exception:  # struct.error, too short
+            version = None
+        if version not in VERSIONS:
+            self.dropped += 1
+            logger.debug("Dropping version %s from %s", version, ipa)
+            return
+        self.versions[version] = self.versions.get(version, 0) + 1
+
+        if not self.raw:
+            datagram = wrap(datagram, ipa)
+        name, sock = self.pick(ipa, self.ring)
+        self.forwarded[name] += 1
+        self._queue(sock, datagram)
+        if self.dup_ring:
+            name, sock = self.pick(ipa, self.dup_ring)
+            self.duplicated[name] += 1
+            self._queue(sock, datagram)
+
+    def _queue(self, sock, datagram):
+        batch = self.pending.get(sock)
+        if batch is None:
+            batch = self.pending[sock] = []
+        batch.append(datagram)
+        if len(batch) >= self.batch:
+            self._send(sock, batch)
+            del self.pending[sock]
+
+    def _send(self, sock, batch):
+        self.sends += 1
+        send = sock.send
+        for datagram in batch:
+            try:
+                send(datagram)
+            except BlockingIOError:
+                self.errors += 1  # socket buffer full, lost like on the wire
+            except ConnectionRefusedError:
+                # ICMP port unreachable reported on the connected socket
+                self.errors += 1
+                self._mark_down(sock)
+            except OSError as e:
+                self.errors += 1
+                logger.debug("Sending to %s failed: %r", sock.getpeername(), e)
+
+    def _mark_down(self, sock):
+        name, ring = self.names[sock]
+        if name in ring and len(ring) > 1:
+            ring.remove(name)  # its exporters move on to the next node
+            self.down[name] = (ring, time.monotonic())
+            logger.warning("Relaying around %s, not listening", name)
+
+    def flush(self):
+        """
+        Send everything queued, retry downstreams marked down a while ago
+        """
+        for sock, batch in self.pending.items():
+            self._send(sock, batch)
+        self.pending = {}
+        if self.down:
+            now = time.monotonic()
+            for name, (ring, when) in list(self.down.items()):
+                if now - when > RETRY:
+                    del self.down[name]
+                    ring.add(name)
+
+    def serve(self, sock, stop=None):
+        """
+        Forward what sock receives until stop (`threading.Event`) is set
+
+        Reads whatever is available, then sends the batches.
+        """
+        sock.setblocking(False)
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
+        recvfrom = sock.recvfrom
+        forward = self.forward
+        trusted = self.trusted
+        try:
+            while stop is None or not stop.is_set():
+                if not sel.select(timeout=1):
+                    continue
+                while True:
+                    try:
+                        datagram, addr = recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    forward(*unwrap(datagram, addr[0], trusted))
+                self.flush()
+        finally:
+            sel.close()
+
+    def close(self):
+        """
+        Flush and close all sockets
+        """
+        self.flush()
+        for sock in self.names:
+            sock.close()
+
+    def stats(self):
+        """
+        Return metrics as `dict`
+        """
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "sends": self.sends,
+            "versions": dict(self.versions),
+            "forwarded": dict(self.forwarded),
+            "duplicated": dict(self.duplicated),
+            "down": sorted(self.down),
+        }
+
+
+def listen(host, port):
+    """
+    Return a UDP socket bound to (host, port) with a large receive buffer
+    """
+    family, _, _, _, addr = socket.getaddrinfo(
+        host, port, type=socket.SOCK_DGRAM
+    )[0]
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    except OSError as e:
+        logger.warning("Cannot set receive buffer size: %r", e)
+    sock.bind(addr)
+    return sock
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Run coroutines on the event loop of choice
+
+    "asyncio"   the standard library's loop
+    "uvloop"    uvloop's (libuv based, faster socket I/O), if installed
+    "auto"      uvloop if installed, else asyncio
+
+uvloop is optional, install it with `pip install flowproc[uvloop]`.
+"""
+
+import asyncio
+import logging
+import sys
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+LOOPS = ("asyncio", "uvloop", "auto")
+
+
+def loop_factory(name="asyncio"):
+    """
+    Return a callable creating the event loop named, `None` for asyncio's
+
+    Raises `ValueError` for uvloop if not installed
+    """
+    if name not in LOOPS:
+        raise ValueError("Unknown event loop '{}'".format(name))
+    if name == "asyncio" or (name == "auto" and uvloop is None):
+        return None
+    if uvloop is None:
+        raise ValueError("uvloop is not installed")
+    return uvloop.new_event_loop
+
+
+def available():
+    """
+    Return names of the event loops that can be run (not "auto")
+    """
+    return [name for name in LOOPS[:2] if name == "asyncio" or uvloop]
+
+
+def gil_enabled():
+    """
+    Return `False` on free-threaded builds running without the GIL
+    """
+    check = getattr(sys, "_is_gil_enabled", None)  # Python 3.13+
+    return check() if check else True
+
+
+def run(main, loop="asyncio"):
+    """
+    Run coroutine main to completion on a new event loop of the kind
+    named, closing it afterwards
+
+    Return:
+        what main returns
+    """
+    try:
+        factory = loop_factory(loop)
+    except ValueError:
+        main.close()  # never to be awaited
+        raise
+    logger.info(
+        "Running on %s event loop", "uvloop" if factory else "asyncio"
+    )
+    if factory is None:
+        return asyncio.run(main)
+    if hasattr(asyncio, "Runner"):  # Python 3.11+
+        with asyncio.Runner(loop_factory=factory) as runner:
+            return runner.run(main)
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    try:
+        return asyncio.run(main)
+    finally:
+        asyncio.set_event_loop_policy(None)
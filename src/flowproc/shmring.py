@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Single-producer/single-consumer ring buffer in shared memory
+
+Carries raw datagrams, exporter address and receive time from the process
+receiving to a process decoding, without pickling and without locks. The
+shared memory block starts with a control block of counters, each written
+by one side only, on cache lines of their own:
+
+    producer:   head (bytes written), puts, drops, highwater, closed
+    consumer:   tail (bytes read), gets
+
+followed by the data area. An entry is
+
+    length (4) | address length (1) | pad (3) | time (8) | address | datagram
+
+padded to 8 bytes. Entries don't wrap: if one doesn't fit before the end
+of the data area, a length of `WRAP` tells the consumer to go on at the
+start. head and tail only grow, head - tail is the fill level.
+
+The producer writes an entry, then publishes it by storing head, the
+consumer reads it, then frees it by storing tail. Each side caches the
+other's counter and only reloads it when the cached value has run out -
+the counters are aligned 8 byte stores, and the loads get repeated until
+two agree, so a torn load can't be mistaken for progress. Store order is
+kept by the hardware on x86 (TSO), which this relies on: elsewhere (e.g.
+aarch64) a consumer could see head before the entry's bytes, so rings
+refuse to be created there (see `supported`).
+"""
+
+import logging
+import os
+import platform
+import struct
+import sys
+import time
+
+from multiprocessing import shared_memory
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+SIZE = 2 ** 24  # bytes of data area
+LINE = 64  # bytes per cache line
+COUNTER = struct.Struct("=Q")
+HEAD, PUTS, DROPS, HIGHWATER, CLOSED = (i * 8 for i in range(5))
+TAIL, GETS = LINE, LINE + 8
+CONTROL = 2 * LINE
+ENTRY = struct.Struct("=IBxxxd")
+WRAP = 0xFFFFFFFF
+IDLE = 0.001  # seconds to sleep polling an empty ring
+MACHINES = ("x86_64", "AMD64", "i386", "i686", "x86")  # TSO
+
+
+def supported():
+    """
+    Return `True` if the hardware keeps store order as the ring needs it
+    """
+    return platform.machine() in MACHINES
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+class Ring:
+    """
+    Responsibility: put entries on one side, get them on the other, keep
+    fill level metrics in shared memory
+    """
+
+    def __init__(self, name=None, size=SIZE, create=True):
+        """
+        Args:
+            name        `str`: shared memory block, `None` for a new one
+                        named by the system
+            size        `int`: bytes of data area (multiple of 8), ignored
+                        when attaching
+            create      `bool`: create the block, else attach to it
+        """
+        if create:
+            if not supported():
+                raise RuntimeError(
+                    "Ring needs x86 store ordering, not {}".format(
+                        platform.machine()
+                    )
+                )
+            if size % 8 or size < LINE:
+                raise ValueError("Ring size must be a multiple of 8 >= 64")
+            self.shm = shared_memory.SharedMemory(
+                name, create=True, size=CONTROL + size
+            )
+            self.shm.buf[:CONTROL] = bytes(CONTROL)
+        else:
+            kwargs = {"track": False} if sys.version_info >= (3, 13) else {}
+            self.shm = shared_memory.SharedMemory(name, **kwargs)
+        self.name = self.shm.name
+        self.owner = os.getpid() if create else None  # not forks
+        self.buf = self.shm.buf
+        self.data = self.buf[CONTROL:]
+        self.size = len(self.data)
+        # local copies of own counters, cached ones of the other side
+        self.head = self._load(HEAD)
+        self.tail = self._load(TAIL)
+        self.puts = self._load(PUTS)
+        self.drops = self._load(DROPS)
+        self.gets = self._load(GETS)
+        self.highwater = self._load(HIGHWATER)
+
+    def __reduce__(self):
+        # passed to another process: attach there by name
+        return (Ring, (self.name, 0, False))
+
+    def __repr__(self):
+        return "Ring({}, {:d})".format(self.name, self.size)
+
+    def __len__(self):
+        """
+        Return bytes in use (entries and padding)
+        """
+        return self._load(HEAD) - self._load(TAIL)
+
+    def _load(self, offset):
+        value = COUNTER.unpack_from(self.buf, offset)[0]
+        while True:
+            again = COUNTER.unpack_from(self.buf, offset)[0]
+            if again == value:
+                return value
+            value = again
+
+    def _store(self, offset, value):
+        COUNTER.pack_into(self.buf, offset, value)
+
+    def put(self, datagram, ipa, ts=None):
+        """
+        Append entry, called by the producer only
+
+        Args:
+            datagram    `bytes`: as received
+            ipa         `str`: exporter address
+            ts          `float`: receive time, now if `None`
+
+        Return:
+            `False` if the ring was full and the entry dropped
+        """
+        address = ipa.encode()
+        need = _align(ENTRY.size + len(address) + len(datagram))
+        offset = self.head % self.size
+        skip = self.size - offset if offset + need > self.size else 0
+        if self.head + skip + need - self.tail > self.size:
+            self.tail = self._load(TAIL)  # cached tail ran out, reload
+            if self.head + skip + need - self.tail > self.size:
+                self.drops += 1
+                self._store(DROPS, self.drops)
+                return False
+        if skip:
+            struct.pack_into("=I", self.data, offset, WRAP)
+            self.head += skip
+            offset = 0
+
+        start = offset + ENTRY.size
+        ENTRY.pack_into(
+            self.data,
+            offset,
+            len(datagram),
+            len(address),
+            time.time() if ts is None else ts,
+        )
+        self.data[start : start + len(address)] = address
+        start += len(address)
+        self.data[start : start + len(datagram)] = datagram
+        self.head += need
+        self.puts += 1
+        self._store(PUTS, self.puts)
+        self._store(HEAD, self.head)  # publish
+        fill = self.head - self.tail  # upper bound, tail may be stale
+        if fill > self.highwater:
+            self.highwater = fill
+            self._store(HIGHWATER, fill)
+        return True
+
+    def get(self):
+        """
+        Remove first entry, called by the consumer only
+
+        Return:
+            (datagram `bytes`, exporter `str`, time `float`) or `None` if
+            the ring is empty
+        """
+        if self.tail == self.head:
+            self.head = self._load(HEAD)  # cached head ran out, reload
+            if self.tail == self.head:
+                return None
+        offset = self.tail % self.size
+        if struct.unpack_from("=I", self.data, offset)[0] == WRAP:
+            self.tail += self.size - offset
+            offset = 0
+
+        length, alen, ts = ENTRY.unpack_from(self.data, offset)
+        start = offset + ENTRY.size
+        ipa = bytes(self.data[start : start + alen]).decode()
+        start += alen
+        datagram = bytes(self.data[start : start + length])
+        self.tail += _align(ENTRY.size + alen + length)
+        self.gets += 1
+        self._store(GETS, self.gets)
+        self._store(TAIL, self.tail)  # free
+        return datagram, ipa, ts
+
+    def get_batch(self, n):
+        """
+        Return list of up to n entries as returned by `get`
+        """
+        batch = []
+        for _ in range(n):
+            entry = self.get()
+            if entry is None:
+                break
+            batch.append(entry)
+        return batch
+
+    def close_input(self):
+        """
+        Tell the consumer there's nothing more to come
+        """
+        self._store(CLOSED, 1)
+
+    @property
+    def closed(self):
+        """
+        `True` after `close_input` was called on the producer side
+        """
+        return bool(self._load(CLOSED))
+
+    def consume(self, handle, batch=64, stop=None):
+        """
+        Call handle(datagram, ipa, ts) for every entry until the input is
+        closed and the ring is empty (or stop, an event, is set), sleeping
+        while the ring is empty
+        """
+        idle = 0
+        while not (stop and stop.is_set()):
+            entries = self.get_batch(batch)
+            for entry in entries:
+                handle(*entry)
+            if entries:
+                idle = 0
+            elif self.closed and not len(self):
+                break
+            else:
+                idle = min(idle + IDLE, 0.05)  # back off while idle
+                time.sleep(idle)
+
+    def close(self):
+        """
+        Detach, remove the shared memory block if created in this process
+        """
+        self.data.release()
+        self.buf = self.data = None
+        self.shm.close()
+        if self.owner == os.getpid():
+            self.shm.unlink()
+
+    def stats(self):
+        """
+        Return metrics as `dict`, readable from either side
+        """
+        head, tail = self._load(HEAD), self._load(TAIL)
+        return {
+            "name": self.name,
+            "size": self.size,
+            "used": head - tail,
+            "fill": (head - tail) / self.size,
+            "highwater": self._load(HIGHWATER),
+            "puts": self._load(PUTS),
+            "gets": self._load(GETS),
+            "drops": self._load(DROPS),
+        }
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Disk-backed FIFO to spill output bursts to
+
+Items are appended to segment files of fixed size, preallocated and mapped
+to memory, each entry a 4 byte length and the serialized item. A length of
+0 (the preallocated zeros) marks the end of a segment's entries. Segments
+read to their end get deleted.
+
+The read position is checkpointed to a small file every so many reads and
+on `close`, so after a restart reading resumes there. Items read after the
+last checkpoint get read again - delivery is at least once.
+"""
+
+import json
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+
+from flowproc.v9_classes import record_type
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+SEGSIZE = 64 * 2 ** 20  # bytes per segment
+CHECKPOINT_EVERY = 1000  # reads
+HEADER = struct.Struct("!I")
+SEGMENT = "spill-{:08d}.seg"
+SEGMENT_RE = re.compile(r"^spill-(\d{8})\.seg$")
+CHECKPOINT = "checkpoint"
+
+
+def dump_batch(item):
+    """
+    Serialize an (exporter, records) item - named tuple classes are made
+    at runtime, so their field labels get stored instead
+    """
+    ipa, records = item
+    labels = getattr(records[0], "_fields", None) if records else None
+    rows = [tuple(r) for r in records] if labels else records
+    return pickle.dumps((ipa, labels, rows), pickle.HIGHEST_PROTOCOL)
+
+
+def load_batch(data):
+    """
+    Return (exporter, records) serialized by `dump_batch`
+    """
+    ipa, labels, rows = pickle.loads(data)
+    if labels:
+        Record = record_type(tuple(labels))
+        rows = [Record._make(row) for row in rows]
+    return ipa, rows
+
+
+class _Segment:
+    """
+    Responsibility: map a segment file, creating it with size if missing
+    """
+
+    def __init__(self, path, size=None):
+        self.path = path
+        if size is not None:
+            with open(path, "wb") as fh:
+                fh.truncate(size)
+        self.fh = open(path, "r+b")
+        self.size = os.fstat(self.fh.fileno()).st_size
+        self.mm = mmap.mmap(self.fh.fileno(), self.size)
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+    def entries(self, offset):
+        """
+        Yield offset after each entry from offset to the segment's end
+        """
+        while offset + HEADER.size <= self.size:
+            length, = HEADER.unpack_from(self.mm, offset)
+            if not length:
+                return
+            offset += HEADER.size + length
+            yield offset
+
+
+class DiskQueue:
+    """
+    Responsibility: FIFO of items in memory-mapped segment files
+    """
+
+    def __init__(
+        self,
+        path,
+        segsize=SEGSIZE,
+        dumps=pickle.dumps,
+        loads=pickle.loads,
+        checkpoint_every=CHECKPOINT_EVERY,
+    ):
+        """
+        Args:
+            path                `str`: directory, created if missing
+            segsize             `int`: bytes per segment (larger for items
+                                not fitting)
+            dumps, loads        serialize items to `bytes` and back
+            checkpoint_every    `int`: reads between checkpoints
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segsize = segsize
+        self.dumps = dumps
+        self.loads = loads
+        self.checkpoint_every = checkpoint_every
+        self.reads = 0
+        self.count = 0
+
+        numbers = sorted(
+            int(m.group(1))
+            for m in map(SEGMENT_RE.match, os.listdir(path))
+            if m
+        )
+        number, offset = self._read_checkpoint()
+        for n in [n for n in numbers if n < number]:
+            os.remove(self._name(n))  # read before the last shutdown
+        numbers = [n for n in numbers if n >= number]
+        if not numbers or numbers[0] != number:
+            offset = 0  # checkpointed segment gone, start over
+        self.numbers = numbers or [number]
+
+        # count entries left, find where to write
+        self.segments = {}
+        self.roff = offset
+        for n in self.numbers:
+            segment = self._open(n)
+            for offset in segment.entries(offset):
+                self.count += 1
+            if n not in (self.numbers[0], self.numbers[-1]):
+                segment.close()
+                del self.segments[n]
+            self.woff = offset
+            offset = 0
+        if self.count:
+            logger.info("%d items spilled to %s before", self.count, path)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "DiskQueue({})".format(self.path)
+
+    def _name(self, number):
+        return os.path.join(self.path, SEGMENT.format(number))
+
+    def _open(self, number, size=None):
+        segment = self.segments.get(number)
+        if segment is None:
+            if size is None and not os.path.exists(self._name(number)):
+                size = self.segsize
+            segment = self.segments[number] = _Segment(
+                self._name(number), size
+            )
+        return segment
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT)) as fh:
+                checkpoint = json.load(fh)
+            return checkpoint["segment"], checkpoint["offset"]
+        except FileNotFoundError:
+            return 0, 0
+        except (ValueError, KeyError) as e:
+            logger.error("Reading all of %s, bad checkpoint: %r", self, e)
+            return 0, 0
+
+    def put(self, item):
+        """
+        Append item
+        """
+        data = self.dumps(item)
+        need = HEADER.size + len(data)
+        segment = self._open(self.numbers[-1])
+        if self.woff + need > segment.size:
+            # rest stays zero, i.e. marks the end
+            segment.mm.flush()
+            if len(self.numbers) > 1:
+                segment.close()  # not read from yet
+                del self.segments[self.numbers[-1]]
+            self.numbers.append(self.numbers[-1] + 1)
+            segment = self._open(self.numbers[-1], max(self.segsize, need))
+            self.woff = 0
+
+        # length last, a crash in between leaves the end marker in place
+        segment.mm[self.woff + HEADER.size : self.woff + need] = data
+        HEADER.pack_into(segment.mm, self.woff, len(data))
+        self.woff += need
+        self.count += 1
+
+    def get(self):
+        """
+        Remove and return the first item, raise `IndexError` if empty
+        """
+        if not self.count:
+            raise IndexError("{} is empty".format(self))
+        while True:
+            segment = self._open(self.numbers[0])
+            if self.roff + HEADER.size <= segment.size:
+                length, = HEADER.unpack_from(segment.mm, self.roff)
+            else:
+                length = 0
+            if length:
+                break
+            # segment read, on to the next one
+            segment.close()
+            del self.segments[self.numbers[0]]
+            os.remove(segment.path)
+            self.numbers.pop(0)
+            self.roff = 0
+
+        start = self.roff + HEADER.size
+        data = segment.mm[start : start + length]
+        self.roff = start + length
+        self.count -= 1
+        self.reads += 1
+        if self.reads % self.checkpoint_every == 0:
+            self.checkpoint()
+        return self.loads(data)
+
+    def checkpoint(self):
+        """
+        Flush written entries and save the read position
+        """
+        for segment in self.segments.values():
+            segment.mm.flush()
+        tmp = os.path.join(self.path, CHECKPOINT + ".tmp")
+        with open(tmp, "w") as fh:
+            json.dump({"segment": self.numbers[0], "offset": self.roff}, fh)
+        os.replace(tmp, os.path.join(self.path, CHECKPOINT))
+
+    def close(self):
+        """
+        Checkpoint and unmap all segments
+        """
+        self.checkpoint()
+        for segment in self.segments.values():
+            segment.close()
+        self.segments = {}
+
+    def stats(self):
+        """
+        Return metrics as `dict`
+        """
+        return {
+            "path": self.path,
+            "items": self.count,
+            "segments": len(self.numbers),
+            "reads": self.reads,
+        }
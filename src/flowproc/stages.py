@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded queues between receiving, decoding and output
+
+    datagram_received -> [decode queue] -> parser -> [sink queue] -> output
+
+Receiving only enqueues, so the event loop gets back to the socket quickly.
+Decoding runs in an event loop task, output in a thread of its own, so a
+stalling sink fills the sink queue instead of stalling receive. When a
+queue is full, its policy decides what gets lost:
+
+    drop_newest     the item being put (tail drop, like a socket buffer)
+    drop_oldest     the item waiting longest
+    spill           nothing, items go to a spill queue (`put`, `get` and
+                    `len`) until the queue has drained, order is kept
+
+With decode workers, the decode task hands batches of datagrams to decode
+threads instead, sharded by exporter: all datagrams of an exporter get
+decoded by the same thread, in order, so its templates are registered
+before its data gets decoded - and no two threads touch the state of the
+same exporter. Records decoded in a worker are enqueued for output by the
+loop thread. On builds with the GIL, workers take decoding off the loop
+thread (receive keeps up, `recv` releases the GIL), free-threaded builds
+(see `flowproc.runtime.gil_enabled`) decode on as many cores.
+"""
+
+import asyncio
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# globals
+logger = logging.getLogger(__name__)
+POLICIES = ("drop_newest", "drop_oldest", "spill")
+BATCH = 64  # items handled before yielding to the event loop
+
+
+class BoundedQueue:
+    """
+    Responsibility: hold items up to maxsize, apply the overflow policy and
+    count what happens
+    """
+
+    def __init__(self, name, maxsize, policy="drop_newest", spill=None):
+        """
+        Args:
+            name        `str`: for metrics
+            maxsize     `int`: items held in memory
+            policy      `str`: one of `POLICIES`
+            spill       spill queue, required for policy "spill"
+        """
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy '{}'".format(policy))
+        if policy == "spill" and spill is None:
+            raise ValueError("Overflow policy 'spill' needs a spill queue")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill = spill if policy == "spill" else None
+        self.items = deque()
+        self.ready = None  # `asyncio.Event`, created by the first waiter
+        # metrics
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.maxdepth = 0
+
+    def __len__(self):
+        return len(self.items) + (len(self.spill) if self.spill else 0)
+
+    def __repr__(self):
+        return "BoundedQueue({}, {:d}, {})".format(
+            self.name, self.maxsize, self.policy
+        )
+
+    def put(self, item):
+        """
+        Enqueue item or apply the overflow policy
+
+        Return:
+            `False` if item was dropped
+        """
+        items = self.items
+        if len(items) >= self.maxsize or (self.spill and len(self.spill)):
+            if self.policy == "drop_newest":
+                self.dropped += 1
+                return False
+            elif self.policy == "drop_oldest":
+                items.popleft()
+                self.dropped += 1
+            else:
+                self.spill.put(item)
+                self.spilled += 1
+                self.enqueued += 1
+                self._wake()
+                return True
+
+        items.append(item)
+        self.enqueued += 1
+        if len(items) > self.maxdepth:
+            self.maxdepth = len(items)
+        self._wake()
+        return True
+
+    def get_nowait(self):
+        """
+        Return the next item, raise `IndexError` if empty
+        """
+        if self.items:
+            item = self.items.popleft()
+        elif self.spill and len(self.spill):
+            item = self.spill.get()
+        else:
+            raise IndexError("{} is empty".format(self.name))
+        self.dequeued += 1
+        return item
+
+    def _wake(self):
+        if self.ready is not None:
+            self.ready.set()
+
+    async def wait(self):
+        """
+        Return as soon as there are items to get
+        """
+        if self.ready is None:
+            self.ready = asyncio.Event()
+        while not len(self):
+            self.ready.clear()
+            await self.ready.wait()
+
+    def stats(self):
+        """
+        Return metrics as `dict`
+        """
+        return {
+            "queue": self.name,
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "depth": len(self),
+            "maxdepth": self.maxdepth,
+            "enqueued": self.enqueued,
+            "dequeued": self.dequeued,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "spill": self.spill.stats()
+            if hasattr(self.spill, "stats")
+            else None,
+        }
+
+
+class Stages:
+    """
+    Responsibility: run decode and output from their queues
+
+    Use `receive` as datagram callback and `attach` whenever the parser
+    output got (re)configured.
+    """
+
+    def __init__(self, parser, decode_queue, sink_queue, workers=0):
+        """
+        Args:
+            parser          parser module (`parse_packet` and `output`)
+            decode_queue    `BoundedQueue` for (datagram, ipa)
+            sink_queue      `BoundedQueue` for (ipa, records)
+            workers         `int`: decode threads, 0 to decode in the
+                            event loop thread
+        """
+        self.parser = parser
+        self.decode_queue = decode_queue
+        self.sink_queue = sink_queue
+        self.output = None
+        self.busy = False  # output running in the sink thread
+        self.retiring = []  # callables to run once output is not busy
+        self.executor = ThreadPoolExecutor(max_workers=1)  # in order
+        # one thread per shard, keeping each exporter's datagrams in order
+        self.shards = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode")
+            for _ in range(workers)
+        ]
+        self.local = threading.local()  # records decoded in a worker
+        self.decoding = asyncio.Lock()  # held while workers decode
+        self.tasks = []
+
+    def receive(self, datagram, ipa):
+        """
+        Enqueue datagram for decoding
+        """
+        self.decode_queue.put((datagram, ipa))
+
+    def _enqueue(self, ipa, records):
+        pending = getattr(self.local, "pending", None)
+        if pending is None:
+            self.sink_queue.put((ipa, records))
+        else:
+            pending.append((ipa, records))  # in a worker, loop enqueues
+
+    def attach(self, parser=None):
+        """
+        Take over the parser's output, records get queued for it from now on
+        """
+        self.parser = parser or self.parser
+        if self.parser.output is not self._enqueue:
+            self.output = self.parser.output
+            self.parser.output = self._enqueue
+
+    def retire(self, func):
+        """
+        Call func (e.g. closing a replaced output) once output is not busy
+        """
+        if self.busy:
+            self.retiring.append(func)
+        else:
+            func()
+
+    def start(self):
+        """
+        Create the decode and sink tasks on the running event loop
+        """
+        self.tasks = [
+            asyncio.ensure_future(self._decode()),
+            asyncio.ensure_future(self._sink()),
+        ]
+
+    async def _decode(self):
+        if self.shards:
+            return await self._decode_sharded()
+        queue = self.decode_queue
+        while True:
+            await queue.wait()
+            for _ in range(min(BATCH, len(queue))):
+                datagram, ipa = queue.get_nowait()
+                try:
+                    self.parser.parse_packet(datagram, ipa)
+                except Exception as e:
+                    logger.error("Failed to parse from %s: %r", ipa, e)
+            await asyncio.sleep(0)  # let receive in
+
+    def _decode_batch(self, items):
+        # in a worker thread, returns the (ipa, records) to enqueue
+        self.local.pending = pending = []
+        try:
+            for datagram, ipa in items:
+                try:
+                    self.parser.parse_packet(datagram, ipa)
+                except Exception as e:
+                    logger.error("Failed to parse from %s: %r", ipa, e)
+        finally:
+            self.local.pending = None
+        return pending
+
+    async def _decode_sharded(self):
+        loop = asyncio.get_running_loop()
+        queue = self.decode_queue
+        shards = self.shards
+        while True:
+            await queue.wait()
+            async with self.decoding:
+                groups = {}
+                for _ in range(min(BATCH * len(shards), len(queue))):
+                    datagram, ipa = queue.get_nowait()
+                    groups.setdefault(hash(ipa) % len(shards), []).append(
+                        (datagram, ipa)
+                    )
+                results = await asyncio.gather(
+                    *(
+                        loop.run_in_executor(
+                            shards[n], self._decode_batch, items
+                        )
+                        for n, items in groups.items()
+                    )
+                )
+            for pending in results:
+                for item in pending:
+                    self.sink_queue.put(item)
+
+    async def _sink(self):
+        loop = asyncio.get_running_loop()
+        queue = self.sink_queue
+        while True:
+            await queue.wait()
+            ipa, records = queue.get_nowait()
+            self.busy = True
+            try:
+                await loop.run_in_executor(
+                    self.executor, self.output, ipa, records
+                )
+            except Exception as e:
+                logger.error("Output failed for %s: %r", ipa, e)
+            finally:
+                self.busy = False
+            while self.retiring:
+                self.retiring.pop(0)()
+
+    async def _output(self, loop, ipa, records):
+        try:
+            await loop.run_in_executor(
+                self.executor, self.output, ipa, records
+            )
+        except Exception as e:
+            logger.error("Output failed for %s: %r", ipa, e)
+
+    async def drain(self):
+        """
+        Stop the tasks and process whatever is queued - but what was spilled
+        from the sink queue, that stays for the next start
+
+        Records still to be decoded go to the output directly, not through
+        the sink queue, which would drop most of them.
+        """
+        async with self.decoding:  # no batch in the workers
+            for task in self.tasks:
+                task.cancel()
+        self.tasks = []
+        loop = asyncio.get_running_loop()
+        while self.sink_queue.items:  # in memory, older than spilled
+            await self._output(loop, *self.sink_queue.get_nowait())
+        queue = self.decode_queue
+        while len(queue):
+            items = [queue.get_nowait() for _ in range(min(BATCH, len(queue)))]
+            for ipa, records in self._decode_batch(items):
+                await self._output(loop, ipa, records)
+        while self.retiring:
+            await loop.run_in_executor(self.executor, self.retiring.pop(0))
+        self.executor.shutdown()
+        for shard in self.shards:
+            shard.shutdown()
+
+    def stats(self):
+        """
+        Return metrics of both queues
+        """
+        return [self.decode_queue.stats(), self.sink_queue.stats()]
@@ -8,7 +8,7 @@ import logging
 
 from datetime import datetime
 
-from flowproc import __version__
+import flowproc
 from flowproc.collector_state import Collector
 from flowproc.util import stopwatch
 from flowproc.v9_classes import OptionsTemplate
@@ -21,6 +21,7 @@ __license__ = "mit"
 
 # globals
 logger = logging.getLogger(__name__)
+TREE_CHUNK = 100  # exporters per chunk streamed
 
 
 class TreeVisitor:
@@ -31,7 +32,7 @@ class TreeVisitor:
     @stopwatch
     def visit_Collector(self, host):
         collector = {
-            "flowproc": __version__,
+            "flowproc": flowproc.__version__,
             "at": str(datetime.utcnow()),  # TODO add timezone info
             "parser": "V9 someting...",
             # "transport": "UDP",
@@ -40,7 +41,7 @@ class TreeVisitor:
         exp = {}
         collector["exporters"] = exp
 
-        for child in host.children.values():
+        for child in list(host.children.values()):
             exp[child.ipa] = []
             exp[child.ipa].append(child.accept(self))
 
@@ -50,17 +51,21 @@ class TreeVisitor:
     def visit_Exporter(self, host):
         domain = {}
 
-        for child in host.children.values():
+        for child in list(host.children.values()):
             attr = {}
             domain[child.odid] = attr
-            attr["options_records"] = [rec for rec in child.optrecs if rec is not None]
+            # copies, chunks may get serialized off the event loop
+            attr["options"] = {
+                table: {key: dict(entry) for key, entry in entries.items()}
+                for table, entries in child.options.items()
+            }
             attr["templates"] = child.accept(self)
 
         return domain
 
     def visit_ObservationDomain(self, host):
         templates = {}
-        for child in host.children.values():
+        for child in list(host.children.values()):
             attr = {}
             templates[child.tid] = attr
             # Format returned by str( timedelta ) e.g '0:02:41.411545' -
@@ -85,6 +90,92 @@ class TreeVisitor:
         return templates
 
 
+class ChangesVisitor:
+    """
+    Return what changed since a state version, ready for JSON: observation
+    domains changed in full (to replace on the client side) and paths
+    removed - everything with "full" set if since is 0 or removals that old
+    have been forgotten
+
+    Cost is in the number of changes, not in the size of the state.
+    """
+
+    def __init__(self, since=0):
+        self.since = since
+
+    def visit_Collector(self, host):
+        full = self.since == 0 or self.since < host.forgotten
+        if full:
+            self.since = 0
+        return {
+            "version": host.version,
+            "full": full,
+            "removed": []
+            if full
+            else [
+                list(path)
+                for version, path in host.removed
+                if version > self.since
+            ],
+            "exporters": {
+                str(ipa): child.accept(self)
+                for ipa, child in list(host.children.items())
+                if child.version > self.since
+            },
+        }
+
+    def visit_Exporter(self, host):
+        return {
+            odid: child.accept(self)
+            for odid, child in list(host.children.items())
+            if child.version > self.since
+        }
+
+    def visit_ObservationDomain(self, host):
+        return {
+            "version": host.version,
+            "lastseen": host.lastseen.isoformat(),
+            "options": {
+                table: {key: dict(entry) for key, entry in entries.items()}
+                for table, entries in host.options.items()
+            },
+            "templates": {
+                tid: {
+                    "lastwrite": child.lastwrite.isoformat(),
+                    "labels": list(child.labels),
+                }
+                if isinstance(child, Template)
+                else {"lastwrite": child.lastwrite.isoformat()}
+                for tid, child in list(host.children.items())
+            },
+        }
+
+
+def tree_chunks(size=TREE_CHUNK):
+    """
+    Yield collector state like `TreeVisitor` does, but in chunks of size
+    exporters each, the first one with the collector's attributes
+
+    Meant for streaming: state may change between chunks, exporters gone
+    meanwhile are skipped.
+    """
+    visitor = TreeVisitor()
+    yield {
+        "flowproc": flowproc.__version__,
+        "at": str(datetime.utcnow()),  # TODO add timezone info
+        "exporters": len(Collector.children),
+    }
+    exporters = list(Collector.children.items())
+    for i in range(0, len(exporters), size):
+        yield {
+            "exporters": {
+                exporter.ipa: [exporter.accept(visitor)]
+                for ipa, exporter in exporters[i : i + size]
+                if Collector.children.get(ipa) is exporter
+            }
+        }
+
+
 def stats():
     """
     Print basic statistics
@@ -95,11 +186,22 @@ Collector started: {}
 Packets processed:    {:9d}
 Headers record count: {:9d}
 Records processed:    {:9d}
-Records diff:         {:9d}""".format(
-        __version__,
+Records diff:         {:9d}
+State evictions:      {:9d}
+
+State version:        {:9d}
+Exporters:            {:9d}
+Observation domains:  {:9d}
+Templates:            {:9d}""".format(
+        flowproc.__version__,
         Collector.created,
         Collector.packets,
         Collector.count,
         Collector.record_count,
         Collector.count - Collector.record_count,
+        Collector.evictions,
+        Collector.version,
+        len(Collector.children),
+        Collector.domains,
+        Collector.templates,
     )
@@ -9,17 +9,27 @@ import asyncio
 import sys
 import logging
 import os
-
-from importlib import reload
+import signal
 
 from flowproc import __version__
+from flowproc import cluster
+from flowproc import config
+from flowproc import control
+from flowproc import fieldcodecs
+from flowproc import logqueue
+from flowproc import persist
+from flowproc import relay
+from flowproc import runtime
+from flowproc import spill
 from flowproc import testasync
-# from flowproc import v5_parser
+from flowproc import util
 from flowproc import v9_classes
 from flowproc import v9_fieldtypes
 from flowproc import v9_parser
-# from flowproc import v10_parser
 from flowproc.collector_state import Collector
+from flowproc.dispatch import Dispatcher
+from flowproc.stages import BoundedQueue
+from flowproc.stages import Stages
 
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
@@ -42,7 +52,8 @@ def parse_args(args):
     )
     parser.add_argument(
         dest="parser",
-        help="set parser to use (values are: 'v5', 'v9' or 'ipfix'",
+        help="set parser to use (values are: 'v5', 'v9', 'ipfix' or 'all' "
+        "for any of them on the same socket)",
         type=str,
     )
     parser.add_argument(
@@ -59,6 +70,176 @@ def parse_args(args):
         type=str,
         action="store",
     )
+    parser.add_argument(
+        "-f",
+        "--filter",
+        help="keep records matching expression only, e.g. 'proto tcp and "
+        "dst port 443 and src net 10.0.0.0/8'",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "-o",
+        "--store",
+        help="write records to flow store directory instead of printing",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "--upscale",
+        help="multiply byte and packet counters by the sampling rate",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="JSON config file (instead of -f, -o and --upscale), re-read "
+        "on SIGHUP or 'reconfig'",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "--state",
+        help="template state file, restored on start, saved periodically "
+        "and on shutdown",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "--state-interval",
+        help="seconds between template state saves (default 60)",
+        type=int,
+        default=60,
+        action="store",
+    )
+    parser.add_argument(
+        "--state-maxage",
+        help="discard templates older than this on restore (default {:d} "
+        "seconds)".format(v9_parser.LIM),
+        type=int,
+        default=v9_parser.LIM,
+        action="store",
+    )
+    parser.add_argument(
+        "--expire-templates",
+        help="expire templates not refreshed for this many seconds",
+        type=int,
+        action="store",
+    )
+    parser.add_argument(
+        "--expire-idle",
+        help="expire exporters and observation domains idle for this many "
+        "seconds",
+        type=int,
+        action="store",
+    )
+    parser.add_argument(
+        "--max-templates",
+        help="keep at most this many templates per exporter",
+        type=int,
+        action="store",
+    )
+    parser.add_argument(
+        "--sweep-interval",
+        help="seconds between expiry sweeps (default 60)",
+        type=int,
+        default=60,
+        action="store",
+    )
+    parser.add_argument(
+        "--decode-queue",
+        help="datagrams queued for decoding, 0 to decode on receipt "
+        "(default 10000)",
+        type=int,
+        default=10000,
+        action="store",
+    )
+    parser.add_argument(
+        "--decode-threads",
+        help="decode in this many threads, sharded by exporter - on more "
+        "cores with free-threaded Python (default 0, in the event loop)",
+        type=int,
+        default=0,
+        action="store",
+    )
+    parser.add_argument(
+        "--sink-queue",
+        help="record batches queued for output (default 1000)",
+        type=int,
+        default=1000,
+        action="store",
+    )
+    parser.add_argument(
+        "--decode-policy",
+        help="what to drop when the decode queue is full",
+        choices=("drop_newest", "drop_oldest"),
+        default="drop_newest",
+    )
+    parser.add_argument(
+        "--sink-policy",
+        help="what to drop when the sink queue is full, 'spill' for "
+        "nothing (needs --spill-dir)",
+        choices=("drop_newest", "drop_oldest", "spill"),
+        default="drop_newest",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        help="directory to spill record batches to while output stalls, "
+        "kept across restarts",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "--spill-segment",
+        help="spill segment size in MiB (default {:d})".format(
+            spill.SEGSIZE // 2 ** 20
+        ),
+        type=int,
+        default=spill.SEGSIZE // 2 ** 20,
+        action="store",
+    )
+    parser.add_argument(
+        "--node",
+        help="run as cluster node of this name, the host:port the relay "
+        "sends to (needs --peer for all nodes)",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "--peer",
+        dest="peers",
+        help="cluster node and its template replication address (host:port "
+        "or unix socket path), repeat for each node including this one",
+        type=cluster.parse_peer,
+        default=[],
+        action="append",
+        metavar="NAME=ADDRESS",
+    )
+    parser.add_argument(
+        "--relay-from",
+        dest="trusted",
+        help="take the exporter from the relay header of datagrams sent by "
+        "this relay, repeat for several (others are taken as received)",
+        type=relay.parse_source,
+        default=[],
+        action="append",
+        metavar="ADDR",
+    )
+    parser.add_argument(
+        "--loop",
+        help="event loop to run on, 'auto' for uvloop if installed "
+        "(default asyncio)",
+        choices=runtime.LOOPS,
+        default="asyncio",
+    )
+    parser.add_argument(
+        "--log-rate",
+        help="seconds between repetitive warnings logged, 0 for all "
+        "(default {:d})".format(logqueue.RATE_LIMIT),
+        type=int,
+        default=logqueue.RATE_LIMIT,
+        action="store",
+    )
     parser.add_argument(
         "-d",
         dest="loglevel",
@@ -95,94 +276,235 @@ def parse_args(args):
     return parser.parse_args(args)
 
 
-def start(parser, host, port, socketpath):
+def start(
+    parser,
+    host,
+    port,
+    socketpath,
+    statepath=None,
+    interval=60,
+    sweep=None,
+    conf=None,
+    stages=None,
+    replicator=None,
+    loop="asyncio",
+    trusted=(),
+):
     """
-    Fire up an asyncio event loop
+    Run `serve` on a new event loop
+
+    Args:
+        loop    `str`: event loop to use, see `flowproc.runtime`
+        trusted [`str`]: relays to take the exporter from, see `serve`
+
+    Return:
+        `flowproc.config.Config` in use at shutdown
+    """
+    return runtime.run(
+        serve(
+            parser,
+            host,
+            port,
+            socketpath,
+            statepath,
+            interval,
+            sweep,
+            conf,
+            stages,
+            replicator,
+            trusted,
+        ),
+        loop,
+    )
+
+
+async def serve(
+    parser,
+    host,
+    port,
+    socketpath,
+    statepath=None,
+    interval=60,
+    sweep=None,
+    conf=None,
+    stages=None,
+    replicator=None,
+    trusted=(),
+):
+    """
+    Collect until stopped by SIGINT, SIGTERM or the "shutdown" command,
+    then shut down gracefully: stop receiving, decode and output all that
+    is queued, save template state
+
+    Args:
+        sweep   `dict`: kwargs for `Collector.expire` plus "interval" in
+                seconds, `None` for no expiry sweeps
+        conf    `flowproc.config.Config` applied to parser
+        stages  `flowproc.stages.Stages` to queue datagrams and records
+                with, `None` to decode and output on receipt
+        replicator  `flowproc.cluster.Replicator` to run as cluster node
+        trusted [`str`]: relays to take the exporter from the relay header
+                of (`flowproc.relay.unwrap`), from others datagrams are
+                taken as received
+
+    Return:
+        `flowproc.config.Config` in use at shutdown
     """
 
-    class NetFlow:  # the protocol definition
+    trusted = frozenset(trusted)
+
+    class NetFlow(asyncio.DatagramProtocol):  # the protocol definition
         def connection_made(self, transport):
             self.transport = transport
 
         def datagram_received(self, datagram, addr):
-            parser.parse_packet(datagram, addr[0])
+            receive(*relay.unwrap(datagram, addr[0], trusted))
 
         def connection_lost(self, exc):
             pass
 
-    @asyncio.coroutine
-    def callback(reader, writer):  # callback function for Unix Sockets
-        data = yield from reader.read(1024)
-        msg = data.decode()
-        msg = run_command(msg.split())  # seems to work on multiple whitespace
-        writer.write(str(msg).encode())
-        yield from writer.drain()
-        writer.close()
-
-    def load():
-        modules = (testasync, v9_classes, v9_fieldtypes, v9_parser)
-        [reload(m) for m in modules]
-        logger.info("Reloaded {}".format(modules))
-        return "reloaded {}".format([m.__name__ for m in modules])
+    async def load():
+        if stages:
+            async with stages.decoding:  # not while workers decode
+                return reload()
+        return reload()
+
+    def reload():
+        # dependencies first, collector_state holds the state and stays,
+        # parsers not selected haven't been imported
+        modules = (
+            v9_fieldtypes,
+            fieldcodecs,
+            v9_classes,
+            persist,
+            v9_parser,
+            *parser.parsers.values(),
+            testasync,
+        )
+        modules = tuple(dict.fromkeys(modules))  # v9_parser once
+        try:
+            count = config.reload_code(parser, conf, modules)
+        finally:
+            if stages:  # output re-applied even if reloading failed
+                stages.attach(parser)
+        return "reloaded {}, rebuilt {:d} templates".format(
+            [m.__name__ for m in modules], count
+        )
+
+    async def reconfigure(path=None):
+        if stages:
+            async with stages.decoding:
+                return reconfig(path)
+        return reconfig(path)
+
+    def reconfig(path=None):
+        nonlocal conf
+        path = path or (conf.path if conf else None)
+        if not path:
+            return "No config file to read"
+        conf = config.swap(
+            parser,
+            conf,
+            config.Config.load(path),
+            stages.retire if stages else None,
+        )
+        if stages:
+            stages.attach(parser)
+        return "configured {}".format(conf)
+
+    async def rehang():
+        try:
+            await reconfigure()
+        except Exception as e:
+            logger.error("Keeping {}: {}".format(conf, e))
+
+    def hangup():
+        asyncio.ensure_future(rehang())
 
     def setloglevel(level):
         logger.setLevel(int(level))  # Int because args are split-up `str`.
         return logger.level
 
     def stop():
-        loop.stop()
+        loop.call_later(0.1, stopping.set)  # after replying
         return "stopping event loop..."
 
-    def run_command(args):
-        """
-        Reply to the few commands existing
-        """
-        run = {
-            "ping": lambda: "pong",
-            "getloglevel": lambda: logger.level,
-            "setloglevel": setloglevel,
-            "stats": testasync.stats,
-            "tree": lambda: Collector.accept(testasync.TreeVisitor()),
-            "reload": load,
-            "shutdown": stop,
-            "help": lambda: "Command must be one of {}".format(
-                [c for c in run.keys()]
-            ),
-        }
-        logger.info("Ctrl: {}".format(args))
-        cmd = args[0]
-        if cmd not in run.keys():
-            return "Command '{}' unknown".format(cmd)
-        else:
-            try:
-                if len(args) == 1:
-                    return run[cmd]()
-                else:
-                    return run[cmd](*args[1:])
-            except Exception as e:
-                return e
-
-    loop = asyncio.get_event_loop()
+    # module attributes looked up on call, modules may get reloaded
+    commands = {
+        "ping": lambda: "pong",
+        "getloglevel": lambda: logger.level,
+        "setloglevel": setloglevel,
+        "stats": lambda: testasync.stats(),
+        "tree": lambda: testasync.tree_chunks(),  # streamed
+        "changes": lambda since=0: Collector.accept(
+            testasync.ChangesVisitor(int(since))
+        ),
+        "summary": Collector.summary,
+        "queues": lambda: stages.stats() if stages else [],
+        "versions": parser.stats,
+        "cluster": lambda: replicator.stats() if replicator else None,
+        "reload": load,
+        "reconfig": reconfigure,
+        "config": lambda: conf.settings,
+        "shutdown": stop,
+        "help": lambda: sorted(commands),
+    }
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    if stages:
+        stages.attach(parser)
+        stages.start()
+        receive = stages.receive
+    else:
+        receive = parser.parse_packet
     # UDP
     logger.info("Starting UDP server on host {} port {}".format(host, port))
-    coro = loop.create_datagram_endpoint(NetFlow, local_addr=(host, port))
-    transport, protocol = loop.run_until_complete(coro)
+    transport, protocol = await loop.create_datagram_endpoint(
+        NetFlow, local_addr=(host, port)
+    )
+    # template replication
+    if replicator:
+        await replicator.start()
     # Unix Sockets (ctrl)
     if socketpath:
         logger.info("Starting Unix Socket on {}".format(socketpath))
-        coro = asyncio.start_unix_server(callback, socketpath, loop=loop)
-        socketserver = loop.run_until_complete(coro)
-    try:
-        loop.run_forever()
-    except KeyboardInterrupt:
-        print()  # newline for ^C
+        socketserver = await asyncio.start_unix_server(
+            control.ControlServer(commands).handle, socketpath
+        )
+    # config file re-read on hangup, stop on interrupt and termination
+    loop.add_signal_handler(signal.SIGHUP, hangup)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    # template state
+    if statepath:
+        saver = util.Periodic(loop, interval, persist.save, statepath)
+    # expiry
+    if sweep:
+        sweep = dict(sweep)
+        sweeper = util.Periodic(
+            loop, sweep.pop("interval"), Collector.expire, **sweep
+        )
+    await stopping.wait()
 
     logger.info("Shutting down...")
-    transport.close()
+    transport.close()  # nothing more to queue
+    if stages:
+        await stages.drain()  # outputs all in memory, sinks flushed on close
+    if replicator:
+        await replicator.stop()
+    if statepath:
+        saver.cancel()
+        persist.save(statepath)
+    if sweep:
+        sweeper.cancel()
     if socketpath:
         socketserver.close()
-        os.remove(socketpath)
-    loop.close()
+        if os.path.exists(socketpath):
+            os.remove(socketpath)
+    for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+        loop.remove_signal_handler(signum)
+    return conf
 
 
 def main(args):
@@ -196,27 +518,116 @@ def main(args):
     logger.setLevel(logging.WARNING) if not args.loglevel else logger.setLevel(
         args.loglevel
     )
-    logger.debug(args)
+    # handlers run in a thread of their own from now on
+    sh.setFormatter(logging.Formatter(logqueue.FORMAT))
+    listener = logqueue.start([sh], logger, args.log_rate)
+    logger.debug("%s", args)
 
     # configure
     socketpath = args.sock
 
     if args.parser.lower() == "v5":
-        # parser = v9_parser
+        parser = Dispatcher((5,))
         port = 2055 if not args.port else args.port
     elif args.parser.lower() == "v9":
-        parser = v9_parser
+        parser = Dispatcher((9,))
         port = 2055 if not args.port else args.port
     elif args.parser.lower() == "ipfix":
-        # parser = ipfix_parser
+        parser = Dispatcher((10,))
         port = 4739 if not args.port else args.port
+    elif args.parser.lower() == "all":
+        parser = Dispatcher()
+        port = 2055 if not args.port else args.port
 
     if not parser:
         print("No suitable parser configured, giving up...")
         exit(1)
 
+    if args.config:
+        conf = config.Config.load(args.config)
+    else:
+        conf = config.Config(
+            filter=args.filter, store=args.store, upscale=args.upscale
+        )
+    conf.build(parser)
+    conf.apply(parser)
+
+    if args.state:
+        persist.restore(args.state, args.state_maxage)
+
+    sweep = None
+    if any(
+        limit is not None
+        for limit in (
+            args.expire_templates,
+            args.expire_idle,
+            args.max_templates,
+        )
+    ):
+        sweep = {
+            "template_age": args.expire_templates,
+            "idle": args.expire_idle,
+            "max_templates": args.max_templates,
+            "interval": args.sweep_interval,
+        }
+
+    stages = None
+    spilling = None
+    if args.sink_policy == "spill":
+        if not args.spill_dir or not args.decode_queue:
+            print("Spilling needs --spill-dir and a decode queue")
+            exit(1)
+        spilling = spill.DiskQueue(
+            args.spill_dir,
+            args.spill_segment * 2 ** 20,
+            spill.dump_batch,
+            spill.load_batch,
+        )
+    if args.decode_queue:
+        stages = Stages(
+            parser,
+            BoundedQueue("decode", args.decode_queue, args.decode_policy),
+            BoundedQueue(
+                "sink", args.sink_queue, args.sink_policy, spilling
+            ),
+            args.decode_threads,
+        )
+        if args.decode_threads > 1 and runtime.gil_enabled():
+            logger.warning(
+                "Decoding with the GIL, %d threads share one core",
+                args.decode_threads,
+            )
+
+    replicator = None
+    if args.node:
+        try:
+            replicator = cluster.Replicator(args.node, dict(args.peers))
+        except ValueError as e:
+            print(e)
+            exit(1)
+
     # fire up event loop
-    start(parser, "0.0.0.0", port, socketpath)
+    if args.loop == "uvloop" and "uvloop" not in runtime.available():
+        print("uvloop is not installed")
+        exit(1)
+    conf = start(
+        parser,
+        "0.0.0.0",
+        port,
+        socketpath,
+        args.state,
+        args.state_interval,
+        sweep,
+        conf,
+        stages,
+        replicator,
+        args.loop,
+        args.trusted,
+    )
+    conf.close()  # flushes sinks
+    if spilling:
+        spilling.close()
+    listener.stop()
 
 
 def run():
@@ -2,20 +2,21 @@
 # -*- coding: utf-8 -*-
 """
 Test parsers using raw NetFlow/IPFIX input from disk
+
+Given a directory or glob pattern, processes all files in it in parallel
+(see `flowproc.batch`).
 """
 
 import argparse
+import os
 import struct
 import sys
 import logging
 
 from flowproc import __version__
 from flowproc import testasync
-# from flowproc import v5_parser
 from flowproc import v9_parser
 
-# from flowproc import v10_parser
-
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
 __license__ = "mit"
@@ -47,7 +48,47 @@ def parse_args(args):
         version="flowproc {ver}".format(ver=__version__),
     )
     parser.add_argument(
-        dest="infile", help="input file to use", type=str, metavar="INPUT_FILE"
+        dest="infile",
+        help="input file to use, or directory or glob pattern (quoted) of "
+        "files to process in parallel, in directories named by exporter "
+        "address",
+        type=str,
+        metavar="INPUT_FILE",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="processes for directories and patterns (default: per CPU)",
+        type=int,
+        action="store",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="JSON config file (filter, store, aggregate, ...) for "
+        "directories and patterns, instead of -f, -o and --upscale",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "-f",
+        "--filter",
+        help="keep records matching expression only, e.g. 'proto tcp and "
+        "dst port 443 and src net 10.0.0.0/8'",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "-o",
+        "--store",
+        help="write records to flow store directory instead of printing",
+        type=str,
+        action="store",
+    )
+    parser.add_argument(
+        "--upscale",
+        help="multiply byte and packet counters by the sampling rate",
+        action="store_true",
     )
     parser.add_argument(
         "-d",
@@ -92,6 +133,42 @@ def main(args):
         args.loglevel
     )
 
+    if not os.path.isfile(args.infile):  # directory or pattern
+        from flowproc import batch
+        from flowproc import config
+
+        if not batch.is_batch(args.infile):
+            print("No such file or directory: {}".format(args.infile))
+            exit(1)
+
+        if args.config:
+            settings = config.Config.load(args.config).settings
+        else:
+            settings = config.Config(
+                filter=args.filter, store=args.store, upscale=args.upscale
+            ).settings
+        totals = batch.run(args.infile, settings, args.jobs)
+        print(batch.report(totals))
+        if "pipeline" in totals:
+            print(totals["pipeline"])
+        return
+
+    # filter and sink modules get imported when asked for only, short jobs
+    # spend much of their time starting up
+    if args.filter:
+        from flowproc.flowfilter import Filter
+
+        v9_parser.record_filter = Filter(args.filter)
+    v9_parser.upscale = args.upscale
+
+    pipeline = None
+    if args.store:
+        from flowproc.flowstore import FlowStore
+        from flowproc.fluent import Fluent
+
+        pipeline = Fluent().sink(FlowStore(args.store)).compile()
+        v9_parser.output = pipeline
+
     try:
         with open(args.infile, "rb") as fh:
             ver = struct.unpack("!H", fh.read(2))[0]
@@ -108,6 +185,9 @@ def main(args):
         print("Closing infile...")
 
     print(testasync.stats())
+    if pipeline:
+        pipeline.close()
+        print(pipeline.stats())
 
 
 def run():
@@ -9,17 +9,25 @@ a stopwatch decorator function
 A class to reflect netflow exporter attributes and options
 """
 
+import contextvars
 import functools
 import logging
 import socket
+import struct
 import time
 
+from abc import ABC
+from abc import abstractmethod
+
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
 __license__ = "mit"
 
 # globals
 logger = logging.getLogger(__name__)
+# export time (unix secs) of the packet being reprocessed from a capture file
+# by `v9_parser.parse_file`, for sinks to store records by, else `None` (now)
+EXPORTED = contextvars.ContextVar("exported", default=None)
 
 
 def stopwatch(fn):
@@ -36,19 +44,43 @@ def stopwatch(fn):
         # log results
         logger = fn.__globals__.get("logger", None)
         if logger:
-            logger.debug(
-                "{elapsed:8.3f} msec elapsed in '{name}'".format(
-                    elapsed=round(msec, 3), name=fn.__qualname__
-                )
-            )
+            logger.debug("%8.3f msec elapsed in '%s'", msec, fn.__qualname__)
         return result
 
     return wrapper
 
 
+class Periodic:
+    """
+    Call a function every interval seconds on an asyncio event loop
+    """
+
+    def __init__(self, loop, interval, func, *args, **kwargs):
+        self.loop = loop
+        self.interval = interval
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.handle = loop.call_later(interval, self._run)
+
+    def _run(self):
+        try:
+            self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            logger.error(
+                "Periodic call of '%s' failed: %r", self.func.__qualname__, e
+            )
+        self.handle = self.loop.call_later(self.interval, self._run)
+
+    def cancel(self):
+        self.handle.cancel()
+
+
+@functools.lru_cache(maxsize=4096)
 def port_to_str(port):
     """
-    TODO
+    Return service name for (TCP) port number, `None` if there's none - the
+    services database is read on every lookup, hence the cache
     """
     try:
         return socket.getservbyport(port)
@@ -56,6 +88,46 @@ def port_to_str(port):
         return None
 
 
+def proto_to_str(proto):
+    """
+    Return IANA label for protocol number, the number itself if unassigned
+    """
+    return PROTO.get(proto, proto)
+
+
+@functools.lru_cache(maxsize=None)
+def proto_to_num(label):
+    """
+    Return protocol number for IANA label (any case), `None` if unknown -
+    looked up as asked for instead of a reverse table built at import
+    """
+    label = label.lower()
+    for proto, name in reversed(PROTO.items()):
+        if name.lower() == label:
+            return proto
+    return None
+
+
+def get_header_version(packet):
+    """
+    Return the version number in first two bytes of an export packet
+    """
+    return struct.unpack("!H", packet[:2])[0]
+
+
+class AbstractCollector(ABC):
+    """
+    The things every collector class should implement
+    """
+
+    @abstractmethod
+    def collect(self, client_addr, export_packet):
+        """
+        Process an export packet received from client_addr
+        """
+        pass
+
+
 # ----- [ flag ] = label
 TCPFLAGS = {}
 TCPFLAGS[1 << 0] = "fin"
@@ -93,6 +165,95 @@ def tcpflags_to_str(flags, brief=False):
     return short if brief else verbose
 
 
+# ----- [ address field label ] = IP version
+ADDRESS_FIELDS = {
+    "IPV4_SRC_ADDR": 4,
+    "IPV4_DST_ADDR": 4,
+    "IPV4_NEXT_HOP": 4,
+    "BGP_IPV4_NEXT_HOP": 4,
+    "IPV6_SRC_ADDR": 6,
+    "IPV6_DST_ADDR": 6,
+    "IPV6_NEXT_HOP": 6,
+    "BPG_IPV6_NEXT_HOP": 6,
+}
+ADDRESS_CACHE_SIZE = 65536  # addresses repeat a lot within flow data
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def ipv4_to_str(ipa):
+    """
+    Return dotted quad for IPv4 address given as `int` or packed `bytes`
+    """
+    if isinstance(ipa, int):
+        ipa = ipa.to_bytes(4, "big")
+    return socket.inet_ntoa(ipa)
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def ipv6_to_str(ipa):
+    """
+    Return IPv6 address given as `int` or packed `bytes` in exploded form
+    (as `ipaddress` does, to match `Exporter.ipa` etc.)
+    """
+    if isinstance(ipa, int):
+        ipa = ipa.to_bytes(16, "big")
+    h = ipa.hex()
+    return ":".join([h[i:i + 4] for i in range(0, 32, 4)])
+
+
+def addresses_to_str(values, version=4):
+    """
+    Return `list` of text for a column of addresses (`int` or packed)
+    """
+    return list(map(ipv4_to_str if version == 4 else ipv6_to_str, values))
+
+
+def packed_to_str(buf, width=4):
+    """
+    Return `list` of text for addresses packed back to back in buf, as
+    raw 4 or 16 byte fields come in
+    """
+    buf = bytes(buf)
+    return addresses_to_str(
+        [buf[i:i + width] for i in range(0, len(buf), width)],
+        4 if width == 4 else 6,
+    )
+
+
+def render_addresses(records):
+    """
+    Return records with address fields converted to text, column-wise for
+    a batch of named tuples of one type (as parsers produce), per record for
+    `dict` records. Only sinks needing text should call this.
+    """
+    if not records:
+        return records
+
+    first = records[0]
+    if not hasattr(first, "_fields"):
+        rendered = []
+        for rec in records:
+            rec = dict(rec)
+            for k, version in ADDRESS_FIELDS.items():
+                if isinstance(rec.get(k), int):
+                    rec[k] = addresses_to_str([rec[k]], version)[0]
+            rendered.append(rec)
+        return rendered
+
+    columns = [
+        (i, ADDRESS_FIELDS[label])
+        for i, label in enumerate(first._fields)
+        if label in ADDRESS_FIELDS
+    ]
+    if not columns:
+        return records
+    table = list(zip(*records))
+    for i, version in columns:
+        table[i] = addresses_to_str(table[i], version)
+    make = type(first)._make
+    return [make(row) for row in zip(*table)]
+
+
 # @stopwatch
 def fqdnlookup(ipa_str):
     """
@@ -264,6 +425,17 @@ def dstport_to_icmptc(dstport):
     return int(dstport / 256), dstport % 256
 
 
+# ----- [ dimension ] = record keys carrying it, V9 labels before SiLK-like
+# (V5) names, used wherever records of both kinds get inspected by meaning
+FIELD_ALIASES = {
+    "srcaddr": ("IPV4_SRC_ADDR", "IPV6_SRC_ADDR", "sIP", "srcaddr"),
+    "dstaddr": ("IPV4_DST_ADDR", "IPV6_DST_ADDR", "dIP", "dstaddr"),
+    "srcport": ("L4_SRC_PORT", "sPort", "srcport"),
+    "dstport": ("L4_DST_PORT", "dPort", "dstport"),
+    "proto": ("PROTOCOL", "protocol", "prot"),
+}
+
+
 # TODO This is work in progress...
 ICMPTEXT = {
     (0, 0): "Echo Reply",
@@ -310,23 +482,8 @@ def ffs(length, ftype=None):
     Return:
         Format string for 'struct.unpack' w. prefix '!' (network byte order)
     """
-    # TODO Revise/ improve!
-
-    # filtering dict
-    fdict = {
-        40: "Ixxxx",  # these 4 types (from TOTAL_BYTES_EXP and 163
-        41: "Ixxxx",  # send lengt=8
-        42: "Ixxxx",
-        163: "Ixxxx",
-        153: "Ixxxx",  # 153, 160, NF_F_FLOW_CREATE_TIME_MSEC
-        160: "Ixxxx",
-        152: "Ixxxx",
-    }
-    try:
-        return fdict[ftype]  # lookup for problematic fields
-    except KeyError:
-        pass
-
+    # Lengths without native format (and strings) raise `KeyError`, see
+    # `flowproc.fieldcodecs` for decoding any field by its type.
     ldict = {1: "B", 2: "H", 4: "I", 8: "Q"}
     return ldict[length]
 
@@ -338,10 +495,7 @@ def vunpack(dataslice):
     According to bitkeks (D. Pataky): "Better solution than struct.unpack
                                        with variable field length"
 
-    We just try it out here :)
+    Return:
+        `int` for big-endian bytes of any length
     """
-    fdata = 0
-    for idx, byte in enumerate(reversed(bytearray(dataslice))):
-        fdata += byte << (idx * 8)
-
-    return fdata
+    return int.from_bytes(dataslice, "big")
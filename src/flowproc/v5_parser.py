@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for NetFlow V5 packets
+
+V5 records are of fixed layout. They get the labels of the NetFlow V9
+field types with the same meaning, so filters, pipelines and flow stores
+handle records of both versions alike.
+"""
+
+import logging
+import struct
+
+from flowproc import util
+from flowproc.collector_state import Collector
+from flowproc.logqueue import EXPORTER
+from flowproc.v9_classes import field_label
+from flowproc.v9_classes import record_type
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+# global settings
+logger = logging.getLogger(__name__)
+HEADER = struct.Struct("!HHIIIIBBH")
+# srcaddr, dstaddr, nexthop, input, output, dPkts, dOctets, First, Last,
+# srcport, dstport, pad1, tcp_flags, prot, tos, src_as, dst_as, src_mask,
+# dst_mask, pad2
+RECORD = struct.Struct("!IIIHHIIIIHHxBBBHHBBxx")
+TYPES = (8, 12, 15, 10, 14, 2, 1, 22, 21, 7, 11, 6, 4, 5, 16, 17, 9, 13)
+LABELS = tuple(field_label(n) for n in TYPES)
+Record = record_type(LABELS)
+
+
+def print_records(ipa, records):
+    """
+    Default output, print Data Records
+    """
+    for record in util.render_addresses(records):
+        print("DataRec: {}".format(record))
+
+
+# callable(ipa, records) receiving the records of each packet, see
+# `v9_parser.output`
+output = print_records
+
+# `flowproc.flowfilter.Filter` applied to records right after unpacking
+record_filter = None
+
+# no options to join with, kept for the same settings as the other parsers
+JOINS = ()
+joins = JOINS
+
+# multiply counters by the sampling interval the header announces
+SCALED = tuple(LABELS.index(label) for label in ("IN_PKTS", "IN_BYTES"))
+upscale = False
+
+
+def parse_packet(datagram, ipa):
+    """
+    Responsibility: parse UDP packet received from NetFlow V5 exporter
+
+    Args:
+        packet  `bytes`: next packet to parse
+        ipa     `str` or `int`: ip addr to use for exporter identification
+    """
+    EXPORTER.set(ipa)  # log context
+    header = HEADER.unpack_from(datagram)
+    ver, count, up, secs, nsecs, seq, etype, eid, sampling = header
+
+    end = HEADER.size + count * RECORD.size
+    if len(datagram) < end:
+        logger.warning(
+            "Packet of %d bytes too short for %d records", len(datagram), count
+        )
+        end = HEADER.size + (len(datagram) - HEADER.size) // RECORD.size * (
+            RECORD.size
+        )
+
+    keep = (
+        record_filter.compile(LABELS, index=True) if record_filter else None
+    )
+    # sampling mode in the 2 upper bits, interval in the lower 14
+    rate = sampling & 0x3FFF if upscale else 0
+    records = []
+    for unpacked in RECORD.iter_unpack(memoryview(datagram)[HEADER.size:end]):
+        if keep and not keep(unpacked):
+            continue
+        if rate > 1:
+            unpacked = list(unpacked)
+            for pos in SCALED:
+                unpacked[pos] *= rate
+        records.append(Record._make(unpacked))
+    output(ipa, records)
+
+    logger.info("Parsed %s, %d recs from %s", header, len(records), ipa)
+
+    # stats
+    Collector.packets += 1
+    Collector.count += count
+    Collector.record_count += (end - HEADER.size) // RECORD.size
@@ -4,8 +4,11 @@ Template classes for NetFlow V9 parsing
 
 import logging
 
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 
+from flowproc import fieldcodecs
 from flowproc import v9_fieldtypes
 from flowproc.collector_state import AbstractTemplate
 from flowproc.collector_state import Collector
@@ -14,53 +17,108 @@ from flowproc.collector_state import Collector
 logger = logging.getLogger(__name__)
 
 
+def field_label(ftype):
+    """
+    Return label for field type, a valid identifier for unknown types too
+    """
+    return v9_fieldtypes.LABEL.get(ftype, "FIELD_{:d}".format(ftype))
+
+
+@lru_cache(maxsize=1024)
+def record_type(labels):
+    """
+    Return the named tuple class for Data Records with field labels given,
+    shared by all templates with the same layout
+
+    Args:
+        labels      `tuple` of `str`
+    """
+    # rename=True for fields sent twice in one template
+    return namedtuple("DataRecord", labels, rename=True)
+
+
 class Template(AbstractTemplate):
     """
     Responsibility: represent Template Record
+
+    Everything derived from the field list gets computed once, here.
     """
 
+    __slots__ = (
+        "tid",
+        "tdata",
+        "types",
+        "lengths",
+        "offsets",
+        "reclen",
+        "labels",
+        "Record",
+        "codec",
+        "lastwrite",
+    )
+
     def __init__(self, ipa, odid, tid, tdata):
         self.tid = tid
-        self.tdata = tdata
+        self.tdata = tuple(tdata)
+        self.types = self.tdata[0::2]  # using start::step for all field types
+        self.lengths = self.tdata[1::2]  # same for all field lengths
+        offsets = [0]
+        for length in self.lengths:
+            offsets.append(offsets[-1] + length)
+        self.offsets = tuple(offsets)  # field n from offsets[n:n + 2]
+        self.reclen = offsets[-1]
+        self.labels = tuple(field_label(n) for n in self.types)
+        self.Record = record_type(self.labels)
+        self.codec = fieldcodecs.record_codec(self.types, self.lengths)
         self.lastwrite = datetime.utcnow()  # TODO add timezone info
 
         Collector.register(ipa, odid, self)
 
     @classmethod
-    def get(cls, tid):
+    def get(cls, ipa, odid, tid):
         """
         Return:
             `Template` or raise `KeyError`
         """
-        return cls.tdict[tid]
+        template = Collector.get_qualified(ipa, odid, tid)
+        if not isinstance(template, cls):
+            raise KeyError(tid)
+        return template
 
     @classmethod
-    def discard_all(cls):
-        """
-        Discard all templates
+    def discard_all(cls, ipa=None, odid=None):
         """
-        cls.tdict = {}
-
-    @property
-    def types(self):
-        return self.tdata[0::2]  # using start::step for all field types
+        Discard all templates of the observation domain on path, of all
+        domains if no path given
 
-    @property
-    def lengths(self):
-        return self.tdata[1::2]  # same for all field lengths
+        Return:
+            number of templates discarded
+        """
+        if ipa is None:
+            paths = [
+                (ipa, odid)
+                for ipa, exporter in Collector.children.items()
+                for odid in exporter.children
+            ]
+        else:
+            paths = [(ipa, odid)]
+
+        count = 0
+        for ipa, odid in paths:
+            domain = Collector.get_qualified(ipa, odid)
+            for tid in list(domain.children) if domain is not None else ():
+                count += Collector.unregister(ipa, odid, tid)
+        return count
 
     def __str__(self):
         return "{:d} age={} types={}".format(
             self.tid,
             datetime.utcnow() - self.lastwrite,
-            list(zip(
-                [v9_fieldtypes.LABEL.get(n, n) for n in self.types],
-                self.lengths
-            )),
+            list(zip(self.labels, self.lengths)),
         )
 
     def __repr__(self):
-        return self.tid, self.tdata  # TODO Should be string!
+        return "{}({:d}, {})".format(type(self).__name__, self.tid, self.tdata)
 
     def get_tid(self):
         return self.tid
@@ -71,37 +129,50 @@ class OptionsTemplate(AbstractTemplate):
     Responsibility: represent Options Template Record attributes
     """
 
+    __slots__ = (
+        "tid",
+        "scopes",
+        "options",
+        "scope_types",
+        "scope_lengths",
+        "option_types",
+        "option_lengths",
+        "reclen",
+        "codec",
+        "lastwrite",
+    )
+
     def __init__(self, ipa, odid, tid, scopes, options):
         self.tid = tid
-        self.scopes = scopes
-        self.options = options
+        self.scopes = tuple(scopes)
+        self.options = tuple(options)
+        # using start::step for all field types, lengths
+        self.scope_types = self.scopes[0::2]
+        self.scope_lengths = self.scopes[1::2]
+        self.option_types = self.options[0::2]
+        self.option_lengths = self.options[1::2]
+        self.reclen = sum(self.scope_lengths) + sum(self.option_lengths)
+        # scope field types have their own number space, all unsigned
+        self.codec = fieldcodecs.record_codec(
+            self.scope_types + self.option_types,
+            self.scope_lengths + self.option_lengths,
+            ("unsigned",) * len(self.scope_types)
+            + (None,) * len(self.option_types),
+        )
         self.lastwrite = datetime.utcnow()  # TODO add timezone info
 
         Collector.register(ipa, odid, self)
 
     @classmethod
-    def get(cls, tid):
+    def get(cls, ipa, odid, tid):
         """
         Return:
-            `Template` or raise `KeyError`
+            `OptionsTemplate` or raise `KeyError`
         """
-        return cls.tdict[tid]
-
-    @property
-    def scope_types(self):
-        return self.scopes[0::2]  # using start::step for all field types
-
-    @property
-    def scope_lengths(self):
-        return self.scopes[1::2]  # same for all field lengths
-
-    @property
-    def option_types(self):
-        return self.options[0::2]  # as above
-
-    @property
-    def option_lengths(self):
-        return self.options[1::2]  # as above
+        template = Collector.get_qualified(ipa, odid, tid)
+        if not isinstance(template, cls):
+            raise KeyError(tid)
+        return template
 
     def __str__(self):
         return "{:d} age={} scopes={} options={}".format(
@@ -121,7 +192,9 @@ class OptionsTemplate(AbstractTemplate):
         )
 
     def __repr__(self):
-        return self.tid, self.scopes, self.options  # TODO Should be string!
+        return "{}({:d}, {}, {})".format(
+            type(self).__name__, self.tid, self.scopes, self.options
+        )
 
     def get_tid(self):
         return self.tid
@@ -72,7 +72,7 @@ LABEL = {
     47: 'MPLS_TOP_LABEL_IP_ADDR',
     48: 'FLOW_SAMPLER_ID',
     49: 'FLOW_SAMPLER_MODE',
-    50: 'NTERVAL',
+    50: 'FLOW_SAMPLER_RANDOM_INTERVAL',
     # 51 vendor proprietary
     52: 'MIN_TTL',
     53: 'MAX_TTL',
@@ -137,6 +137,9 @@ LABEL = {
     281: 'NF_F_XLATE_SRC_ADDR_IPV6',  # Post NAT Source IPv6 Address
     282: 'NF_F_XLATE_DST_ADDR_IPV6',  # Post NAT Destination IPv6 Address
     233: 'NF_F_FW_EVENT',  # High-level event code
+    234: 'INGRESS_VRFID',  # from IPFIX
+    235: 'EGRESS_VRFID',  # from IPFIX
+    236: 'VRF_NAME',  # from IPFIX
     33002: 'NF_F_FW_EXT_EVENT',  # Extended event code
     323: 'NF_F_EVENT_TIME_MSEC',  # The time that the event occurred, which comes from IPFIX
     152: 'NF_F_FLOW_CREATE_TIME_MSEC',
@@ -161,3 +164,31 @@ SCOPE_LABEL = {
     4: "Cache",
     5: "Template",
 }
+
+# What field values mean, for decoding - types not listed are unsigned
+# integers (any length from 1 to 16 bytes, raw `bytes` beyond)
+SEMANTIC = {}
+SEMANTIC.update(dict.fromkeys(
+    (
+        8, 12, 15, 18, 27, 28, 44, 45, 47, 62, 63,
+        130, 131,  # IPFIX exporterIPv4Address, exporterIPv6Address
+        225, 226, 281, 282,
+    ),
+    "address",
+))
+SEMANTIC.update(dict.fromkeys((56, 57, 80, 81), "mac"))
+SEMANTIC.update(dict.fromkeys(
+    (82, 83, 84, 94, 96, 236, 40000, 56702), "string"
+))
+SEMANTIC.update(dict.fromkeys(
+    (
+        21, 22,  # sysUpTime milliseconds
+        150, 151,  # IPFIX flowStart/EndSeconds
+        152, 153,  # flowStart/EndMilliseconds
+        154, 155, 156, 157,  # flowStart/EndMicro- and Nanoseconds
+        160,  # systemInitTimeMilliseconds
+        323,
+    ),
+    "timestamp",
+))
+SEMANTIC.update(dict.fromkeys((104,), "octets"))
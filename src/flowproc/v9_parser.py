@@ -6,13 +6,15 @@ Parser for NetFlow V9 packets
 import logging
 import struct
 
-from ipaddress import ip_address
+from functools import lru_cache
 
 from flowproc import util
 from flowproc import v9_fieldtypes
 from flowproc.collector_state import Collector
+from flowproc.logqueue import EXPORTER
 from flowproc.v9_classes import OptionsTemplate
 from flowproc.v9_classes import Template
+from flowproc.v9_classes import record_type
 
 __author__ = "Tobias Frei"
 __copyright__ = "Tobias Frei"
@@ -24,6 +26,86 @@ LIM = 1800  # out of sequence tdiff limit for discarding templates
 lim = LIM
 
 
+def print_records(ipa, records):
+    """
+    Default output, print Data Records
+    """
+    for record in util.render_addresses(records):
+        print("DataRec: {}".format(record))
+
+
+# callable(ipa, records) receiving the batch of Data Records (named tuples,
+# one class per template layout) decoded per Data FlowSet - addresses are
+# `int`, see `util.render_addresses` - e.g. a compiled
+# `flowproc.fluent.Pipeline`
+output = print_records
+
+# `flowproc.flowfilter.Filter` applied to Data Records right after unpacking
+record_filter = None
+
+# Joins of Data Records with the options index of their observation domain,
+# as (label added, key label in record, options table, options field)
+JOINS = (
+    ("IN_IF_NAME", "INPUT_SNMP", "interface", "IF_NAME"),
+    ("OUT_IF_NAME", "OUTPUT_SNMP", "interface", "IF_NAME"),
+    (
+        "SAMPLING_RATE",
+        "FLOW_SAMPLER_ID",
+        "sampler",
+        "FLOW_SAMPLER_RANDOM_INTERVAL",
+    ),
+    ("VRF_NAME", "INGRESS_VRFID", "vrf", "VRF_NAME"),
+)
+joins = JOINS  # set to () to get Data Records as sent
+
+# counters multiplied by the sampling rate when `upscale` is set, see
+# `ObservationDomain.sampling_rate`
+SCALED = ("IN_BYTES", "IN_PKTS", "OUT_BYTES", "OUT_PKTS")
+upscale = False
+
+
+@lru_cache(maxsize=1024)
+def join_plan(labels, joins):
+    """
+    Return the Data Record class with joined labels appended and the
+    (key position, options table, options field) to look up for each
+
+    Args:
+        labels      `tuple`: field labels of a template
+        joins       `tuple`: see `JOINS`
+    """
+    applying = [
+        (out, labels.index(key), table, field)
+        for out, key, table, field in joins
+        if key in labels and out not in labels
+    ]
+    return (
+        record_type(labels + tuple(out for out, _, _, _ in applying)),
+        tuple((pos, table, field) for _, pos, table, field in applying),
+    )
+
+
+@lru_cache(maxsize=1024)
+def scale_plan(labels):
+    """
+    Return positions of the counters to upscale and of the fields telling
+    the sampling rate, FLOW_SAMPLER_ID and SAMPLING_INTERVAL (`None` if not
+    in labels)
+
+    Args:
+        labels      `tuple`: field labels of a template
+    """
+    return (
+        tuple(labels.index(label) for label in SCALED if label in labels),
+        labels.index("FLOW_SAMPLER_ID")
+        if "FLOW_SAMPLER_ID" in labels
+        else None,
+        labels.index("SAMPLING_INTERVAL")
+        if "SAMPLING_INTERVAL" in labels
+        else None,
+    )
+
+
 @util.stopwatch
 def parse_options_data_records(ipa, odid, template, flowset):
     """
@@ -38,57 +120,20 @@ def parse_options_data_records(ipa, odid, template, flowset):
     Return:
         number of records processed
     """
-    record_count = 0
-
-    # scopes part
-    scopes = {}
-    unpacked = []
-    start = 0
-    stop = start
-    for length in template.scope_lengths:
-        stop += length
-
-        unpacked.append(
-            struct.unpack(util.ffs(length), flowset[start:stop])[0]
-        )
-        start = stop
-
     labels = [
         v9_fieldtypes.SCOPE_LABEL.get(n, n) for n in template.scope_types
-    ]
-    scopes.update(list(zip(labels, unpacked)))
-
-    # options part
-    options = {}
-    unpacked = []
-
-    # To fix a few bad field lengths, we work with lengt/type-pairs
-    pair = list(zip(template.option_lengths, template.option_types))
-    for length, ftype in pair:
-        stop += length
-
-        try:
-            unpacked.append(
-                struct.unpack(
-                    util.ffs(length, ftype=ftype), flowset[start:stop]
-                )[0]
-            )
-        except KeyError:
-            # remove from 1st trailing \x00 and decode to `str`
-            unpacked.append(flowset[start:stop].partition(b"\0")[0].decode())
-        start = stop
+    ] + [v9_fieldtypes.LABEL.get(n, n) for n in template.option_types]
 
-    labels = [v9_fieldtypes.LABEL.get(n, n) for n in template.option_types]
-    options.update(list(zip(labels, unpacked)))
+    for unpacked in template.codec.decode(flowset):
+        optrec = dict(zip(labels, unpacked))
 
-    # register record with corresponding odid
-    optrec = scopes.update(options)
-    Collector.register_optrec(ipa, odid, optrec)
+        # index record with corresponding odid, to join Data Records with
+        Collector.register_optrec(ipa, odid, optrec)
 
-    print("OptionsDataRec: {}".format(optrec))
+        logger.debug("OptionsDataRec: %s", optrec)
 
-    reclen = sum(template.scope_lengths) + sum(template.option_lengths)
-    record_count = len(flowset) // reclen  # divide // to rule out padding
+    # divide // to rule out padding
+    record_count = len(flowset) // template.reclen
 
     return record_count
 
@@ -116,35 +161,58 @@ def parse_data_flowset(ipa, odid, tid, flowset):
             return parse_options_data_records(ipa, odid, template, flowset)
 
         else:
-            record = {}
-            unpacked = []
-            start = 0
-            stop = start
-            for length in template.lengths:
-                stop += length
-
-                unpacked.append(util.vunpack(flowset[start:stop]))
-                start = stop
-
-            labels = [v9_fieldtypes.LABEL.get(n, n) for n in template.types]
-            record.update(list(zip(labels, unpacked)))
-
-            # replace ont the fly, just for testing/ plausibility checking
-            # TODO Remove later!
-            for k, v in record.items():
-                if k in [
-                    "IPV4_SRC_ADDR",
-                    "IPV4_DST_ADDR",
-                    "IPV4_NEXT_HOP",
-                    "IPV6_SRC_ADDR",
-                    "IPV6_DST_ADDR",
-                    "IPV6_NEXT_HOP",
-                ]:
-                    record[k] = ip_address(v).exploded
-
-            print("DataRec: {}".format(record))
-
-            reclen = sum(template.lengths)
+            reclen = template.reclen
+            domain = Collector.get_qualified(ipa, odid)
+            Record, plan = join_plan(template.labels, joins)
+            if plan:
+                lookups = [
+                    (pos, domain.options.get(table, {}), field)
+                    for pos, table, field in plan
+                ]
+            scaled, sampler_pos, interval_pos = (
+                scale_plan(template.labels) if upscale else ((), None, None)
+            )
+            if scaled:
+                default_rate = domain.sampling_rate()
+                rates = {}  # per sampler
+            records = []
+            keep = (
+                record_filter.compile(template.labels, index=True)
+                if record_filter
+                else None
+            )
+
+            # all records in the set at once, a trailing rest is padding
+            for unpacked in template.codec.decode(flowset):
+                if keep and not keep(unpacked):
+                    continue  # dropped before any conversion
+
+                if scaled:
+                    if interval_pos is not None:
+                        rate = unpacked[interval_pos] or default_rate
+                    elif sampler_pos is not None:
+                        sampler = unpacked[sampler_pos]
+                        rate = rates.get(sampler)
+                        if rate is None:
+                            rate = rates[sampler] = domain.sampling_rate(
+                                sampler
+                            )
+                    else:
+                        rate = default_rate
+                    if rate > 1:
+                        unpacked = list(unpacked)
+                        for pos in scaled:
+                            unpacked[pos] *= rate
+
+                if plan:
+                    unpacked = list(unpacked)
+                    for pos, table, field in lookups:
+                        entry = table.get(unpacked[pos])
+                        unpacked.append(entry.get(field) if entry else None)
+
+                records.append(Record._make(unpacked))
+
+            output(ipa, records)
 
         record_count = len(flowset) // reclen  # divide // to rule out padding
 
@@ -264,7 +332,7 @@ def dispatch_flowset(ipa, odid, setid, packed):
     else:
         # interval [2, 255]
         logger.error(
-            "No implementation for unknown ID {:3d} - {}".format(setid, packed)
+            "No implementation for unknown ID %3d - %s", setid, packed
         )
 
     return record_count
@@ -280,8 +348,10 @@ def parse_packet(datagram, ipa):
     """
     record_count = 0
 
+    EXPORTER.set(ipa)  # log context
     header = struct.unpack("!HHIIII", datagram[:20])
     ver, count, up, unixsecs, seq, odid = header
+    Collector.touch(ipa, odid)
 
     packed = datagram[20:]
 
@@ -299,13 +369,15 @@ def parse_packet(datagram, ipa):
     if count:
         if count != record_count:
             logger.warning(
-                "Record account not balanced {}/{}".format(record_count, count)
+                "Record account not balanced %d/%d", record_count, count
             )
 
     logger.info(
-        "Parsed {} WITHOUT checks, {}/{} recs processed from {}".format(
-            header, record_count, count, ipa
-        )
+        "Parsed %s WITHOUT checks, %d/%d recs processed from %s",
+        header,
+        record_count,
+        count,
+        ipa,
     )
 
     # stats
@@ -315,79 +387,95 @@ def parse_packet(datagram, ipa):
         Collector.record_count += record_count
 
 
-def parse_file(fh, ipa):
+def parse_file(fh, ipa, templates_only=False):
     """
     Responsibility: parse raw NetFlow V9 data from disk.
 
     Args:
-        fh      `BufferedReader`, BytesIO` etc: input file handle
-        ipa     `str` or `int`: ip addr to use for exporter identification
-    """
-    lastseq = None
-    lastup = None
-    count = None
-    record_count = 0
-    odid = None
-
-    while True:
-        pos = fh.tell()
-        packed = fh.read(4)
-
-        try:
-            assert len(packed) == 4
-        except AssertionError:
-            # EOF
-            return
-
-        # Unpack, expecting the next FlowSet.
-        setid, setlen = struct.unpack("!HH", packed)
-
-        if setid != 9:
-            packed = fh.read(setlen - 4)
-            assert len(packed) == setlen - 4
-            record_count += dispatch_flowset(ipa, odid, setid, packed)
+        fh              `BufferedReader`, BytesIO` etc: input file handle
+        ipa             `str` or `int`: ip addr to use for exporter
+                        identification
+        templates_only  `bool`: skip Data FlowSets, to get the template
+                        state at the file's end quickly
 
-        else:
-            # for completeness' sake
-            if count:
-                if count != record_count:
-                    logger.warning(
-                        "Record account not balanced {}/{}".format(
-                            record_count, count
-                        )
-                    )
-                else:
-                    logger.debug("Processed {} records".format(count))
-
-            # next packet header
-            fh.seek(pos)
-            packed = fh.read(20)
-            assert len(packed) == 20
-            header = struct.unpack("!HHIIII", packed)
-            ver, count, up, unixsecs, seq, odid = header
-
-            logger.info(header)
-
-            # stats
-            Collector.packets += 1
-            Collector.count += count
-            if record_count:
+    While parsing, `util.EXPORTED` holds the export time of the packet.
+    """
+    EXPORTER.set(ipa)  # log context
+    token = util.EXPORTED.set(None)  # records stored by export time
+    try:
+        lastseq = None
+        lastup = None
+        count = None
+        record_count = 0
+        odid = None
+
+        while True:
+            pos = fh.tell()
+            packed = fh.read(4)
+
+            try:
+                assert len(packed) == 4
+            except AssertionError:
+                # EOF, the last packet's records count too
                 Collector.record_count += record_count
-
-            # sequence checks
-            if lastup and lastseq:
-                if seq != lastseq + 1:
-                    updiff = up - lastup
-                    logger.warning(
-                        "Out of seq, lost {}, tdiff {:.1f} s".format(
-                            seq - lastseq, round(updiff / 1000, 1)
+                return
+
+            # Unpack, expecting the next FlowSet.
+            setid, setlen = struct.unpack("!HH", packed)
+
+            if templates_only and setid > 255:
+                fh.seek(setlen - 4, 1)
+
+            elif setid != 9:
+                packed = fh.read(setlen - 4)
+                assert len(packed) == setlen - 4
+                record_count += dispatch_flowset(ipa, odid, setid, packed)
+
+            else:
+                # for completeness' sake
+                if count and not templates_only:
+                    if count != record_count:
+                        logger.warning(
+                            "Record account not balanced %d/%d",
+                            record_count,
+                            count,
+                        )
+                    else:
+                        logger.debug("Processed %d records", count)
+
+                # next packet header
+                fh.seek(pos)
+                packed = fh.read(20)
+                assert len(packed) == 20
+                header = struct.unpack("!HHIIII", packed)
+                ver, count, up, unixsecs, seq, odid = header
+                Collector.touch(ipa, odid)
+                util.EXPORTED.set(unixsecs)
+
+                logger.info("%s", header)
+
+                # stats
+                Collector.packets += 1
+                Collector.count += count
+                if record_count:
+                    Collector.record_count += record_count
+
+                # sequence checks
+                if lastup and lastseq:
+                    if seq != lastseq + 1:
+                        updiff = up - lastup
+                        logger.warning(
+                            "Out of seq, lost %d, tdiff %.1f s",
+                            seq - lastseq,
+                            updiff / 1000,
                         )
-                    )
-                    if updiff > lim * 1000:
-                        logger.warning("Discarding templates")
-                        Template.discard_all()
-
-            lastup = up
-            lastseq = seq
-            count = header[1]
-            record_count = 0
+                        if updiff > lim * 1000:
+                            logger.warning("Discarding templates")
+                            Template.discard_all(ipa, odid)
+
+                lastup = up
+                lastseq = seq
+                count = header[1]
+                record_count = 0
+    finally:
+        util.EXPORTED.reset(token)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'batch' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import glob
+import logging
+import os
+import struct
+
+from flowproc import batch
+from flowproc.collector_state import Collector
+from flowproc.flowstore import FlowStore
+from flowproc.flowstore import Query
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+RECORDS = 3
+EXPORTED = 1571234567  # export time of packet 0, a minute between packets
+
+
+def header(count, seq):
+    unixsecs = EXPORTED + 60 * seq
+    return struct.pack("!HHIIII", 9, count, 1000 + seq, unixsecs, seq, 0)
+
+
+def template(tid):
+    # src addr, dst addr, bytes
+    tset = struct.pack("!10H", 0, 20, tid, 3, 8, 4, 12, 4, 1, 4)
+    return header(1, 0) + tset
+
+
+def data(tid, seq):
+    records = struct.pack("!III", 0xC0000201, 0xC0000202, 1500) * RECORDS
+    dset = struct.pack("!HH", tid, 4 + len(records)) + records
+    return header(RECORDS, seq) + dset
+
+
+def write(path, *packets):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(b"".join(packets))
+
+
+def test_run(tmp_path):
+    captures = tmp_path / "captures"
+    # template in the first file only, used by the following ones
+    write(str(captures / "192.0.2.1" / "01"), template(256), data(256, 1))
+    write(str(captures / "192.0.2.1" / "02"), data(256, 2), data(256, 3))
+    write(str(captures / "192.0.2.1" / "03"), data(256, 4))
+    # same template ID, other exporter, other template
+    write(str(captures / "192.0.2.2" / "01"), data(256, 1), template(256))
+    write(str(captures / "misc" / "v5"), struct.pack("!HH", 5, 0))
+
+    assert batch.is_batch(str(captures))
+    assert batch.is_batch(str(captures / "*" / "0?"))
+    assert batch.exporter_of(str(captures / "misc" / "v5")) == "0.0.0.0"
+
+    store = str(tmp_path / "store")
+    totals = batch.run(str(captures), {"store": store}, jobs=2)
+    assert totals["files"] == 4
+    assert totals["failed"] == 1  # V5
+    assert totals["exporters"] == 3
+    assert totals["seeded"] == 2  # for 192.0.2.1's 02 and 03
+    assert totals["packets"] == 7
+    # 192.0.2.2's data came before its template
+    assert totals["count"] == 5 * RECORDS + 2
+    assert totals["record_count"] == 4 * RECORDS + 2
+    assert totals["pipeline"]["records"] == 4 * RECORDS
+    assert "Files failed:                 1" in batch.report(totals)
+
+    lines = 0
+    for segment in glob.glob(os.path.join(store, "flows-*.jsonl")):
+        with open(segment) as fh:
+            lines += len(fh.readlines())
+    assert lines == 4 * RECORDS
+
+    # stored at export time, not when reprocessed
+    query = Query(start=EXPORTED + 120, end=EXPORTED + 240)
+    found = list(FlowStore(store).query(query))
+    assert sorted(ts for ts, _, _ in found) == [EXPORTED + 120] * RECORDS + [
+        EXPORTED + 180
+    ] * RECORDS
+    assert {exporter for _, exporter, _ in found} == {"192.0.2.1"}
+    assert Collector.get_qualified("192.0.2.1") is None  # all in workers
+
+
+def test_merge_stats():
+    total = batch.merge_stats(
+        None, {"a": 1, "s": [{"stage": "x", "in": 2}], "n": None}
+    )
+    total = batch.merge_stats(total, {"a": 2, "s": [{"stage": "x", "in": 3}]})
+    assert total == {"a": 3, "s": [{"stage": "x", "in": 5}], "n": None}
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'cluster' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import asyncio
+import json
+import logging
+import threading
+
+from flowproc import cluster
+from flowproc.collector_state import Collector
+from flowproc.v9_classes import Template
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+KEYS = ["10.0.{:d}.{:d}".format(i // 256, i % 256) for i in range(3000)]
+
+
+def test_ring():
+    ring = cluster.HashRing(["a", "b", "c"])
+    owners = {key: ring.owner(key) for key in KEYS}
+    counts = [list(owners.values()).count(n) for n in "abc"]
+    assert min(counts) > 500  # roughly balanced
+
+    backups = {key: ring.lookup(key, 2)[1] for key in KEYS}
+    assert all(backups[key] != owners[key] for key in KEYS)
+
+    ring.remove("b")
+    for key in KEYS:
+        if owners[key] == "b":
+            assert ring.owner(key) == backups[key]  # the backup takes over
+        else:
+            assert ring.owner(key) == owners[key]  # nothing else moves
+    ring.add("b")
+    assert all(ring.owner(key) == owners[key] for key in KEYS)
+
+
+def test_replicator(tmp_path):
+    peers = {
+        "a": str(tmp_path / "a.sock"),
+        "b": str(tmp_path / "b.sock"),
+    }
+    node = cluster.Replicator("a", peers, refresh=3600)
+    ipa = next(key for key in KEYS if node.ring.owner(key) == "a")
+    received = []
+
+    async def peer_b(reader, writer):
+        async for line in reader:
+            received.append(json.loads(line))
+
+    async def run():
+        Template(ipa, 0, 300, (8, 4))  # before start, sent on connect
+        server = await asyncio.start_unix_server(peer_b, peers["b"])
+        await node.start()
+        await asyncio.sleep(0.1)
+        Template(ipa, 0, 301, (12, 4))
+        Template(ipa, 0, 301, (12, 4))  # refresh, not sent again yet
+        Collector.unregister(ipa, 0, 300)
+        await asyncio.sleep(0.1)
+        # from a decode worker, while this thread applies a peer's message
+        node.local.applying = True
+        worker = threading.Thread(target=Template, args=(ipa, 0, 302, (1, 4)))
+        worker.start()
+        worker.join()
+        node.local.applying = False
+        await asyncio.sleep(0.1)
+        stats = node.stats()
+        await node.stop()
+        server.close()
+        return stats
+
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    assert [(m["op"], m["path"][-1]) for m in received] == [
+        ("register", 0),
+        ("register", 0),
+        ("remove", 300),
+        ("register", 0),
+    ]
+    tids = [m["template"]["tid"] for m in received if "template" in m]
+    assert tids == [300, 301, 302]
+    assert stats["connected"] == ["b"] and stats["sent"] == 4
+    assert stats["owned"] >= 1
+    Collector.unregister(ipa)
+
+
+def test_apply():
+    node = cluster.Replicator("b", {"a": "/nonexistent", "b": "x:1"})
+    ipa = next(key for key in KEYS if node.ring.owner(key) == "a")
+    Collector.observers.append(node.observe)
+    try:
+        node.apply(
+            {
+                "op": "register",
+                "path": [ipa, 1],
+                "template": {
+                    "class": "Template",
+                    "tid": 256,
+                    "tdata": [8, 4, 12, 4],
+                    "lastwrite": "2020-01-01T00:00:00",
+                },
+            }
+        )
+        template = Collector.get_qualified(ipa, 1, 256)
+        assert template.labels == ("IPV4_SRC_ADDR", "IPV4_DST_ADDR")
+        assert not node.queues["a"]  # applied, not replicated back
+
+        node.apply({"op": "remove", "path": [ipa, 1, 256]})
+        assert Collector.get_qualified(ipa, 1, 256) is None
+        assert node.applied == 2
+    finally:
+        Collector.observers.remove(node.observe)
+        Collector.unregister(ipa)
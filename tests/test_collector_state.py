@@ -8,9 +8,14 @@ __copyright__ = "Tobias Frei"
 __license__ = "mit"
 
 import logging
+import threading
 import time
 
+from collections import deque
 from datetime import datetime
+from datetime import timedelta
+
+import pytest
 
 from flowproc import testasync
 from flowproc.collector_state import AbstractTemplate
@@ -110,3 +115,127 @@ def test_Collector_register_optrec():
     assert Collector.register_optrec("127.0.0.1", 1, rec)
 
     print(Collector.accept(testasync.TreeVisitor()))
+
+
+def test_Collector_unregister(monkeypatch):
+    monkeypatch.setattr(Collector, "children", {})
+    Collector.register("127.0.0.1", 0, T(300))
+    Collector.register("127.0.0.1", 0, T(301))
+    Collector.register("127.0.0.1", 1, T(300))
+
+    assert Collector.unregister("127.0.0.1", 0, 300)
+    assert not Collector.unregister("127.0.0.1", 0, 300)  # gone already
+    assert Collector.get_qualified("127.0.0.1", 0, 301) is not None
+    assert Collector.unregister("127.0.0.1", 1)
+    assert Collector.get_qualified("127.0.0.1", 1) is None
+    with pytest.raises(ValueError):
+        Collector.unregister("127.0.0.1", None, 0)  # not domain 0
+    assert Collector.get_qualified("127.0.0.1", 0) is not None
+    assert Collector.unregister("127.0.0.1")
+    assert Collector.children == {}
+
+
+def test_Collector_expire(monkeypatch):
+    monkeypatch.setattr(Collector, "children", {})
+    old = datetime.utcnow() - timedelta(hours=1)
+
+    Collector.register("127.0.0.1", 0, T(300))
+    Collector.register("127.0.0.1", 0, T(301))
+    Collector.get_qualified("127.0.0.1", 0, 300).lastwrite = old
+    for tid in (400, 401, 402):
+        Collector.register("127.0.0.1", 1, T(tid))
+    Collector.register("8.8.4.4", 0, T(300))
+    Collector.get_qualified("8.8.4.4").lastseen = old
+    Collector.register("8.8.8.8", 0, T(300))
+    Collector.register("8.8.8.8", 1, T(300))
+    Collector.get_qualified("8.8.8.8", 1).lastseen = old
+    assert Collector.touch("8.8.8.8", 0)
+    assert not Collector.touch("8.8.8.8", 2)
+
+    evicted = Collector.expire(template_age=600, idle=600, max_templates=3)
+
+    assert (("127.0.0.1", 0, 300), "template age") in evicted
+    assert (("8.8.4.4",), "exporter idle") in evicted
+    assert (("8.8.8.8", 1), "domain idle") in evicted
+    assert len([e for e in evicted if e[1] == "template limit"]) == 1
+    assert len(evicted) == 4
+    assert Collector.get_qualified("127.0.0.1", 0, 301) is None  # oldest
+    assert Collector.get_qualified("127.0.0.1", 1, 402) is not None
+    assert Collector.get_qualified("8.8.8.8", 0) is not None
+    assert Collector.expire() == []  # no limits, nothing to do
+
+
+def test_Collector_changes(monkeypatch):
+    monkeypatch.setattr(Collector, "children", {})
+    for counter in ("version", "forgotten", "domains", "templates"):
+        monkeypatch.setattr(Collector, counter, 0)
+    monkeypatch.setattr(Collector, "removed", deque(maxlen=2))
+
+    Collector.register("127.0.0.1", 0, T(300))
+    Collector.register("127.0.0.1", 1, T(300))
+    Collector.register("8.8.8.8", 0, T(300))
+    version = Collector.version
+    assert Collector.summary()["templates"] == 3
+
+    # only what changed since shows up
+    Collector.register("127.0.0.1", 1, T(301))
+    assert Collector.register_optrec("127.0.0.1", 1, {"INPUT_SNMP": 1})
+    changes = Collector.accept(testasync.ChangesVisitor(version))
+    assert not changes["full"] and changes["removed"] == []
+    assert list(changes["exporters"]) == ["127.0.0.1"]
+    assert list(changes["exporters"]["127.0.0.1"]) == [1]
+    assert changes["version"] == Collector.version == version + 2
+
+    # refreshed options are no change
+    assert Collector.register_optrec("127.0.0.1", 1, {"INPUT_SNMP": 1})
+    assert Collector.version == version + 2
+
+    version = Collector.version
+    Collector.unregister("127.0.0.1", 1)
+    changes = Collector.accept(testasync.ChangesVisitor(version))
+    assert changes["removed"] == [["127.0.0.1", 1]]
+    assert changes["exporters"] == {}
+    assert Collector.summary()["domains"] == 2
+    assert Collector.summary()["templates"] == 2
+
+    # removals forgotten, full state instead
+    Collector.unregister("8.8.8.8", 0, 300)
+    Collector.unregister("8.8.8.8")
+    changes = Collector.accept(testasync.ChangesVisitor(version))
+    assert changes["full"] and list(changes["exporters"]) == ["127.0.0.1"]
+    assert Collector.summary()["templates"] == 1
+
+    # exporter removed after its last domain, expired one by one likewise
+    Collector.unregister("127.0.0.1", 0)
+    Collector.unregister("127.0.0.1")
+    assert Collector.summary()["templates"] == 0
+    Collector.register("8.8.8.8", 0, T(300))
+    Collector.get_qualified("8.8.8.8", 0).lastseen = datetime(2000, 1, 1)
+    Collector.expire(idle=600)
+    Collector.get_qualified("8.8.8.8").lastseen = datetime(2000, 1, 1)
+    Collector.expire(idle=600)
+    assert Collector.summary()["domains"] == 0
+    assert Collector.summary()["templates"] == 0
+
+
+def test_Collector_locked(monkeypatch):
+    monkeypatch.setattr(Collector, "children", {})
+    Collector.register("127.0.0.1", 0, T(300))
+    Collector.register("8.8.8.8", 0, T(300))
+    Collector.get_qualified("8.8.8.8").lastseen = datetime(2000, 1, 1)
+    removals = [
+        threading.Thread(target=Collector.unregister, args=("127.0.0.1", 0)),
+        threading.Thread(target=Collector.expire, kwargs={"idle": 600}),
+    ]
+
+    with Collector.lock:  # like a decode worker registering
+        for thread in removals:
+            thread.start()
+            thread.join(0.1)
+            assert thread.is_alive()  # waits for registering to finish
+        assert Collector.get_qualified("127.0.0.1", 0) is not None
+        assert Collector.get_qualified("8.8.8.8") is not None
+    for thread in removals:
+        thread.join()
+    assert Collector.get_qualified("127.0.0.1", 0) is None
+    assert Collector.get_qualified("8.8.8.8") is None
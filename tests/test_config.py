@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'config' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import importlib
+import json
+import logging
+
+from collections import namedtuple
+
+import pytest
+
+from flowproc import config
+from flowproc import persist
+from flowproc import v9_parser
+from flowproc.collector_state import Collector
+from flowproc.flowfilter import FilterSyntaxError
+from flowproc.v9_classes import Template
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+Rec = namedtuple("Rec", ["IPV4_SRC_ADDR", "PROTOCOL", "IN_BYTES"])
+
+
+@pytest.fixture
+def parser(monkeypatch):
+    # restore parser globals after each test
+    for name in ("output", "record_filter", "upscale", "joins"):
+        monkeypatch.setattr(v9_parser, name, getattr(v9_parser, name))
+    return v9_parser
+
+
+def test_swap(parser, tmpdir):
+    path = str(tmpdir.join("flowproc.json"))
+    with open(path, "w") as fh:
+        json.dump(
+            {
+                "filter": "proto tcp",
+                "store": str(tmpdir.join("store")),
+                "upscale": True,
+                "joins": False,
+                "aggregate": [
+                    {"name": "bytes", "key": ["PROTOCOL"], "value": "IN_BYTES"}
+                ],
+            },
+            fh,
+        )
+
+    current = config.Config()
+    current.build(parser)
+    current.apply(parser)
+    assert parser.record_filter is None and parser.joins == parser.JOINS
+
+    conf = config.swap(parser, current, config.Config.load(path))
+    assert parser.output is conf.pipeline
+    assert parser.record_filter.expression == "proto tcp"
+    assert parser.upscale and parser.joins == ()
+
+    parser.output("10.0.0.1", [Rec(1, 6, 100), Rec(2, 6, 50)])
+    assert conf.pipeline.table("bytes") == {(6,): 150}
+    conf.close()
+
+
+def test_swap_failing(parser):
+    current = config.Config(filter="udp")
+    current.build(parser)
+    current.apply(parser)
+
+    with pytest.raises(FilterSyntaxError):
+        config.swap(parser, current, config.Config(filter="proto foo"))
+    with pytest.raises(ValueError):
+        config.swap(parser, current, config.Config(aggregate=[{"key": []}]))
+    assert parser.output is current.pipeline
+    assert parser.record_filter is current.record_filter
+
+
+def test_load_unknown(tmpdir):
+    path = str(tmpdir.join("flowproc.json"))
+    with open(path, "w") as fh:
+        json.dump({"fliter": "tcp"}, fh)
+    with pytest.raises(ValueError):
+        config.Config.load(path)
+
+
+def test_rebuild(monkeypatch):
+    monkeypatch.setattr(Collector, "children", {})
+    old = Template("10.0.0.1", 1, 256, (8, 4, 1, 8))
+
+    assert persist.rebuild() == 1
+    new = Collector.get_qualified("10.0.0.1", 1, 256)
+    assert new is not old
+    assert new.labels == old.labels and new.lastwrite == old.lastwrite
+
+
+def test_reload_failing(parser, tmp_path, monkeypatch):
+    # modules to reload, the second failing when executed again
+    (tmp_path / "reload_a.py").write_text("LOADS = []\nLOADS.append(1)\n")
+    (tmp_path / "reload_b.py").write_text(
+        "import os\nif os.environ.get('FAIL'):\n    raise ValueError()\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    modules = [importlib.import_module(n) for n in ("reload_a", "reload_b")]
+    first = modules[0].LOADS
+    rebuilt = []
+    monkeypatch.setattr(persist, "rebuild", lambda: rebuilt.append(1) or 0)
+    monkeypatch.setenv("FAIL", "1")
+    conf = config.Config(filter="tcp")
+    conf.build(parser)
+
+    with pytest.raises(ValueError):
+        config.reload_code(parser, conf, modules[::-1])
+    assert modules[0].LOADS is first  # after the failing one, not reloaded
+
+    with pytest.raises(ValueError):
+        config.reload_code(parser, conf, modules)
+    assert modules[0].LOADS is not first  # reloaded before the failure
+    assert rebuilt == [1, 1]  # templates rebuilt anyway
+    assert parser.output is conf.pipeline  # and config re-applied
+    conf.close()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'control' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import asyncio
+import json
+import logging
+
+from flowproc.control import ControlServer
+from flowproc.control import parse_request
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+def test_parse_request():
+    assert parse_request(b'{"id": 7, "cmd": "ping"}\n') == {
+        "id": 7,
+        "cmd": "ping",
+        "args": [],
+    }
+    assert parse_request(b"setloglevel  10\n") == {
+        "id": None,
+        "cmd": "setloglevel",
+        "args": ["10"],
+    }
+
+
+def test_server(tmpdir):
+    socketpath = str(tmpdir.join("ctrl.sock"))
+
+    async def later(x):
+        await asyncio.sleep(0)
+        return x
+
+    server = ControlServer(
+        {
+            "ping": lambda: "pong",
+            "echo": lambda *args: list(args),
+            "count": lambda n: iter(range(int(n))),
+            "later": later,
+        }
+    )
+
+    async def client():
+        unix_server = await asyncio.start_unix_server(
+            server.handle, socketpath
+        )
+        reader, writer = await asyncio.open_unix_connection(socketpath)
+        requests = [
+            {"id": 1, "cmd": "ping"},
+            {"id": 2, "cmd": "echo", "args": [1, "a"]},
+            {"id": 3, "cmd": "count", "args": [3]},
+            {"id": 4, "cmd": "later", "args": ["x"]},
+            {"id": 5, "cmd": "nope"},
+        ]
+        for request in requests:
+            writer.write((json.dumps(request) + "\n").encode())
+        writer.write(b"ping\n")
+        await writer.drain()
+        lines = [json.loads(await reader.readline()) for _ in range(9)]
+        writer.close()
+        await writer.wait_closed()
+        unix_server.close()
+        await unix_server.wait_closed()
+        await asyncio.sleep(0.1)  # server side closing
+        return lines
+
+    loop = asyncio.new_event_loop()
+    try:
+        lines = loop.run_until_complete(client())
+    finally:
+        loop.close()
+
+    assert lines[0] == {"id": 1, "ok": True, "result": "pong"}
+    assert lines[1]["result"] == [1, "a"]
+    assert [line.get("chunk") for line in lines[2:5]] == [0, 1, 2]
+    assert lines[5] == {"id": 3, "ok": True, "done": True}
+    assert lines[6]["result"] == "x"
+    assert lines[7]["id"] == 5 and not lines[7]["ok"]
+    assert "nope" in lines[7]["error"]
+    assert lines[8] == {"id": None, "ok": True, "result": "pong"}
+    assert server.requests == 6
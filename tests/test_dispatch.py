@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'dispatch' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import struct
+
+import pytest
+
+from flowproc import ipfix_parser
+from flowproc import v5_parser
+from flowproc import v9_parser
+from flowproc.dispatch import Dispatcher
+from flowproc.flowfilter import Filter
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+def v5_packet(*records, sampling=0):
+    header = struct.pack(
+        "!HHIIIIBBH", 5, len(records), 1000, 1571234567, 0, 1, 0, 0, sampling
+    )
+    return header + b"".join(
+        struct.pack(
+            "!IIIHHIIIIHHxBBBHHBBxx",
+            src, 0xC0000202, 0, 1, 2, 10, 1000, 1, 2, sport, 443, 0x1B, 6, 0,
+            0, 0, 24, 24,
+        )
+        for src, sport in records
+    )
+
+
+@pytest.fixture
+def dispatcher():
+    saved = [
+        (m, name, getattr(m, name))
+        for m in (v5_parser, v9_parser)
+        for name in ("output", "record_filter", "upscale", "joins")
+    ]
+    yield Dispatcher()
+    for module, name, value in saved:
+        setattr(module, name, value)
+
+
+def test_routing(dispatcher):
+    batches = []
+    dispatcher.output = lambda ipa, records: batches.append(records)
+    assert v5_parser.output is v9_parser.output is dispatcher.output
+    assert not hasattr(ipfix_parser, "output")  # decoded with V9's
+
+    dispatcher.parse_packet(v5_packet((0xC0000201, 1024)), "192.0.2.20")
+    ipfix = struct.pack("!HHIII", 10, 16, 1571234567, 1, 0)
+    dispatcher.parse_packet(ipfix, "192.0.2.20")
+    dispatcher.parse_packet(struct.pack("!HH", 8, 0), "192.0.2.20")
+    with pytest.raises(struct.error):
+        dispatcher.parse_packet(struct.pack("!HH", 9, 0), "192.0.2.20")
+
+    stats = dispatcher.stats()
+    assert stats["versions"] == {
+        "v5": {"packets": 1, "errors": 0},
+        "v9": {"packets": 1, "errors": 1},
+        "ipfix": {"packets": 1, "errors": 0},
+    }
+    assert stats["unknown"] == 1
+
+    record = batches[0][0]
+    assert record.IPV4_SRC_ADDR == 0xC0000201 and record.L4_DST_PORT == 443
+    assert record.IN_PKTS == 10 and record.IN_BYTES == 1000
+
+
+def test_v5_settings(dispatcher):
+    batches = []
+    dispatcher.output = lambda ipa, records: batches.append(records)
+    dispatcher.record_filter = Filter("src port 1024")
+    dispatcher.upscale = True
+    sampled = v5_packet(
+        (0xC0000201, 1024), (0xC0000203, 1025), sampling=0x4000 | 100
+    )
+    dispatcher.parse_packet(sampled, "192.0.2.20")
+
+    assert [r.IPV4_SRC_ADDR for r in batches[0]] == [0xC0000201]
+    assert batches[0][0].IN_BYTES == 100000
+
+    only = Dispatcher((10,))
+    assert only.modules == [v9_parser]  # IPFIX data settings
+    only.parse_packet(sampled, "192.0.2.20")
+    assert only.stats()["unknown"] == 1
+    assert only.JOINS == v9_parser.JOINS
+    assert Dispatcher((5,)).JOINS == ()  # V5 has no options to join
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'fieldcodecs' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+
+from flowproc import fieldcodecs
+from flowproc import util
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+def test_lengths():
+    # IN_BYTES (8), TOTAL_BYTES_EXP (8), flowStartMilliseconds (8), a 3 byte
+    # and a 16 byte counter
+    types = (1, 40, 152, 2, 85)
+    lengths = (8, 8, 8, 3, 16)
+    codec = fieldcodecs.record_codec(types, lengths)
+    assert codec.reclen == 43
+
+    values = (2 ** 40 + 7, 2 ** 63 + 1, 1571234567890, 2 ** 23 + 5, 2 ** 100)
+    record = b"".join(
+        v.to_bytes(n, "big") for v, n in zip(values, lengths)
+    )
+    assert codec.decode(record * 2 + b"\0\0") == [list(values)] * 2
+
+
+def test_semantics():
+    # IPV6_SRC_ADDR, IN_SRC_MAC, IF_NAME, PROTOCOL
+    codec = fieldcodecs.record_codec((27, 56, 82, 4), (16, 6, 8, 1))
+    record = (
+        (1).to_bytes(16, "big")
+        + bytes.fromhex("00005e0053af")
+        + b"eth0\0\0\0\0"
+        + b"\x06"
+    )
+    assert codec.decode(record) == [[1, "00:00:5e:00:53:af", "eth0", 6]]
+    assert fieldcodecs.record_codec((27,), (16,)) is \
+        fieldcodecs.record_codec((27,), (16,))
+
+
+def test_native_tuples():
+    codec = fieldcodecs.record_codec((8, 7), (4, 2))
+    assert codec.decode(bytes(range(6))) == [(0x00010203, 0x0405)]
+    assert codec.decode(b"") == []
+
+
+def test_util_compat():
+    assert util.ffs(8, ftype=40) == "Q"  # no truncation
+    assert util.vunpack(b"\x01\x00\x00\x00\x00\x00\x00\x00\x02") == 2 ** 64 + 2
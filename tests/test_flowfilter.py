@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'flowfilter' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+
+from ipaddress import ip_address
+
+import pytest
+
+from flowproc.flowfilter import Filter
+from flowproc.flowfilter import FilterSyntaxError
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+LABELS = [
+    "IPV4_SRC_ADDR", "IPV4_DST_ADDR", "L4_SRC_PORT", "L4_DST_PORT", "PROTOCOL"
+]
+
+
+def rec(src, dst, sport, dport, proto):
+    return [int(ip_address(src)), int(ip_address(dst)), sport, dport, proto]
+
+
+HTTPS = rec("10.1.2.3", "1.1.1.1", 40000, 443, 6)
+DNS = rec("10.1.2.3", "8.8.8.8", 40001, 53, 17)
+SSH = rec("192.168.0.1", "10.0.0.1", 22, 50000, 6)
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("proto tcp and dst port 443 and src net 10.0.0.0/8", [HTTPS]),
+        ("tcp", [HTTPS, SSH]),
+        ("proto 17", [DNS]),
+        ("port 22", [SSH]),
+        ("src port 22 or dst port 53", [DNS, SSH]),
+        ("net 10.0.0.0/8 and not (udp || port 443)", [SSH]),
+        ("host 8.8.8.8", [DNS]),
+        ("dst portrange 400-500", [HTTPS]),
+        ("! tcp", [DNS]),
+        ("net 2001:db8::/32", []),
+    ],
+)
+def test_match(expression, expected):
+    keep = Filter(expression).compile(LABELS, index=True)
+    assert [r for r in (HTTPS, DNS, SSH) if keep(r)] == expected
+
+
+def test_layouts():
+    f = Filter("src host 10.1.2.3 and dst port 443")
+    as_dict = dict(zip(LABELS, HTTPS))
+
+    assert f.compile(LABELS)(as_dict)
+    assert f.compile()(as_dict)  # layout unknown
+    assert f.compile(LABELS, index=True) is f.compile(LABELS, index=True)
+
+    # V5 (SiLK-like) labels, port field not selected never matches
+    keep = Filter("src host 10.1.2.3 or port 443").compile(["sIP"], True)
+    assert keep([int(ip_address("10.1.2.3"))])
+    assert not Filter("port 443").compile(["sIP"], True)([0])
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["", "proto", "proto foo", "host 10.0.0.300", "(tcp", "tcp udp", "src"],
+)
+def test_syntax(expression):
+    with pytest.raises(FilterSyntaxError):
+        Filter(expression)
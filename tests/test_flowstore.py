@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'flowstore' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+
+from ipaddress import ip_address
+
+from flowproc.flowstore import BloomFilter
+from flowproc.flowstore import FlowStore
+from flowproc.flowstore import Query
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+def rec(src, dst, sport, dport, proto=6):
+    return {
+        "IPV4_SRC_ADDR": int(ip_address(src)),
+        "IPV4_DST_ADDR": int(ip_address(dst)),
+        "L4_SRC_PORT": sport,
+        "L4_DST_PORT": dport,
+        "PROTOCOL": proto,
+    }
+
+
+def fill(path):
+    store = FlowStore(str(path), rowgroup=2, segsize=4)
+    store.append(
+        "10.1.1.1",
+        [rec("10.0.0.1", "8.8.8.8", 40000, 53, 17)] * 2,
+        ts=1000.0,
+    )
+    store.append(
+        "10.1.1.1",
+        [
+            rec("10.0.0.2", "1.1.1.1", 40001, 443),
+            rec("10.0.0.3", "1.1.1.1", 40002, 443),
+        ],
+        ts=2000.0,
+    )
+    store.append(
+        "10.1.1.2",
+        [rec("192.168.1.1", "9.9.9.9", 40003, 22)],
+        ts=3000.0,
+    )
+    store.close()
+    return store
+
+
+def test_bloom():
+    bloom = BloomFilter.for_capacity(100)
+    for i in range(100):
+        bloom.add(i.to_bytes(4, "big"))
+    assert all(i.to_bytes(4, "big") in bloom for i in range(100))
+    assert BloomFilter.load(bloom.dump()).bits == bloom.bits
+
+
+def test_segments(tmp_path):
+    store = fill(tmp_path)
+    assert len(store.indexes()) == 2  # rolled over after 4 records
+
+    query = Query()
+    assert len(list(store.query(query))) == 5
+    assert query.stats["groups"] == 3
+    assert query.stats["groups_skipped"] == 0
+
+
+def test_prune_time(tmp_path):
+    store = fill(tmp_path)
+
+    query = Query(start=2500)
+    assert len(list(store.query(query))) == 1
+    assert query.stats["files_skipped"] == 1
+    assert query.stats["records_read"] == 1
+
+
+def test_prune_host(tmp_path):
+    store = fill(tmp_path)
+
+    query = Query(host="1.1.1.1")
+    found = list(store.query(query))
+    assert len(found) == 2
+    assert query.stats["groups_skipped"] == 2
+
+    query = Query(host="10.0.0.9")  # within min/max, bloom rules it out
+    assert list(store.query(query)) == []
+    assert query.stats["records_read"] == 0
+
+
+def test_match(tmp_path):
+    store = fill(tmp_path)
+
+    assert len(list(store.query(Query(net="10.0.0.0/30", port=443)))) == 2
+    assert len(list(store.query(Query(proto="udp")))) == 2
+    assert len(list(store.query(Query(exporter="10.1.1.2")))) == 1
+    assert list(store.query(Query(net="2001:db8::/32"))) == []
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'fluent' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+
+import pytest
+
+from flowproc.fluent import Fluent
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+RECORDS = [
+    {"PROTOCOL": 6, "L4_DST_PORT": 443, "IN_BYTES": 100, "SRC": "a"},
+    {"PROTOCOL": 17, "L4_DST_PORT": 53, "IN_BYTES": 60, "SRC": "a"},
+    {"PROTOCOL": 6, "L4_DST_PORT": 22, "IN_BYTES": 40, "SRC": "b"},
+    {"PROTOCOL": 6, "L4_DST_PORT": 443, "IN_BYTES": 10, "SRC": "a"},
+]
+
+
+def test_pipeline():
+    received = []
+    pipeline = (
+        Fluent()
+        .filter(lambda r: r["PROTOCOL"] == 6, name="tcp")
+        .map(dict)  # copy
+        .enrich("KB", lambda r: r["IN_BYTES"] / 1000)
+        .aggregate(
+            "bytes", key=lambda r: r["SRC"], value=lambda r: r["IN_BYTES"]
+        )
+        .sink(lambda exporter, recs: received.append((exporter, recs)))
+        .compile()
+    )
+
+    out = pipeline("10.0.0.1", RECORDS)
+    pipeline("10.0.0.1", RECORDS)
+
+    assert len(out) == 3
+    assert out[0]["KB"] == 0.1
+    assert "KB" not in RECORDS[0]
+    assert pipeline.table("bytes") == {"a": 220, "b": 80}
+    assert len(received) == 2 and received[0][0] == "10.0.0.1"
+
+    stats = pipeline.stats()
+    assert stats["batches"] == 2
+    assert stats["records"] == 8
+    assert stats["stages"][0] == {"stage": "tcp", "in": 8, "out": 6}
+    assert stats["stages"][-1]["in"] == 6
+
+
+def test_chain_is_immutable():
+    base = Fluent().filter(lambda r: r["PROTOCOL"] == 17)
+    base.map(lambda r: None)  # discarded
+
+    assert base.compile()(None, RECORDS) == [RECORDS[1]]
+    assert Fluent().compile()(None, RECORDS) == RECORDS
+
+
+def test_sink_last():
+    with pytest.raises(ValueError):
+        Fluent().sink(print).filter(bool).compile()
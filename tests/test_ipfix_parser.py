@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'ipfix_parser' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import struct
+
+from flowproc import ipfix_parser
+from flowproc import v9_parser
+from flowproc.collector_state import Collector
+from flowproc.v9_classes import OptionsTemplate
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+IPA = "192.0.2.10"
+
+
+def ipfix_set(setid, payload, padding=0):
+    payload += bytes(padding)
+    return struct.pack("!HH", setid, len(payload) + 4) + payload
+
+
+def message(*sets, odid=3):
+    body = b"".join(sets)
+    header = struct.pack("!HHIII", 10, len(body) + 16, 1571234567, 1, odid)
+    return header + body
+
+
+def test_parse(monkeypatch):
+    batches = []
+    monkeypatch.setattr(
+        v9_parser, "output", lambda ipa, records: batches.append(records)
+    )
+    monkeypatch.setattr(v9_parser, "joins", ())
+
+    templates = ipfix_set(
+        2,
+        # tid 256: src addr, dst addr, enterprise field, bytes
+        struct.pack("!HHHHHHHHIHH", 256, 4, 8, 4, 12, 4, 0x8001, 2, 9, 1, 8)
+        # tid 257: with a variable length field
+        + struct.pack("!HHHHHH", 257, 2, 8, 4, 82, 65535),
+        padding=2,
+    )
+    options = ipfix_set(
+        3,
+        # tid 258: scope ingressInterface, option interfaceName
+        struct.pack("!HHHHHHH", 258, 2, 1, 10, 4, 82, 8),
+    )
+    data = ipfix_set(
+        256,
+        struct.pack("!IIHQ", 0xC0000201, 0xC0000202, 7, 1500) * 2,
+        padding=3,
+    )
+    optdata = ipfix_set(258, struct.pack("!I8s", 5, b"eth0"))
+    ipfix_parser.parse_packet(message(templates, options), IPA)
+    ipfix_parser.parse_packet(message(data, optdata), IPA)
+
+    template = Collector.get_qualified(IPA, 3, 256)
+    assert template.tdata == (8, 4, 12, 4, 0x8001, 2, 1, 8)
+    assert Collector.get_qualified(IPA, 3, 257) is None  # skipped
+    assert isinstance(Collector.get_qualified(IPA, 3, 258), OptionsTemplate)
+    domain = Collector.get_qualified(IPA, 3)
+    assert domain.options["interface"][5]["IF_NAME"] == "eth0"
+
+    records = [r for batch in batches for r in batch]
+    assert len(records) == 2
+    assert records[0].IPV4_SRC_ADDR == 0xC0000201
+    assert records[0].IN_BYTES == 1500
+    assert records[0].FIELD_32769 == 7
+
+    # withdrawal of a single template, then of all
+    withdraw = ipfix_set(2, struct.pack("!HH", 256, 0))
+    ipfix_parser.parse_packet(message(withdraw), IPA)
+    assert Collector.get_qualified(IPA, 3, 256) is None
+    withdraw = ipfix_set(3, struct.pack("!HH", 3, 0))
+    ipfix_parser.parse_packet(message(withdraw), IPA)
+    assert not Collector.get_qualified(IPA, 3).children
+    Collector.unregister(IPA)
+
+
+def test_bad_set_length():
+    packets = Collector.packets
+    bad = message(struct.pack("!HH", 256, 2))  # shorter than a set header
+    ipfix_parser.parse_packet(bad, IPA)
+    assert Collector.packets == packets + 1
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'loadgen' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import socket
+import struct
+
+import pytest
+
+from flowproc import ipfix_parser
+from flowproc import loadgen
+from flowproc import relay
+from flowproc import v5_parser
+from flowproc import v9_parser
+from flowproc.collector_state import Collector
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+PREFIX = loadgen.PREFIX
+
+
+def generated(gen, count):
+    return [
+        (ipa, bytes(buf[PREFIX:]))
+        for ipa, buf in gen.packets(count, start=1571234567)
+    ]
+
+
+@pytest.fixture
+def records(monkeypatch):
+    batches = []
+
+    def output(ipa, records):
+        batches.append(records)
+
+    monkeypatch.setattr(v5_parser, "output", output)
+    monkeypatch.setattr(v9_parser, "output", output)
+    monkeypatch.setattr(v9_parser, "joins", ())
+    return batches
+
+
+def test_parse_fields():
+    assert loadgen.parse_fields("8:4,7:2") == ((8, 4), (7, 2))
+    for spec in ("", "8", "8:0", "8:4,x:2"):
+        with pytest.raises(ValueError):
+            loadgen.parse_fields(spec)
+
+
+def test_v9(records):
+    gen = loadgen.Generator(
+        9, exporters=2, domains=2, records=5, rate=100, template_interval=0.1
+    )
+    packets = generated(gen, 20)
+    # templates for 4 streams at 0 s and again after 0.1 s (packet 10)
+    assert len(packets) == 20 + 8
+    assert gen.exporters() == ["127.0.0.1", "127.0.0.2"]
+    for ipa, datagram in packets:
+        v9_parser.parse_packet(datagram, ipa)
+    template = Collector.get_qualified("127.0.0.2", 1, loadgen.TEMPLATE_ID)
+    fields = loadgen.parse_fields(loadgen.FIELDS)
+    assert template.tdata == tuple(n for field in fields for n in field)
+    assert sum(len(batch) for batch in records) == 20 * 5
+    record = records[0][0]
+    assert record.IPV4_SRC_ADDR >> 24 == 10
+    assert record.PROTOCOL in (1, 6, 17)
+
+    # V9 counts packets, templates included
+    seqs = [struct.unpack("!I", d[12:16])[0] for ipa, d in packets[:8]]
+    assert seqs == [0, 1] * 4  # template, data per stream
+    Collector.unregister("127.0.0.1")
+    Collector.unregister("127.0.0.2")
+
+
+def test_records(records):
+    # more records per packet than `loadgen.POOL` generated by default
+    gen = loadgen.Generator(9, records=100, fields="8:4,12:4")
+    packets = generated(gen, 70)  # windows start at all records
+    assert len({len(datagram) for _, datagram in packets[1:]}) == 1
+    for ipa, datagram in packets:
+        v9_parser.parse_packet(datagram, ipa)
+    assert [len(batch) for batch in records] == [100] * 70
+    Collector.unregister("127.0.0.1")
+
+
+def test_ipfix_gaps(records):
+    gen = loadgen.Generator(10, records=4, gap_every=3, gap=2, base="::1")
+    packets = generated(gen, 6)
+    for ipa, datagram in packets:
+        assert struct.unpack("!H", datagram[2:4])[0] == len(datagram)
+        ipfix_parser.parse_packet(datagram, ipa)
+    assert sum(len(batch) for batch in records) == 6 * 4
+    # IPFIX counts data records, 2 packets missing every 3rd
+    seqs = [struct.unpack("!I", d[8:12])[0] for ipa, d in packets[1:]]
+    assert seqs == [0, 4, 16, 20, 24, 36]
+    Collector.unregister("::1")
+
+
+def test_v5(records):
+    gen = loadgen.Generator(5, domains=2, records=30)
+    packets = generated(gen, 4)
+    assert len(packets) == 4  # no templates
+    for ipa, datagram in packets:
+        v5_parser.parse_packet(datagram, ipa)
+    assert sum(len(batch) for batch in records) == 4 * 30
+    assert records[0][0].L4_DST_PORT in (53, 80, 123, 443)
+    with pytest.raises(ValueError):
+        loadgen.Generator(5, records=31)
+
+
+def test_write(tmp_path):
+    path = str(tmp_path / "capture")
+    gen = loadgen.Generator(9, records=3)
+    gen.write(path, 10)
+    assert gen.stats()["packets"] == 11
+    with open(path, "rb") as fh:
+        v9_parser.parse_file(fh, "192.0.2.1", templates_only=True)
+    assert Collector.get_qualified("192.0.2.1", 0, loadgen.TEMPLATE_ID)
+    Collector.unregister("192.0.2.1")
+
+    gen = loadgen.Generator(9, exporters=3)
+    gen.write(str(tmp_path / "captures"), 3)
+    assert (tmp_path / "captures" / "127.0.0.3" / "loadgen.cap").exists()
+
+
+def test_send():
+    sock = relay.listen("127.0.0.1", 0)
+    sock.settimeout(1)
+    dest = sock.getsockname()
+    received = []
+    try:
+        gen = loadgen.Generator(9, exporters=2, rate=1000)
+        gen.send(dest, 4)
+        gen = loadgen.Generator(10, exporters=2, base="192.0.2.1")
+        gen.send(dest, 2, wrap=True)
+        for _ in range(6 + 4):
+            datagram, addr = sock.recvfrom(65535)
+            received.append(relay.unwrap(datagram, addr[0], {addr[0]}))
+    except socket.timeout:
+        pass
+    finally:
+        sock.close()
+    assert gen.stats()["errors"] == 0
+    assert {ipa for _, ipa in received} == {
+        "127.0.0.1",
+        "127.0.0.2",
+        "192.0.2.1",
+        "192.0.2.2",
+    }
+    assert len(received) == 10
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'logqueue' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+
+from flowproc import logqueue
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+class ListHandler(logging.Handler):
+    """
+    Helper handler keeping formatted messages
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter(logqueue.FORMAT))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def test_queue():
+    target = logging.getLogger("test_logqueue")
+    target.propagate = False
+    handler = ListHandler()
+    listener = logqueue.start([handler], target, rate_limit=60)
+
+    logqueue.EXPORTER.set("192.0.2.1")
+    for i in range(5):
+        target.warning("Record account not balanced %d/%d", i, 5)
+    target.info("Parsed %s", (9, 5))
+    logqueue.EXPORTER.set("192.0.2.2")
+    target.error("Cannot process header version %s", 8)
+    target.warning("Record account not balanced %d/%d", 0, 5)  # limited
+    listener.stop()  # flushes
+
+    assert len(handler.lines) == 3
+    assert "[192.0.2.1]: Record account not balanced 0/5" in handler.lines[0]
+    assert handler.lines[1].endswith("Parsed (9, 5)")
+    assert "[192.0.2.2]: Cannot process header version 8" in handler.lines[2]
+
+
+def test_rate_limit():
+    limit = logqueue.RateLimitFilter(interval=10)
+
+    def record(created, msg="Out of seq, lost %d", args=(1,)):
+        rec = logging.LogRecord(
+            "x", logging.WARNING, __file__, 1, msg, args, None
+        )
+        rec.created = created
+        return rec
+
+    assert limit.filter(record(100.0))
+    assert not limit.filter(record(101.0))
+    assert not limit.filter(record(109.0))
+    assert limit.filter(record(100.5, "Discarding templates", ()))
+
+    passing = record(110.0, args=(7,))
+    assert limit.filter(passing)
+    assert passing.getMessage() == "Out of seq, lost 7 (2 similar suppressed)"
+
+    info = logging.LogRecord("x", logging.INFO, __file__, 1, "a", (), None)
+    assert limit.filter(info) and limit.filter(info)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'netflowV5_lab' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import re
+import struct
+
+from flowproc.netflowV5_lab import Collector
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+IPA = "192.0.2.5"
+FIELDS = ["sIP", "packets", "bytes"]
+
+
+def packet(sampling, engine_id=1):
+    header = struct.pack(
+        "!HHIIIIBBH", 5, 1, 60000, 1571234567, 0, 1, 0, engine_id, sampling
+    )
+    record = struct.pack(
+        "!IIIHHIIIIHHxBBBHHBBxx",
+        0xC0000201,
+        0xC0000202,
+        0,
+        1,
+        2,
+        3,  # dPkts
+        1500,  # dOctets
+        50000,
+        59000,
+        51234,
+        443,
+        0x18,
+        6,
+        0,
+        0,
+        0,
+        24,
+        24,
+    )
+    return header + record
+
+
+def counters(capsys):
+    out = capsys.readouterr().out
+    return [
+        (int(p), int(b))
+        for p, b in re.findall(r"packets=(\d+), bytes=(\d+)", out)
+    ]
+
+
+def test_upscale(capsys, caplog):
+    caplog.set_level(logging.INFO)
+    collector = Collector(FIELDS, upscale=True)
+
+    # mode 1 in the upper 2 bits, interval 100
+    collector.collect(IPA, packet(0x4000 | 100))
+    assert counters(capsys) == [(300, 150000)]
+    collector.collect(IPA, packet(0))  # not sampled
+    assert counters(capsys) == [(3, 1500)]
+    collector.collect(IPA, packet(0))
+    assert counters(capsys) == [(3, 1500)]
+
+    # logged when changing only, per exporter and engine
+    changes = [r.getMessage() for r in caplog.records if "Sampling" in r.msg]
+    assert changes == [
+        "Sampling interval 100 (mode 1) for ('192.0.2.5', 1)",
+        "Sampling interval 0 (mode 0) for ('192.0.2.5', 1)",
+    ]
+    assert collector.sampling == {(IPA, 1): 0}
+
+
+def test_no_upscale(capsys):
+    collector = Collector(FIELDS)
+    collector.collect(IPA, packet(0x4000 | 100))
+    assert counters(capsys) == [(3, 1500)]
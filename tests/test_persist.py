@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'persist' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import json
+import logging
+
+from datetime import datetime
+from datetime import timedelta
+
+from flowproc import persist
+from flowproc.collector_state import Collector
+from flowproc.v9_classes import OptionsTemplate
+from flowproc.v9_classes import Template
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+def test_save_restore(tmp_path):
+    path = str(tmp_path / "state.json")
+    Template("192.0.2.1", 0, 256, (8, 4, 12, 4))
+    old = Template("192.0.2.1", 0, 257, (1, 4))
+    old.lastwrite = datetime.utcnow() - timedelta(hours=1)
+    OptionsTemplate("192.0.2.1", 1, 258, (1, 4), (82, 16))
+
+    assert persist.save(path) >= 3
+    with open(path) as fh:
+        assert json.load(fh)["exporters"]["192.0.2.1"]["1"][0]["tid"] == 258
+
+    # simulate a restart
+    del Collector.children["192.0.2.1"]
+    assert persist.restore(path, maxage=600) == 2
+
+    template = Collector.get_qualified("192.0.2.1", 0, 256)
+    assert template.tdata == (8, 4, 12, 4)
+    assert datetime.utcnow() - template.lastwrite < timedelta(minutes=1)
+    assert Collector.get_qualified("192.0.2.1", 0, 257) is None  # too old
+    assert Collector.get_qualified("192.0.2.1", 1, 258).options == (82, 16)
+
+
+def test_restore_missing(tmp_path):
+    assert persist.restore(str(tmp_path / "nothing.json"), maxage=1) == 0
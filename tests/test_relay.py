@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'relay' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import socket
+import struct
+import threading
+
+import pytest
+
+from flowproc import relay
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+EXPORTERS = ["192.0.2.{:d}".format(i) for i in range(1, 21)]
+RELAYS = ("127.0.0.1",)
+
+
+@pytest.fixture
+def collectors():
+    socks = []
+    for _ in range(3):
+        sock = relay.listen("127.0.0.1", 0)
+        sock.settimeout(1)
+        socks.append(sock)
+    yield socks
+    for sock in socks:
+        sock.close()
+
+
+def received(sock):
+    sock.settimeout(0.2)
+    result = []
+    try:
+        while True:
+            datagram, addr = sock.recvfrom(65535)
+            result.append(relay.unwrap(datagram, addr[0], RELAYS))
+    except socket.timeout:
+        return result
+
+
+def packet(version, seq):
+    return struct.pack("!HHI", version, 0, seq)
+
+
+def test_wrap():
+    datagram = packet(9, 1)
+    trusted = {"198.51.100.1"}
+    assert relay.unwrap(datagram, "198.51.100.1", trusted) == (
+        datagram,
+        "198.51.100.1",
+    )
+    for ipa in ("192.0.2.1", "2001:db8::1"):
+        wrapped = relay.wrap(datagram, ipa)
+        assert relay.unwrap(wrapped, "198.51.100.1", trusted) == (
+            datagram,
+            ipa,
+        )
+        # anyone else can't pose as exporter ipa
+        assert relay.unwrap(wrapped, "198.51.100.2", trusted) == (
+            wrapped,
+            "198.51.100.2",
+        )
+        assert relay.unwrap(wrapped, "198.51.100.1")[1] == "198.51.100.1"
+    assert relay.parse_source("2001:DB8::1") == "2001:db8::1"
+    assert relay.parse_destination("[::1]:2055") == ("::1", 2055)
+    with pytest.raises(ValueError):
+        relay.parse_destination("localhost")
+
+
+def test_forward(collectors):
+    primary, dup = collectors[:2], collectors[2:]
+    fwd = relay.Relay(
+        [s.getsockname() for s in primary],
+        [s.getsockname() for s in dup],
+        pool=2,
+        batch=8,
+    )
+    for seq in range(3):
+        for ipa in EXPORTERS:
+            fwd.forward(packet(9 if seq else 10, seq), ipa)
+    fwd.forward(packet(18000, 0), EXPORTERS[0])  # no such version
+    fwd.close()
+
+    got = [received(sock) for sock in collectors]
+    exporters = [{ipa for _, ipa in g} for g in got]
+    assert exporters[0] and exporters[1]
+    assert not exporters[0] & exporters[1]  # each owned by one
+    assert exporters[0] | exporters[1] == exporters[2] == set(EXPORTERS)
+    for ipa in EXPORTERS:
+        seqs = [
+            struct.unpack("!HHI", d)[2] for d, i in got[2] if i == ipa
+        ]
+        assert seqs == [0, 1, 2]  # in order
+
+    stats = fwd.stats()
+    assert stats["received"] == 61 and stats["dropped"] == 1
+    assert stats["versions"] == {9: 40, 10: 20}
+    assert sum(stats["forwarded"].values()) == 60
+    assert sum(stats["duplicated"].values()) == 60
+
+
+def test_serve(collectors):
+    downstream = collectors[0]
+    fwd = relay.Relay([downstream.getsockname()], raw=True, trusted=RELAYS)
+    sock = relay.listen("127.0.0.1", 0)
+    stop = threading.Event()
+    thread = threading.Thread(target=fwd.serve, args=(sock, stop))
+    thread.start()
+
+    exporter = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for seq in range(5):
+        exporter.sendto(packet(5, seq), sock.getsockname())
+    exporter.sendto(relay.wrap(packet(9, 5), "192.0.2.7"), sock.getsockname())
+    got = received(downstream)
+    stop.set()
+    thread.join()
+    exporter.close()
+    sock.close()
+    fwd.close()
+
+    assert [d for d, _ in got] == [packet(5, s) for s in range(5)] + [
+        packet(9, 5)
+    ]
+    assert fwd.stats()["received"] == 6
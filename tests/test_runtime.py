@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'runtime' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import asyncio
+import logging
+
+import pytest
+
+from flowproc import runtime
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+async def answer():
+    await asyncio.sleep(0)
+    return asyncio.get_running_loop()
+
+
+@pytest.mark.parametrize("name", runtime.available() + ["auto"])
+def test_run(name):
+    loop = runtime.run(answer(), name)
+    assert loop.is_closed()
+    if runtime.loop_factory(name):
+        assert type(loop).__module__.startswith("uvloop")
+
+
+def test_unknown():
+    with pytest.raises(ValueError):
+        runtime.loop_factory("trio")
+    if runtime.uvloop is None:
+        coro = answer()
+        with pytest.raises(ValueError):
+            runtime.run(coro, "uvloop")
+        assert coro.cr_frame is None  # closed, no never awaited warning
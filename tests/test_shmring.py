@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'shmring' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import multiprocessing
+
+import pytest
+
+from flowproc import shmring
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+COUNT = 5000
+
+
+@pytest.fixture
+def ring():
+    ring = shmring.Ring(size=1024)
+    yield ring
+    ring.close()
+
+
+def test_put_get(ring):
+    assert ring.get() is None
+    assert ring.put(b"\x00\x09abc", "192.0.2.1", 1.5)
+    assert ring.put(b"", "2001:db8::1", 2.5)
+    assert len(ring) == 32 + 32  # aligned entries
+    assert ring.get() == (b"\x00\x09abc", "192.0.2.1", 1.5)
+    assert ring.get() == (b"", "2001:db8::1", 2.5)
+    assert ring.get() is None
+    assert not len(ring)
+
+
+def test_wrap_and_full(ring):
+    datagram = bytes(range(200))
+    for i in range(20):  # wraps around several times
+        assert ring.put(datagram, "192.0.2.1", i)
+        assert ring.put(datagram, "192.0.2.2", i)
+        assert ring.get() == (datagram, "192.0.2.1", i)
+        assert ring.get() == (datagram, "192.0.2.2", i)
+
+    while ring.put(datagram, "192.0.2.1"):
+        pass
+    stats = ring.stats()
+    assert stats["drops"] == 1
+    assert stats["puts"] == stats["gets"] + 4
+    assert stats["fill"] > 0.8
+    assert stats["highwater"] <= ring.size
+    assert len(ring.get_batch(10)) == 4
+    assert not ring.put(bytes(2000), "192.0.2.1")  # never fits
+
+
+def produce(ring):
+    for i in range(COUNT):
+        datagram = i.to_bytes(4, "big") * (i % 50)
+        while not ring.put(datagram, "192.0.2.{:d}".format(i % 7), i):
+            pass  # spin until the consumer made room
+    ring.close_input()
+    ring.close()
+
+
+def test_processes():
+    ring = shmring.Ring(size=4096)
+    producer = multiprocessing.Process(target=produce, args=(ring,))
+    producer.start()
+    received = []
+    ring.consume(lambda *entry: received.append(entry))
+    producer.join()
+    assert producer.exitcode == 0
+    assert len(received) == COUNT
+    for i, (datagram, ipa, ts) in enumerate(received):
+        assert ts == i
+        assert ipa == "192.0.2.{:d}".format(i % 7)
+        assert datagram == i.to_bytes(4, "big") * (i % 50)
+    stats = ring.stats()
+    assert stats["gets"] == COUNT and stats["used"] == 0
+    ring.close()
+
+
+def test_unsupported(monkeypatch):
+    monkeypatch.setattr(shmring.platform, "machine", lambda: "aarch64")
+    assert not shmring.supported()
+    with pytest.raises(RuntimeError):
+        shmring.Ring(size=1024)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'spill' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import logging
+import os
+
+import pytest
+
+from flowproc import spill
+from flowproc.stages import BoundedQueue
+from flowproc.v9_classes import record_type
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+def segments(path):
+    return sorted(n for n in os.listdir(path) if n.endswith(".seg"))
+
+
+def test_fifo(tmpdir):
+    path = str(tmpdir.join("spill"))
+    queue = spill.DiskQueue(path, segsize=64)
+    for i in range(10):
+        queue.put(("x" * 5, i))  # 2 entries per segment
+    queue.put("y" * 100)  # larger than a segment
+
+    assert len(queue) == 11
+    assert len(segments(path)) == 6
+    assert [queue.get()[1] for _ in range(7)] == list(range(7))
+    assert len(segments(path)) == 3  # read ones removed
+    queue.close()
+
+    # restart resumes at checkpoint
+    queue = spill.DiskQueue(path, segsize=64)
+    assert len(queue) == 4
+    queue.put("z")
+    assert [queue.get() for _ in range(5)][3:] == ["y" * 100, "z"]
+    with pytest.raises(IndexError):
+        queue.get()
+    queue.close()
+
+
+def test_at_least_once(tmpdir):
+    path = str(tmpdir.join("spill"))
+    queue = spill.DiskQueue(path, segsize=4096, checkpoint_every=2)
+    for i in range(5):
+        queue.put(i)
+    assert [queue.get() for _ in range(3)] == [0, 1, 2]
+    # no close, as if crashed: redelivered since checkpoint after 2 reads
+    queue = spill.DiskQueue(path, segsize=4096, checkpoint_every=2)
+    assert [queue.get() for _ in range(len(queue))] == [2, 3, 4]
+
+
+def test_batches(tmpdir):
+    Record = record_type(("IPV4_SRC_ADDR", "IN_BYTES"))
+    batch = ("192.0.2.1", [Record(167772161, 100), Record(167772162, 50)])
+
+    queue = BoundedQueue(
+        "sink",
+        1,
+        "spill",
+        spill.DiskQueue(
+            str(tmpdir), 4096, spill.dump_batch, spill.load_batch
+        ),
+    )
+    queue.put(batch)
+    queue.put(batch)  # spilled
+    queue.put(("192.0.2.2", []))
+
+    assert queue.stats()["spill"]["items"] == 2
+    assert queue.get_nowait() == batch
+    ipa, records = queue.get_nowait()
+    assert ipa == "192.0.2.1" and records == batch[1]
+    assert type(records[0]) is Record
+    assert queue.get_nowait() == ("192.0.2.2", [])
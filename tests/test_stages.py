@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for 'stages' module
+"""
+
+__author__ = "Tobias Frei"
+__copyright__ = "Tobias Frei"
+__license__ = "mit"
+
+import asyncio
+import logging
+import threading
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from flowproc.stages import BoundedQueue
+from flowproc.stages import Stages
+
+# globals
+logger = logging.getLogger().setLevel(logging.DEBUG)
+
+
+@pytest.mark.parametrize(
+    "policy, kept",
+    [("drop_newest", [0, 1, 2]), ("drop_oldest", [2, 3, 4])],
+)
+def test_policies(policy, kept):
+    queue = BoundedQueue("q", 3, policy)
+    results = [queue.put(i) for i in range(5)]
+
+    assert results == [True] * 3 + [policy == "drop_oldest"] * 2
+    assert [queue.get_nowait() for _ in range(len(queue))] == kept
+    stats = queue.stats()
+    assert stats["dropped"] == 2 and stats["maxdepth"] == 3
+    assert stats["depth"] == 0 and stats["dequeued"] == 3
+    with pytest.raises(IndexError):
+        queue.get_nowait()
+
+
+def test_spill():
+    spill = BoundedQueue("spill", 100)  # anything with put, get and len
+    spill.get = spill.get_nowait
+    queue = BoundedQueue("q", 2, "spill", spill)
+    for i in range(4):
+        queue.put(i)
+    queue.get_nowait()
+    queue.put(4)  # after the spilled ones, order kept
+
+    assert len(queue) == 4 and queue.stats()["spilled"] == 3
+    assert [queue.get_nowait() for _ in range(4)] == [1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        BoundedQueue("q", 2, "spill")
+
+
+def test_stages():
+    received = []
+
+    def slow_output(ipa, records):
+        time.sleep(0.01)  # stalling sink, in the sink thread
+        received.append((ipa, records))
+
+    parser = SimpleNamespace(output=slow_output)
+    parser.parse_packet = lambda datagram, ipa: parser.output(
+        ipa, [datagram]
+    )
+    stages = Stages(
+        parser, BoundedQueue("decode", 100), BoundedQueue("sink", 5)
+    )
+    closed = []
+
+    async def run():
+        stages.attach()
+        stages.start()
+        for i in range(20):
+            stages.receive(i, "192.0.2.1")
+        await asyncio.sleep(0.05)
+        stages.retire(lambda: closed.append(stages.busy))
+        stages.receive(99, "192.0.2.1")
+        await stages.drain()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    decode, sink = stages.stats()
+    assert decode["enqueued"] == decode["dequeued"] == 21
+    assert sink["dropped"] > 0  # where we chose to lose data
+    assert len(received) == 21 - sink["dropped"]
+    assert received[-1] == ("192.0.2.1", [99])
+    assert closed == [False]  # not while output ran
+
+
+def test_drain():
+    received = []
+
+    def parse_packet(datagram, ipa):
+        if datagram is None:
+            raise ValueError("malformed")
+        parser.output(ipa, [datagram])
+
+    parser = SimpleNamespace(output=lambda ipa, records: received.append(
+        records[0]
+    ))
+    parser.parse_packet = parse_packet
+    stages = Stages(
+        parser, BoundedQueue("decode", 100), BoundedQueue("sink", 5)
+    )
+
+    async def run():
+        stages.attach()
+        for i in range(50):  # queued, not decoded before shutdown
+            stages.receive(None if i == 10 else i, "192.0.2.1")
+        await stages.drain()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    # all but the malformed one, none dropped by the small sink queue
+    assert received == [i for i in range(50) if i != 10]
+    assert stages.sink_queue.stats()["dropped"] == 0
+
+
+def test_decode_workers():
+    received = []
+    threads = {}
+
+    def parse_packet(datagram, ipa):
+        threads.setdefault(ipa, set()).add(threading.get_ident())
+        parser.output(ipa, [datagram])
+
+    parser = SimpleNamespace(output=lambda ipa, records: received.append(
+        (ipa, records[0])
+    ))
+    parser.parse_packet = parse_packet
+    stages = Stages(
+        parser, BoundedQueue("decode", 1000), BoundedQueue("sink", 1000), 3
+    )
+    exporters = ["192.0.2.{:d}".format(i) for i in range(8)]
+
+    async def run():
+        stages.attach()
+        stages.start()
+        for i in range(200):
+            stages.receive(i, exporters[i % 8])
+        await asyncio.sleep(0.1)
+        await stages.drain()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    assert len(received) == 200
+    for ipa in exporters:
+        seq = [i for exporter, i in received if exporter == ipa]
+        assert seq == sorted(seq)  # in order per exporter
+        assert len(threads[ipa]) == 1  # in the same worker
+        assert threading.get_ident() not in threads[ipa]
@@ -9,6 +9,8 @@ __license__ = "mit"
 
 import logging
 
+from collections import namedtuple
+
 from flowproc import util
 
 # globals
@@ -32,7 +34,30 @@ def test_tcpflags():
 
 def test_proto():
     assert util.PROTO[132] == "SCTP"
+    assert util.proto_to_num("sctp") == 132
+    assert util.proto_to_num("IPv6-ICMP") == 58
+    assert util.proto_to_num("nonsense") is None
 
 
 def test_to_icmptc():
     assert util.dstport_to_icmptc(769) == (3, 1,)  # host unreachable
+
+
+def test_addresses_to_str():
+    assert util.ipv4_to_str(2130706433) == "127.0.0.1"
+    assert util.ipv4_to_str(b"\x0a\x00\x00\x01") == "10.0.0.1"
+    assert util.ipv6_to_str(1) == "0000:0000:0000:0000:0000:0000:0000:0001"
+    assert util.addresses_to_str([1, 2]) == ["0.0.0.1", "0.0.0.2"]
+    assert util.packed_to_str(bytes(range(8))) == ["0.1.2.3", "4.5.6.7"]
+    assert util.packed_to_str(bytes(16), width=16) == [
+        util.ipv6_to_str(0)
+    ]
+
+
+def test_render_addresses():
+    Rec = namedtuple("Rec", ["IPV4_SRC_ADDR", "IPV6_DST_ADDR", "IN_BYTES"])
+    rendered = util.render_addresses([Rec(1, 1, 1), Rec(2, 2, 2)])
+    assert rendered[1] == Rec("0.0.0.2", util.ipv6_to_str(2), 2)
+
+    rendered = util.render_addresses([{"IPV4_DST_ADDR": 3, "IN_BYTES": 1}])
+    assert rendered == [{"IPV4_DST_ADDR": "0.0.0.3", "IN_BYTES": 1}]
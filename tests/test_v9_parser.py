@@ -9,10 +9,13 @@ __license__ = "mit"
 
 import io
 import logging
+import struct
 
 # import pytest
 
+from flowproc import util
 from flowproc import v9_parser
+from flowproc.collector_state import Collector
 
 logging.getLogger().setLevel(logging.DEBUG)
 
@@ -35,3 +38,90 @@ def test_v9_parse_Template():
 def test_v9_parse_Packets():
     for p in packets:
         v9_parser.parse_file(io.BytesIO(bytes.fromhex(p)), "0.0.0.0")
+
+
+def test_v9_records(monkeypatch):
+    batches = []
+    monkeypatch.setattr(
+        v9_parser, "output", lambda ipa, records: batches.append(records)
+    )
+    v9_parser.parse_file(io.BytesIO(bytes.fromhex(template_packet)), "0.0.0.0")
+
+    template = Collector.get_qualified("0.0.0.0", 0, 1024)
+    assert template.reclen == 40 == template.offsets[-1]
+    assert template.labels[:2] == ("IPV4_SRC_ADDR", "IPV4_DST_ADDR")
+    assert not hasattr(template, "__dict__")
+
+    records = [r for batch in batches for r in batch]
+    assert len(records) == 8
+    assert records[0]._fields[:14] == template.Record._fields
+    assert records[0].IN_IF_NAME is None  # no options known
+    assert records[0].IPV4_SRC_ADDR == 2130706433  # rendered by sinks only
+    assert util.render_addresses(records)[0].IPV4_SRC_ADDR == "127.0.0.1"
+    assert records[0].L4_DST_PORT == 37932
+
+
+def flowset(setid, payload):
+    payload += bytes(-len(payload) % 4)  # padding
+    return struct.pack("!HH", setid, len(payload) + 4) + payload
+
+
+def packet(seq, *flowsets, odid=7):
+    return struct.pack("!HHIIII", 9, 0, 1000, 1571234567, seq, odid) + \
+        b"".join(flowsets)
+
+
+def test_v9_options_join(monkeypatch):
+    batches = []
+    monkeypatch.setattr(
+        v9_parser, "output", lambda ipa, records: batches.append(records)
+    )
+    ipa = "192.0.2.9"
+
+    # options template 300: scope System (4), INPUT_SNMP (2), IF_NAME (8)
+    # options template 301: scope System (4), FLOW_SAMPLER_ID (1),
+    #                       FLOW_SAMPLER_RANDOM_INTERVAL (4)
+    # template 400: INPUT_SNMP (2), FLOW_SAMPLER_ID (1), IN_BYTES (8)
+    templates = packet(
+        1,
+        flowset(
+            1,
+            struct.pack("!HHHHHHHHH", 300, 4, 8, 1, 4, 10, 2, 82, 8)
+            + struct.pack("!HHHHHHHHH", 301, 4, 8, 1, 4, 48, 1, 50, 4),
+        ),
+        flowset(0, struct.pack("!HHHHHHHH", 400, 3, 10, 2, 48, 1, 1, 8)),
+    )
+    options = packet(
+        2,
+        flowset(300, struct.pack("!IH8s", 0, 3, b"Gi0/1") * 2),
+        flowset(301, struct.pack("!IBI", 0, 5, 100)),
+    )
+    data = packet(
+        3,
+        flowset(400, struct.pack("!HBQ", 3, 5, 2 ** 40)
+                + struct.pack("!HBQ", 4, 6, 1)),
+    )
+    for p in (templates, options, data):
+        v9_parser.parse_packet(p, ipa)
+
+    domain = Collector.get_qualified(ipa, 7)
+    assert domain.options["interface"][3]["IF_NAME"] == "Gi0/1"
+    assert domain.options["sampler"][5]["FLOW_SAMPLER_RANDOM_INTERVAL"] == 100
+
+    first, second = batches[-1]
+    assert first.IN_BYTES == 2 ** 40
+    assert first.IN_IF_NAME == "Gi0/1"
+    assert first.SAMPLING_RATE == 100
+    assert second.IN_IF_NAME is None and second.SAMPLING_RATE is None
+
+    monkeypatch.setattr(v9_parser, "joins", ())
+    v9_parser.parse_packet(data, ipa)
+    assert batches[-1][0]._fields == ("INPUT_SNMP", "FLOW_SAMPLER_ID",
+                                      "IN_BYTES")
+
+    # counters upscaled by sampler, unknown sampler 6 is taken as unsampled
+    assert domain.sampling_rate(5) == 100
+    assert domain.sampling_rate(6) == domain.sampling_rate() == 1
+    monkeypatch.setattr(v9_parser, "upscale", True)
+    v9_parser.parse_packet(data, ipa)
+    assert [r.IN_BYTES for r in batches[-1]] == [100 * 2 ** 40, 1]